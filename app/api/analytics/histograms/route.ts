@@ -1,6 +1,25 @@
 export const dynamic = "force-dynamic";
 import { NextRequest, NextResponse } from 'next/server';
-import { query } from '@/lib/database';
+import { cachedQuery, monthSplit } from '@/lib/database';
+
+function histogramSql(metric: 'distance' | 'duration') {
+  const range = monthSplit('day');
+  return `
+    SELECT bin as ${metric}_bin, SUM(trip_count) as count
+    FROM (
+      SELECT bin, trip_count
+      FROM dashboard_monthly_histograms
+      WHERE metric = '${metric}' AND ${range.months}
+      UNION ALL
+      SELECT bin, trip_count
+      FROM trip_rollup_histograms_daily
+      WHERE metric = '${metric}'
+        AND ${range.edges('stat_date')}
+    ) h
+    GROUP BY bin
+    ORDER BY ${metric}_bin ASC
+  `;
+}
 
 export async function GET(request: NextRequest) {
   try {
@@ -12,25 +31,13 @@ export async function GET(request: NextRequest) {
       return NextResponse.json({ error: 'Start date and end date are required' }, { status: 400 });
     }
 
-    // Histogram for trip distance (bin size: 1 mile)
-    const distanceSql = `
-      SELECT FLOOR(trip_distance) as distance_bin, COUNT(*) as count
-      FROM taxi_trips
-      WHERE pickup_datetime >= $1 AND pickup_datetime <= $2
-      GROUP BY distance_bin
-      ORDER BY distance_bin ASC
-    `;
-    const distanceResult = await query(distanceSql, [startDate, endDate]);
-
-    // Histogram for trip duration (bin size: 5 minutes)
-    const durationSql = `
-      SELECT FLOOR(trip_duration_minutes / 5) * 5 as duration_bin, COUNT(*) as count
-      FROM taxi_trips
-      WHERE pickup_datetime >= $1 AND pickup_datetime <= $2
-      GROUP BY duration_bin
-      ORDER BY duration_bin ASC
-    `;
-    const durationResult = await query(durationSql, [startDate, endDate]);
+    // Histograms for trip distance (bin size: 1 mile) and trip duration (bin
+    // size: 5 minutes), from the monthly histogram view and the daily
+    // histogram rollup; the range is resolved to whole days
+    const [distanceResult, durationResult] = await Promise.all([
+      cachedQuery(histogramSql('distance'), [startDate, endDate]),
+      cachedQuery(histogramSql('duration'), [startDate, endDate]),
+    ]);
 
     return NextResponse.json({
       distance: distanceResult.rows,
@@ -0,0 +1,64 @@
+export const dynamic = "force-dynamic";
+import { NextRequest, NextResponse } from 'next/server';
+import { cachedQuery } from '@/lib/database';
+
+// Hours of the week count from Monday 00:00 (0) to Sunday 23:00 (167), as in
+// dags/od_matrix.py
+const DAYS: Record<string, number[]> = {
+  weekdays: [0, 1, 2, 3, 4],
+  weekends: [5, 6],
+  all: [0, 1, 2, 3, 4, 5, 6],
+};
+
+export async function GET(request: NextRequest) {
+  try {
+    const { searchParams } = new URL(request.url);
+    const startDate = searchParams.get('startDate');
+    const endDate = searchParams.get('endDate');
+    const origin = Number(searchParams.get('origin'));
+    const hour = searchParams.get('hour');
+    const days = DAYS[searchParams.get('days') || 'all'];
+
+    if (!startDate || !endDate) {
+      return NextResponse.json({ error: 'Start date and end date are required' }, { status: 400 });
+    }
+    if (!Number.isInteger(origin) || origin < 1 || origin > 265) {
+      return NextResponse.json({ error: 'origin must be a zone id between 1 and 265' }, { status: 400 });
+    }
+    const hours = hour === null ? Array.from({ length: 24 }, (_, h) => h) : [Number(hour)];
+    if (!days || hours.some(h => !Number.isInteger(h) || h < 0 || h > 23)) {
+      return NextResponse.json({ error: 'hour must be 0-23 and days one of weekdays, weekends, all' }, { status: 400 });
+    }
+    const hoursOfWeek = days.flatMap(day => hours.map(h => day * 24 + h));
+
+    // Top 10 destinations from the origin zone in the selected hours, read by
+    // primary key from the per-month OD matrix (months overlapping the range).
+    // Medians do not combine across hours and months, so the typical duration
+    // is the trip-weighted mean of the per-hour medians
+    const sql = `
+      SELECT f.dropoff_location_id, z.zone_name, f.trip_count, f.total_revenue, f.typical_duration_minutes
+      FROM (
+        SELECT d.dropoff_location_id,
+               SUM(d.trips) as trip_count,
+               SUM(d.revenue) as total_revenue,
+               ROUND((SUM(d.median_duration_minutes * d.trips) / SUM(d.trips))::numeric, 1) as typical_duration_minutes
+        FROM trip_od_matrix m
+        CROSS JOIN LATERAL unnest(m.dropoff_location_ids, m.trips, m.revenue, m.median_duration_minutes)
+          AS d(dropoff_location_id, trips, revenue, median_duration_minutes)
+        WHERE m.month >= date_trunc('month', $1::timestamp)::date AND m.month <= $2::timestamp::date
+          AND m.pickup_location_id = $3
+          AND m.hour_of_week = ANY($4::smallint[])
+        GROUP BY d.dropoff_location_id
+        ORDER BY trip_count DESC
+        LIMIT 10
+      ) f
+      LEFT JOIN zone_aggregations z ON f.dropoff_location_id = z.location_id
+      ORDER BY f.trip_count DESC
+    `;
+    const result = await cachedQuery(sql, [startDate, endDate, origin, hoursOfWeek]);
+    return NextResponse.json({ origin, data: result.rows });
+  } catch (error) {
+    console.error('OD flows API error:', error);
+    return NextResponse.json({ error: 'Failed to fetch origin-destination flows' }, { status: 500 });
+  }
+}
@@ -1,6 +1,6 @@
 export const dynamic = "force-dynamic";
 import { NextRequest, NextResponse } from 'next/server';
-import { query } from '@/lib/database';
+import { cachedQuery, monthSplit } from '@/lib/database';
 
 export async function GET(request: NextRequest) {
   try {
@@ -13,15 +13,24 @@ export async function GET(request: NextRequest) {
       return NextResponse.json({ error: 'Start date and end date are required' }, { status: 400 });
     }
 
-    // Aggregate trip counts and total revenue by payment type
+    // Aggregate trip counts and total revenue by payment type, from the
+    // monthly hour view and the hourly rollup
+    const range = monthSplit('hour');
     const sql = `
-      SELECT payment_type, COUNT(*) as trip_count, SUM(total_amount) as total_revenue
-      FROM taxi_trips
-      WHERE pickup_datetime >= $1 AND pickup_datetime <= $2
+      SELECT NULLIF(payment_type, -1) as payment_type, SUM(trip_count) as trip_count, SUM(total_amount_sum) as total_revenue
+      FROM (
+        SELECT payment_type, trip_count, total_amount_sum
+        FROM dashboard_monthly_hours
+        WHERE ${range.months}
+        UNION ALL
+        SELECT payment_type, trip_count, total_amount_sum
+        FROM trip_rollup_hourly
+        WHERE ${range.edges('hour_bucket')}
+      ) h
       GROUP BY payment_type
       ORDER BY trip_count DESC
     `;
-    const result = await query(sql, [startDate, endDate]);
+    const result = await cachedQuery(sql, [startDate, endDate]);
     console.log('Payment-types SQL result:', result);
     return NextResponse.json({ data: result.rows });
   } catch (error) {
@@ -1,6 +1,6 @@
 export const dynamic = "force-dynamic";
 import { NextRequest, NextResponse } from 'next/server';
-import { query } from '@/lib/database';
+import { cachedQuery, monthSplit } from '@/lib/database';
 
 export async function GET(request: NextRequest) {
   try {
@@ -13,18 +13,28 @@ export async function GET(request: NextRequest) {
     }
 
     // Aggregate by hour of day for trip counts, total revenue, and total tip
+    // (served from the monthly hour view and the hourly rollup built by the
+    // Airflow DAG)
+    const range = monthSplit('hour');
     const sql = `
       SELECT 
-        EXTRACT(HOUR FROM pickup_datetime) as hour,
-        COUNT(*) as trip_count,
-        SUM(total_amount) as total_revenue,
-        SUM(tip_amount) as total_tip
-      FROM taxi_trips
-      WHERE pickup_datetime >= $1 AND pickup_datetime <= $2
+        hour,
+        SUM(trip_count) as trip_count,
+        SUM(total_amount_sum) as total_revenue,
+        SUM(tip_amount_sum) as total_tip
+      FROM (
+        SELECT hour, trip_count, total_amount_sum, tip_amount_sum
+        FROM dashboard_monthly_hours
+        WHERE ${range.months}
+        UNION ALL
+        SELECT EXTRACT(HOUR FROM hour_bucket), trip_count, total_amount_sum, tip_amount_sum
+        FROM trip_rollup_hourly
+        WHERE ${range.edges('hour_bucket')}
+      ) h
       GROUP BY hour
       ORDER BY hour ASC
     `;
-    const result = await query(sql, [startDate, endDate]);
+    const result = await cachedQuery(sql, [startDate, endDate]);
     return NextResponse.json({ data: result.rows });
   } catch (error) {
     console.error('Timeseries API error:', error);
@@ -1,6 +1,34 @@
 export const dynamic = "force-dynamic";
 import { NextRequest, NextResponse } from 'next/server';
-import { query } from '@/lib/database';
+import { cachedQuery, monthSplit } from '@/lib/database';
+
+// Top 10 zones by trip count and revenue on one side of the trip, with zone
+// name, from the monthly zone view and the daily zone rollup; the range is
+// resolved to whole days
+function topZonesSql(side: 'pickup' | 'dropoff') {
+  const range = monthSplit('day');
+  return `
+    SELECT r.zone_id, z.zone_name, r.trip_count, r.total_revenue
+    FROM (
+      SELECT NULLIF(location_id, -1) as zone_id, SUM(${side}_trips) as trip_count, SUM(${side}_revenue) as total_revenue
+      FROM (
+        SELECT location_id, ${side}_trips, ${side}_revenue
+        FROM dashboard_monthly_zones
+        WHERE ${range.months}
+        UNION ALL
+        SELECT location_id, ${side}_trips, ${side}_revenue
+        FROM trip_rollup_zones_daily
+        WHERE ${range.edges('stat_date')}
+      ) s
+      GROUP BY location_id
+      HAVING SUM(${side}_trips) > 0
+      ORDER BY trip_count DESC
+      LIMIT 10
+    ) r
+    LEFT JOIN zone_aggregations z ON r.zone_id = z.location_id
+    ORDER BY r.trip_count DESC
+  `;
+}
 
 export async function GET(request: NextRequest) {
   try {
@@ -12,29 +40,10 @@ export async function GET(request: NextRequest) {
       return NextResponse.json({ error: 'Start date and end date are required' }, { status: 400 });
     }
 
-    // Top 10 pickup zones by trip count and revenue, with zone name
-    const pickupSql = `
-      SELECT t.pickup_location_id as zone_id, z.zone_name, COUNT(*) as trip_count, SUM(t.total_amount) as total_revenue
-      FROM taxi_trips t
-      LEFT JOIN zone_aggregations z ON t.pickup_location_id = z.location_id
-      WHERE t.pickup_datetime >= $1 AND t.pickup_datetime <= $2
-      GROUP BY t.pickup_location_id, z.zone_name
-      ORDER BY trip_count DESC
-      LIMIT 10
-    `;
-    const pickupResult = await query(pickupSql, [startDate, endDate]);
-
-    // Top 10 dropoff zones by trip count and revenue, with zone name
-    const dropoffSql = `
-      SELECT t.dropoff_location_id as zone_id, z.zone_name, COUNT(*) as trip_count, SUM(t.total_amount) as total_revenue
-      FROM taxi_trips t
-      LEFT JOIN zone_aggregations z ON t.dropoff_location_id = z.location_id
-      WHERE t.pickup_datetime >= $1 AND t.pickup_datetime <= $2
-      GROUP BY t.dropoff_location_id, z.zone_name
-      ORDER BY trip_count DESC
-      LIMIT 10
-    `;
-    const dropoffResult = await query(dropoffSql, [startDate, endDate]);
+    const [pickupResult, dropoffResult] = await Promise.all([
+      cachedQuery(topZonesSql('pickup'), [startDate, endDate]),
+      cachedQuery(topZonesSql('dropoff'), [startDate, endDate]),
+    ]);
 
     return NextResponse.json({
       top_pickups: pickupResult.rows,
@@ -1,6 +1,6 @@
 export const dynamic = "force-dynamic";
 import { NextRequest, NextResponse } from 'next/server';
-import { query } from '@/lib/database';
+import { cachedQuery, monthSplit } from '@/lib/database';
 
 export async function GET(request: NextRequest) {
   try {
@@ -12,15 +12,25 @@ export async function GET(request: NextRequest) {
       return NextResponse.json({ error: 'Start date and end date are required' }, { status: 400 });
     }
 
-    // Aggregate trip counts and total revenue by pickup zone
+    // Aggregate trip counts and total revenue by pickup zone, from the monthly
+    // zone view and the daily zone rollup; the range is resolved to whole days
+    const range = monthSplit('day');
     const sql = `
-      SELECT pickup_location_id, COUNT(*) as trip_count, SUM(total_amount) as total_revenue
-      FROM taxi_trips
-      WHERE pickup_datetime >= $1 AND pickup_datetime <= $2
-      GROUP BY pickup_location_id
+      SELECT NULLIF(location_id, -1) as pickup_location_id, SUM(pickup_trips) as trip_count, SUM(pickup_revenue) as total_revenue
+      FROM (
+        SELECT location_id, pickup_trips, pickup_revenue
+        FROM dashboard_monthly_zones
+        WHERE ${range.months}
+        UNION ALL
+        SELECT location_id, pickup_trips, pickup_revenue
+        FROM trip_rollup_zones_daily
+        WHERE ${range.edges('stat_date')}
+      ) z
+      GROUP BY location_id
+      HAVING SUM(pickup_trips) > 0
       ORDER BY trip_count DESC
     `;
-    const result = await query(sql, [startDate, endDate]);
+    const result = await cachedQuery(sql, [startDate, endDate]);
     return NextResponse.json({ data: result.rows });
   } catch (error) {
     console.error('Zone heatmap API error:', error);
@@ -0,0 +1,74 @@
+export const dynamic = "force-dynamic";
+import { promises as fs } from 'fs';
+import path from 'path';
+import { NextRequest, NextResponse } from 'next/server';
+
+// Written by the DAG's export_trips_task (dags/trip_export.py): one entry per
+// month with its Parquet and CSV.gz files under public/exports/
+const EXPORT_DIR = process.env.EXPORT_DIR || path.join(process.cwd(), 'public', 'exports');
+const FORMATS = ['parquet', 'csv.gz'];
+
+interface ExtractFile {
+  file: string;
+  rows: number;
+  bytes: number;
+}
+
+interface MonthExtract {
+  start: string;
+  end: string;
+  rows: number;
+  files: Record<string, ExtractFile[]>;
+}
+
+export async function GET(request: NextRequest) {
+  try {
+    const { searchParams } = new URL(request.url);
+    const startDate = searchParams.get('startDate');
+    const endDate = searchParams.get('endDate');
+    const format = searchParams.get('format') || 'parquet';
+
+    if (!startDate || !endDate) {
+      return NextResponse.json({ error: 'Start date and end date are required' }, { status: 400 });
+    }
+    if (!FORMATS.includes(format)) {
+      return NextResponse.json({ error: `format must be one of ${FORMATS.join(', ')}` }, { status: 400 });
+    }
+
+    let manifest: { months: Record<string, MonthExtract> };
+    try {
+      manifest = JSON.parse(await fs.readFile(path.join(EXPORT_DIR, 'manifest.json'), 'utf8'));
+    } catch (error) {
+      return NextResponse.json({ error: 'No trip extracts have been published' }, { status: 404 });
+    }
+
+    // Trips are not materialized per request: the response lists the
+    // precomputed monthly files overlapping the range, which the client
+    // downloads directly (and may cache forever, their names being content
+    // hashes). Months are whole, so files can hold trips outside the range.
+    const start = startDate.slice(0, 10);
+    const end = endDate.slice(0, 10);
+    const months = Object.entries(manifest.months)
+      .filter(([, extract]) => extract.start <= end && extract.end > start)
+      .sort(([a], [b]) => a.localeCompare(b))
+      .map(([month, extract]) => ({
+        month,
+        start: extract.start,
+        end: extract.end,
+        rows: extract.rows,
+        files: (extract.files[format] || []).map(part => ({
+          url: `/exports/${part.file}`,
+          rows: part.rows,
+          bytes: part.bytes,
+        })),
+      }));
+
+    if (months.length === 0) {
+      return NextResponse.json({ error: 'No trip extracts found for the selected range' }, { status: 404 });
+    }
+    return NextResponse.json({ format, months });
+  } catch (error) {
+    console.error('Trip extracts API error:', error);
+    return NextResponse.json({ error: 'Failed to list trip extracts' }, { status: 500 });
+  }
+}
@@ -1,15 +1,9 @@
 export const dynamic = "force-dynamic";
 import { NextRequest, NextResponse } from 'next/server';
-import { query, testConnection } from '@/lib/database';
+import { cachedQuery, monthSplit } from '@/lib/database';
 
 export async function GET(request: NextRequest) {
   try {
-    // Test connection first
-    const isConnected = await testConnection();
-    if (!isConnected) {
-      return NextResponse.json({ error: 'Database connection failed' }, { status: 500 });
-    }
-
     const { searchParams } = new URL(request.url);
     const startDate = searchParams.get('startDate');
     const endDate = searchParams.get('endDate');
@@ -18,18 +12,27 @@ export async function GET(request: NextRequest) {
       return NextResponse.json({ error: 'Start date and end date are required' }, { status: 400 });
     }
 
-    // Query summary stats from the summary table
+    // Query summary stats from the monthly summary view and the daily summary
+    // table (sums and counts, so averages over the range are exact)
+    const range = monthSplit('day');
     const statsQuery = `
       SELECT 
         SUM(total_trips) as total_trips,
-        AVG(avg_fare) as avg_fare,
-        AVG(avg_tip) as avg_tip,
+        SUM(fare_sum) / NULLIF(SUM(fare_count), 0) as avg_fare,
+        SUM(tip_sum) / NULLIF(SUM(tip_count), 0) as avg_tip,
         SUM(total_revenue) as total_revenue,
-        AVG(avg_distance) as avg_distance
-      FROM taxi_trip_summary
-      WHERE stat_date >= $1 AND stat_date <= $2
+        SUM(distance_sum) / NULLIF(SUM(distance_count), 0) as avg_distance
+      FROM (
+        SELECT total_trips, fare_sum, fare_count, tip_sum, tip_count, total_revenue, distance_sum, distance_count
+        FROM dashboard_monthly_summary
+        WHERE ${range.months}
+        UNION ALL
+        SELECT total_trips, fare_sum, fare_count, tip_sum, tip_count, total_revenue, distance_sum, distance_count
+        FROM taxi_trip_summary
+        WHERE ${range.edges('stat_date')}
+      ) s
     `;
-    const statsResult = await query(statsQuery, [startDate.slice(0, 10), endDate.slice(0, 10)]);
+    const statsResult = await cachedQuery(statsQuery, [startDate.slice(0, 10), endDate.slice(0, 10)]);
     const stats = statsResult.rows[0];
 
     if (!stats || stats.total_trips === null) {
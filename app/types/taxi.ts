@@ -1,5 +1,4 @@
 export interface TaxiTrip {
-  id?: number;
   pickup_datetime: string;
   dropoff_datetime: string;
   pickup_location_id: number | null;
@@ -11,5 +10,4 @@ export interface TaxiTrip {
   payment_type: number | null;
   trip_duration_minutes: number | null;
   tip_percentage: number | null;
-  created_at?: string;
 } 
\ No newline at end of file
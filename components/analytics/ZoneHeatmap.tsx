@@ -22,6 +22,10 @@ interface Feature {
   };
 }
 
+// Detail level of the zone geometry (see dags/zone_geometry.py); 'medium'
+// suits the 600px map
+const GEOMETRY_LEVEL = 'medium';
+
 function getColor(count: number, max: number) {
   // Blue (low) to Red (high)
   const percent = max ? count / max : 0;
@@ -57,7 +61,17 @@ export default function ZoneHeatmap({ startDate, endDate }: { startDate: string;
       .then(res => res.json())
       .then(res => setData(res.data))
       .catch(() => setError('Failed to load heatmap data'));
-    fetch('/nyu-2451-36743-geojson.json')
+    // The manifest names the current content-hashed geometry file per detail
+    // level; those files are cached forever, so only the manifest is refetched
+    fetch('/zones/manifest.json')
+      .then(res => {
+        if (!res.ok) {
+          console.error('Zone geometry manifest fetch failed with status:', res.status);
+          throw new Error('Network response was not ok');
+        }
+        return res.json();
+      })
+      .then(manifest => fetch(`/zones/${manifest.levels[GEOMETRY_LEVEL].file}`))
       .then(res => {
         if (!res.ok) {
           console.error('GeoJSON fetch failed with status:', res.status);
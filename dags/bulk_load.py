@@ -0,0 +1,127 @@
+"""
+Bulk loading helpers shared by the NYC taxi DAG and its Spark workers.
+
+This module is shipped to Spark executors with addPyFile, so its module-level
+imports are limited to the standard library and psycopg2.
+"""
+import csv
+import io
+import queue
+import threading
+import time
+
+import psycopg2
+
+
+def copy_rows_to_postgres(rows, table, columns, conn_params, chunk_size=50000):
+    """
+    Stream an iterable of rows into a table with COPY ... FROM STDIN (CSV).
+
+    Rows are buffered chunk_size at a time so memory stays bounded; all
+    chunks go through one connection and are committed together.
+    Returns the number of rows copied.
+    """
+    copy_sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    total_rows = 0
+    conn = psycopg2.connect(**conn_params)
+    try:
+        cursor = conn.cursor()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffered = 0
+        for row in rows:
+            # None is written as an unquoted empty field, which COPY reads as NULL
+            writer.writerow(row)
+            buffered += 1
+            if buffered >= chunk_size:
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+                total_rows += buffered
+                buffer.seek(0)
+                buffer.truncate()
+                buffered = 0
+        if buffered:
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+            total_rows += buffered
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+    return total_rows
+
+
+def copy_arrow_table(cursor, arrow_table, table):
+    """
+    COPY one pyarrow Table into a table through an open cursor (CSV), in the
+    cursor's transaction. Column names are taken from the Arrow table.
+    """
+    import pyarrow.csv as pa_csv
+
+    buffer = io.BytesIO()
+    pa_csv.write_csv(arrow_table, buffer, pa_csv.WriteOptions(include_header=False))
+    buffer.seek(0)
+    columns = ', '.join(arrow_table.column_names)
+    cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def copy_tables_to_postgres(tables, table, conn_params, parallelism=4):
+    """
+    Load a stream of pyarrow Tables into a table with parallel COPY (CSV).
+
+    `parallelism` worker threads each hold one connection and pull tables
+    from a bounded queue, so at most 2 * parallelism tables are in memory.
+    Each worker commits once at the end. Returns a list of
+    (worker, rows, seconds) tuples, one per worker.
+    """
+    pending = queue.Queue(maxsize=2 * parallelism)
+    results = []
+    errors = []
+
+    def worker(index):
+        copied = 0
+        started = time.time()
+        try:
+            conn = psycopg2.connect(**conn_params)
+        except Exception as e:
+            errors.append(e)
+            conn = None
+        try:
+            cursor = conn.cursor() if conn else None
+            while True:
+                arrow_table = pending.get()
+                if arrow_table is None:
+                    break
+                # Keep draining after a failure so the producer never blocks
+                if errors:
+                    continue
+                try:
+                    copy_arrow_table(cursor, arrow_table, table)
+                    copied += arrow_table.num_rows
+                except Exception as e:
+                    errors.append(e)
+            if conn and not errors:
+                conn.commit()
+        finally:
+            if conn:
+                conn.close()
+        results.append((index, copied, time.time() - started))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(parallelism)]
+    for thread in threads:
+        thread.start()
+    try:
+        for arrow_table in tables:
+            if errors:
+                break
+            if arrow_table.num_rows:
+                pending.put(arrow_table)
+    finally:
+        for _ in threads:
+            pending.put(None)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        raise errors[0]
+    return sorted(results)
@@ -0,0 +1,149 @@
+"""
+Materialized dashboard aggregates and the data version readers cache on.
+
+The DAG's last task, once every table the dashboard reads has been
+rebuilt, runs publish_data_version() in one transaction:
+
+- the monthly materialized views below are refreshed with REFRESH
+  MATERIALIZED VIEW CONCURRENTLY, so API queries keep reading the previous
+  contents while they are rebuilt instead of waiting on an exclusive lock
+- the single data_version row is incremented
+- NOTIFY taxi_data_version is sent with the new version as JSON payload
+
+Postgres delivers the notification only when the transaction commits, so a
+listener that sees version N can read every view and table at version N.
+The API keys its result cache on the version (lib/database.ts), listening
+on the channel where it holds a long-lived connection and re-reading the
+version row otherwise, so dashboard queries between loads never reach the
+database.
+
+Each view rolls a daily or hourly rollup (dags/trip_rollups.py) or
+taxi_trip_summary up to calendar months. The API reads whole months of a
+requested range from the views and only the partial months at its edges
+from the finer tables. Every value is a count or a sum, so the two combine
+exactly.
+"""
+import json
+
+DATA_VERSION_CHANNEL = 'taxi_data_version'
+
+# One row (id is always TRUE); version only ever increases
+DATA_VERSION_DDL = """
+    CREATE TABLE IF NOT EXISTS data_version (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        version BIGINT NOT NULL,
+        run_id VARCHAR(250),
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    INSERT INTO data_version (version) VALUES (0) ON CONFLICT (id) DO NOTHING;
+"""
+
+# View name -> (query, unique key columns). REFRESH ... CONCURRENTLY needs a
+# unique index over plain columns, covering every row
+DASHBOARD_VIEWS = {
+    'dashboard_monthly_summary': ("""
+        SELECT date_trunc('month', stat_date)::date AS month,
+               SUM(total_trips) AS total_trips,
+               SUM(total_revenue) AS total_revenue,
+               SUM(fare_sum) AS fare_sum,
+               SUM(fare_count) AS fare_count,
+               SUM(tip_sum) AS tip_sum,
+               SUM(tip_count) AS tip_count,
+               SUM(distance_sum) AS distance_sum,
+               SUM(distance_count) AS distance_count
+        FROM taxi_trip_summary
+        GROUP BY 1
+    """, ['month']),
+    'dashboard_monthly_hours': ("""
+        SELECT date_trunc('month', hour_bucket)::date AS month,
+               EXTRACT(HOUR FROM hour_bucket)::smallint AS hour,
+               payment_type,
+               SUM(trip_count) AS trip_count,
+               SUM(total_amount_sum) AS total_amount_sum,
+               SUM(tip_amount_sum) AS tip_amount_sum
+        FROM trip_rollup_hourly
+        GROUP BY 1, 2, 3
+    """, ['month', 'hour', 'payment_type']),
+    'dashboard_monthly_zones': ("""
+        SELECT date_trunc('month', stat_date)::date AS month,
+               location_id,
+               SUM(pickup_trips) AS pickup_trips,
+               SUM(pickup_revenue) AS pickup_revenue,
+               SUM(dropoff_trips) AS dropoff_trips,
+               SUM(dropoff_revenue) AS dropoff_revenue
+        FROM trip_rollup_zones_daily
+        GROUP BY 1, 2
+    """, ['month', 'location_id']),
+    'dashboard_monthly_histograms': ("""
+        SELECT date_trunc('month', stat_date)::date AS month,
+               metric,
+               bin,
+               SUM(trip_count) AS trip_count
+        FROM trip_rollup_histograms_daily
+        GROUP BY 1, 2, 3
+    """, ['month', 'metric', 'bin']),
+}
+
+
+def _view_columns(cursor, name, select):
+    """(columns of the existing view, columns its query returns now)"""
+    cursor.execute("""
+        SELECT array_agg(attname::text ORDER BY attnum) FROM pg_attribute
+        WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped;
+    """, (name,))
+    existing = cursor.fetchone()[0]
+    cursor.execute(f"SELECT * FROM ({select}) q LIMIT 0;")
+    return existing, [column.name for column in cursor.description]
+
+
+def refresh_dashboard_views(cursor):
+    """
+    Create the dashboard views that do not exist yet (populated) and
+    refresh the others concurrently. A view whose columns differ from its
+    query's (the query gained a column) is dropped and recreated instead,
+    locking out its readers until the commit. Returns {view: rows}.
+    """
+    cursor.execute("SELECT matviewname, ispopulated FROM pg_matviews WHERE schemaname = current_schema();")
+    existing = dict(cursor.fetchall())
+    row_counts = {}
+    for name, (select, key) in DASHBOARD_VIEWS.items():
+        if name in existing:
+            view_columns, select_columns = _view_columns(cursor, name, select)
+            if view_columns != select_columns:
+                cursor.execute(f"DROP MATERIALIZED VIEW {name};")
+                del existing[name]
+        if name not in existing:
+            cursor.execute(f"CREATE MATERIALIZED VIEW {name} AS {select};")
+            cursor.execute(f"CREATE UNIQUE INDEX {name}_key ON {name} ({', '.join(key)});")
+        elif existing[name]:
+            cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name};")
+        else:
+            # Created WITH NO DATA; a first refresh cannot be concurrent
+            cursor.execute(f"REFRESH MATERIALIZED VIEW {name};")
+        cursor.execute(f"SELECT COUNT(*) FROM {name};")
+        row_counts[name] = cursor.fetchone()[0]
+    return row_counts
+
+
+def bump_data_version(cursor, run_id=None, months=()):
+    """
+    Increment the data version and queue its NOTIFY, sent when the
+    transaction commits. Returns the new version.
+    """
+    cursor.execute(DATA_VERSION_DDL)
+    # The row lock serializes concurrent bumps, so versions never repeat
+    cursor.execute("""
+        UPDATE data_version
+        SET version = version + 1, run_id = %s, updated_at = CURRENT_TIMESTAMP
+        RETURNING version;
+    """, (run_id,))
+    version = cursor.fetchone()[0]
+    payload = json.dumps({'version': version, 'run_id': run_id, 'months': list(months)})
+    cursor.execute("SELECT pg_notify(%s, %s);", (DATA_VERSION_CHANNEL, payload))
+    return version
+
+
+def publish_data_version(cursor, run_id=None, months=()):
+    """Refresh the dashboard views and bump the data version together. Returns (version, {view: rows})."""
+    row_counts = refresh_dashboard_views(cursor)
+    return bump_data_version(cursor, run_id, months), row_counts
@@ -6,8 +6,9 @@ from airflow.providers.postgres.operators.postgres import PostgresOperator
 import requests
 import os
 import logging
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, when, lit, round, unix_timestamp
+
+from pipeline_db import connection_params, jdbc_options, run_in_transaction, run_outside_transaction, transaction
+from pipeline_metrics import instrument, record_rows, stage
 
 
 # Default arguments for the DAG
@@ -29,219 +30,716 @@ dag = DAG(
     schedule_interval='@monthly',
     catchup=False,
     tags=['nyc', 'taxi', 'data-pipeline'],
+    params={
+        # 'incremental' reloads only the month partition being processed,
+        # 'full' drops the whole taxi_trips table first (old behaviour)
+        'load_mode': 'incremental',
+        # 'copy' streams rows with COPY FROM STDIN, 'jdbc' uses Spark's JDBC writer
+        'loader': 'copy',
+        # number of Spark partitions (and concurrent COPY connections) to load with
+        'copy_parallelism': 4,
+        # 'spark' runs the PySpark job, 'arrow' streams the file through PyArrow
+        # without starting a JVM
+        'engine': 'arrow',
+        # The run processes the month of its logical date minus month_lag
+        # (TLC publishes each month about two months later); 'month'
+        # ('YYYY-MM') overrides that for manual runs
+        'month': None,
+        'month_lag': 2,
+        # >1 also processes the months before it in the same run, each as its
+        # own mapped processing task
+        'backfill_months': 1,
+        # TLC feeds to load (see dags/tlc_feeds.py): 'yellow', 'green', 'fhv'
+        # and 'fhvhv' (high-volume FHV, ~20M trips a month). Every feed's month
+        # is its own mapped processing task, all running concurrently
+        'feeds': ['yellow'],
+        # number of files downloaded concurrently
+        'download_workers': 4,
+        # 'lake' computes zone aggregations and daily stats from the Parquet
+        # lake in data/processed instead of scanning taxi_trips in Postgres
+        'aggregation_source': 'postgres',
+        # 'cprofile' or 'py-spy' writes a profile of every task under
+        # /opt/airflow/logs/profiles (see dags/pipeline_metrics.py)
+        'profile': None,
+        # formats of the downloadable per-month trip extracts written under
+        # public/exports (see dags/trip_export.py); [] skips the export
+        'export_formats': ['parquet', 'csv.gz'],
+    },
 )
 
-def download_nyc_taxi_data(**context):
+# Upper bound on files (feed months) processed at once by one DAG run
+MAX_PARALLEL_MONTHS = 12
+
+# Trips per COPY handed to a loader worker; small slices keep the parallel
+# workers writing neighbouring pickup times
+LOAD_SLICE_ROWS = 25_000
+
+ZONE_LOOKUP_FILE = '/opt/airflow/data/zones/taxi_zone_lookup.csv'
+
+# taxi_trips is partitioned by pickup month (taxi_trips_YYYY_MM), and each
+# month by feed (taxi_trips_YYYY_MM_<feed>, listed by service_type), so the
+# feeds of a month are loaded and swapped in independently while date-range
+# queries still prune by month. Every partition carries the same indexes as
+# the parent table. The columns are TAXI_TRIPS_COLUMNS
+# (dags/trip_processing.py): amounts in integer cents, no surrogate key and
+# no per-row timestamp, laid out without alignment padding
+TAXI_TRIPS_DDL = """
+    CREATE TABLE IF NOT EXISTS taxi_trips (
+        pickup_datetime TIMESTAMP NOT NULL,
+        dropoff_datetime TIMESTAMP,
+        pickup_location_id SMALLINT,
+        dropoff_location_id SMALLINT,
+        trip_distance REAL,
+        fare_cents INTEGER,
+        tip_cents INTEGER,
+        total_cents INTEGER,
+        payment_type SMALLINT,
+        trip_duration_minutes SMALLINT,
+        tip_percentage REAL,
+        service_type SMALLINT NOT NULL
+    ) PARTITION BY RANGE (pickup_datetime);
+"""
+
+# Converts a taxi_trips of the earlier DECIMAL layout in place: every
+# partition is rewritten once, and its indexes rebuilt, in the caller's
+# transaction
+TAXI_TRIPS_COMPACT_MIGRATION = """
+    ALTER TABLE taxi_trips DROP CONSTRAINT IF EXISTS taxi_trips_pkey;
+    ALTER TABLE taxi_trips
+        DROP COLUMN id,
+        DROP COLUMN created_at,
+        ALTER COLUMN pickup_location_id TYPE SMALLINT,
+        ALTER COLUMN dropoff_location_id TYPE SMALLINT,
+        ALTER COLUMN trip_distance TYPE REAL,
+        ALTER COLUMN fare_amount TYPE INTEGER USING round(fare_amount * 100),
+        ALTER COLUMN tip_amount TYPE INTEGER USING round(tip_amount * 100),
+        ALTER COLUMN total_amount TYPE INTEGER USING round(total_amount * 100),
+        ALTER COLUMN payment_type TYPE SMALLINT,
+        ALTER COLUMN trip_duration_minutes TYPE SMALLINT,
+        ALTER COLUMN tip_percentage TYPE REAL;
+    ALTER TABLE taxi_trips RENAME COLUMN fare_amount TO fare_cents;
+    ALTER TABLE taxi_trips RENAME COLUMN tip_amount TO tip_cents;
+    ALTER TABLE taxi_trips RENAME COLUMN total_amount TO total_cents;
+"""
+
+# Adds service_type to a taxi_trips from before multi-feed loads, which only
+# ever held yellow trips; the default is stored once, not written per row
+TAXI_TRIPS_SERVICE_TYPE_MIGRATION = """
+    ALTER TABLE taxi_trips ADD COLUMN service_type SMALLINT NOT NULL DEFAULT {yellow};
+    ALTER TABLE taxi_trips ALTER COLUMN service_type DROP DEFAULT;
+"""
+
+# Indexes of every partition, by name suffix, as "[USING method] (columns)
+# ..." clauses. Months are loaded in pickup_datetime order, so a small BRIN
+# index narrows date ranges to a few blocks; the covering B-tree answers
+# date-range GROUP BYs over zones and revenue with index-only scans (and
+# serves ORDER BY pickup_datetime); the zone B-tree serves zone filters
+# within a date range. Partitions are vacuumed before they are attached, so
+# the visibility map lets index-only scans skip the heap.
+TAXI_TRIPS_INDEXES = {
+    'pickup_brin': "USING brin (pickup_datetime) WITH (pages_per_range = 32)",
+    'pickup_covering': "(pickup_datetime) INCLUDE (pickup_location_id, dropoff_location_id, total_cents)",
+    'pickup_zone': "(pickup_location_id, pickup_datetime)",
+}
+# Indexes of earlier layouts, dropped from taxi_trips (and so every partition)
+RETIRED_TAXI_TRIPS_INDEXES = ['idx_pickup_datetime', 'idx_pickup_location', 'idx_dropoff_location']
+
+def months_to_process(context):
     """
-    Download NYC taxi data for a specific month
+    Return the (year, month) pairs this run processes, oldest first.
+
+    The last month is the month of the run's logical date shifted back by
+    month_lag (or the 'month' param); backfill_months counts back from it.
     """
-    import requests
-    from datetime import datetime
-    
-    # Get the execution date from context
-    execution_date = context['execution_date']
-    year = execution_date.year
-    month = execution_date.month
-    
-    # Create data directory if it doesn't exist
-    os.makedirs('/opt/airflow/data/raw', exist_ok=True)
-    
-    # NYC TLC data URL pattern
-    # Note: Data is typically available 2-3 months after the actual month
-    # For demo purposes, we'll use a recent available month
-    if year == 2025 and month >= 7:
-        # Use a recent available month instead (April 2025 should be available)
-        year = 2025
-        month = 4  # April 2025 should be available
-    elif year == 2025 and month >= 5:
-        # Use March 2025
-        year = 2025
-        month = 3  # March 2025 should be available
-    
-    # Format month with leading zero
-    month_str = f"{month:02d}"
+    params = context.get('params', {})
+    if params.get('month'):
+        year, month = (int(part) for part in params['month'].split('-'))
+    else:
+        logical_date = context['logical_date']
+        index = logical_date.year * 12 + logical_date.month - 1 - int(params.get('month_lag', 2))
+        year, month = index // 12, index % 12 + 1
     
-    # NYC TLC Yellow Taxi data URL
-    url = f"https://d37ci6vzurychx.cloudfront.net/trip-data/yellow_tripdata_{year}-{month_str}.parquet"
+    count = max(int(params.get('backfill_months', 1)), 1)
+    last = year * 12 + month - 1
+    return [(index // 12, index % 12 + 1) for index in range(last - count + 1, last + 1)]
+
+def download_nyc_taxi_data(**context):
+    """
+    Download the NYC taxi data files of every feed for the months this run
+    processes
+    """
+    from tlc_download import download_months
     
-    # Local file path
-    local_file = f"/opt/airflow/data/raw/yellow_tripdata_{year}-{month_str}.parquet"
+    months = months_to_process(context)
+    params = context.get('params', {})
+    feeds = params.get('feeds') or ['yellow']
     
     try:
-        logging.info(f"Downloading data from: {url}")
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-        
-        with open(local_file, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
-        
-        logging.info(f"Successfully downloaded data to: {local_file}")
+        logging.info(f"Downloading {', '.join(feeds)} trips for "
+                     f"{', '.join(f'{year}-{month:02d}' for year, month in months)}")
+        reports = download_months(
+            months,
+            '/opt/airflow/data/raw',
+            feeds=feeds,
+            max_workers=int(params.get('download_workers', 4)),
+        )
+        downloaded = sum(report['bytes'] for report in reports)
+        skipped = sum(report['skipped'] for report in reports)
+        logging.info(f"Downloaded {downloaded} bytes, {skipped} file(s) already up to date")
         
-        # Return the file path for downstream tasks
-        return local_file
+        # One file path per feed and month; each becomes a mapped processing task
+        return [report['path'] for report in reports]
         
     except Exception as e:
         logging.error(f"Error downloading data: {str(e)}")
         raise
 
-def run_spark_processing(**context):
-    """Run PySpark processing job for NYC taxi data"""
-    import subprocess
+def month_partition_bounds(year, month):
+    """
+    Return the partition name and [start, end) timestamps for a month
+    """
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return f"taxi_trips_{year}_{month:02d}", start, end
+
+def feed_partition_name(year, month, feed):
+    """
+    Return the name of a feed's partition of a month
+    """
+    partition_name, _, _ = month_partition_bounds(year, month)
+    return f"{partition_name}_{feed}"
+
+def ensure_month_partition(cursor, year, month):
+    """
+    Create the month's partition of taxi_trips, itself partitioned by
+    service_type, unless it exists. It gets its indexes under the names
+    swap_in_partition uses before it is attached, so the parent's indexes
+    attach them instead of building their own.
+    """
+    partition_name, start, end = month_partition_bounds(year, month)
+    cursor.execute("""
+        SELECT 1
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'taxi_trips'::regclass AND c.relname = %s;
+    """, (partition_name,))
+    if cursor.fetchone():
+        return
+    cursor.execute(f"CREATE TABLE {partition_name} (LIKE taxi_trips) PARTITION BY LIST (service_type);")
+    for suffix, definition in TAXI_TRIPS_INDEXES.items():
+        cursor.execute(f"CREATE INDEX {partition_name}_{suffix}_idx ON {partition_name} {definition};")
+    cursor.execute(f"""
+        ALTER TABLE taxi_trips ATTACH PARTITION {partition_name}
+        FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}');
+    """)
+
+def ensure_taxi_trips_table(cursor, load_mode='incremental'):
+    """
+    Make sure taxi_trips exists as a month- and feed-partitioned table.
+
+    A legacy unpartitioned taxi_trips (from before incremental loads) only
+    ever held a single month, so it is dropped and recreated partitioned; a
+    partitioned one with the earlier DECIMAL columns is converted in place,
+    and one from before multi-feed loads gets service_type and has each of
+    its month partitions moved under a month table as the yellow partition.
+    """
+    from tlc_feeds import SERVICE_TYPES
+
+    cursor.execute("""
+        SELECT c.relkind
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relname = 'taxi_trips';
+    """)
+    row = cursor.fetchone()
+    if load_mode == 'full' or (row and row[0] != 'p'):
+        logging.info("Dropping existing taxi_trips table")
+        cursor.execute("DROP TABLE IF EXISTS taxi_trips CASCADE;")
+
+    cursor.execute(TAXI_TRIPS_DDL)
+    for index_name in RETIRED_TAXI_TRIPS_INDEXES:
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name};")
+    def has_column(name):
+        cursor.execute("""
+            SELECT 1
+            FROM pg_attribute
+            WHERE attrelid = 'taxi_trips'::regclass AND attname = %s AND NOT attisdropped;
+        """, (name,))
+        return cursor.fetchone() is not None
+
+    if has_column('fare_amount'):
+        logging.info("Converting taxi_trips to the compact column layout")
+        # Rebuilt below under their partition names, and only once
+        for suffix in TAXI_TRIPS_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS taxi_trips_{suffix}_idx;")
+        cursor.execute(TAXI_TRIPS_COMPACT_MIGRATION)
+    if not has_column('service_type'):
+        logging.info("Adding service_type to taxi_trips")
+        cursor.execute(TAXI_TRIPS_SERVICE_TYPE_MIGRATION.format(yellow=SERVICE_TYPES['yellow']))
+
+    # Month partitions loaded before multi-feed loads are plain tables of
+    # yellow trips; each becomes the yellow partition of a new month table
+    cursor.execute("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'taxi_trips'::regclass AND c.relkind = 'r';
+    """)
+    for partition_name, in cursor.fetchall():
+        year, month = (int(part) for part in partition_name.rsplit('_', 2)[1:])
+        yellow_name = feed_partition_name(year, month, 'yellow')
+        logging.info(f"Moving {partition_name} to {yellow_name}")
+        cursor.execute(f"ALTER TABLE taxi_trips DETACH PARTITION {partition_name};")
+        cursor.execute(f"ALTER TABLE {partition_name} RENAME TO {yellow_name};")
+        for suffix, definition in TAXI_TRIPS_INDEXES.items():
+            cursor.execute(f"ALTER INDEX IF EXISTS {partition_name}_{suffix}_idx RENAME TO {yellow_name}_{suffix}_idx;")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {yellow_name}_{suffix}_idx ON {yellow_name} {definition};")
+        ensure_month_partition(cursor, year, month)
+        cursor.execute(f"""
+            ALTER TABLE {partition_name} ATTACH PARTITION {yellow_name} FOR VALUES IN ({SERVICE_TYPES['yellow']});
+        """)
+
+    # Partitions attached under an earlier layout get their indexes built
+    # under the names swap_in_partition uses, feed partitions first, then
+    # their month tables and taxi_trips; each parent index then attaches
+    # its partitions' indexes instead of building its own
+    cursor.execute("""
+        SELECT relid::regclass::text
+        FROM pg_partition_tree('taxi_trips')
+        ORDER BY level DESC;
+    """)
+    table_names = [name.rsplit('.', 1)[-1] for name, in cursor.fetchall()]
+    for table_name in table_names:
+        for suffix, definition in TAXI_TRIPS_INDEXES.items():
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_{suffix}_idx ON {table_name} {definition};")
+
+def prepare_staging_partition(cursor, year, month, feed):
+    """
+    Create an empty, unindexed staging table for one month of a feed's trips
+    """
+    staging_name = f"{feed_partition_name(year, month, feed)}_staging"
+    cursor.execute(f"DROP TABLE IF EXISTS {staging_name};")
+    cursor.execute(f"CREATE TABLE {staging_name} (LIKE taxi_trips INCLUDING DEFAULTS);")
+    return staging_name
+
+def swap_in_partition(cursor, year, month, feed):
+    """
+    Index the loaded staging table and swap it in as the feed's partition
+    of the month.
+
+    Indexes and a matching CHECK constraint are built after the load and
+    before the swap, so rows are not indexed one by one and ATTACH PARTITION
+    neither rebuilds indexes nor rescans the table; the other months and
+    feeds (and the old copy of this one) stay queryable until the swap. The
+    staging table should have been vacuumed and analyzed
+    (vacuum_staging_partition).
+    """
+    from tlc_feeds import SERVICE_TYPES
+
+    partition_name, start, end = month_partition_bounds(year, month)
+    feed_partition = feed_partition_name(year, month, feed)
+    staging_name = f"{feed_partition}_staging"
+    service_type = SERVICE_TYPES[feed]
+
+    for suffix, definition in TAXI_TRIPS_INDEXES.items():
+        cursor.execute(f"CREATE INDEX {staging_name}_{suffix}_idx ON {staging_name} {definition};")
+    cursor.execute(f"""
+        ALTER TABLE {staging_name} ADD CONSTRAINT {feed_partition}_range
+        CHECK (pickup_datetime >= '{start.isoformat()}' AND pickup_datetime < '{end.isoformat()}'
+               AND service_type = {service_type});
+    """)
+
+    # Normally created by prepare_taxi_trips before the months are processed
+    ensure_month_partition(cursor, year, month)
+    cursor.execute("""
+        SELECT 1
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass AND c.relname = %s;
+    """, (partition_name, feed_partition))
+    if cursor.fetchone():
+        cursor.execute(f"ALTER TABLE {partition_name} DETACH PARTITION {feed_partition};")
+    cursor.execute(f"DROP TABLE IF EXISTS {feed_partition};")
+
+    cursor.execute(f"ALTER TABLE {staging_name} RENAME TO {feed_partition};")
+    for suffix in TAXI_TRIPS_INDEXES:
+        cursor.execute(f"ALTER INDEX {staging_name}_{suffix}_idx RENAME TO {feed_partition}_{suffix}_idx;")
+    cursor.execute(f"ALTER TABLE {partition_name} ATTACH PARTITION {feed_partition} FOR VALUES IN ({service_type});")
+    cursor.execute(f"ALTER TABLE {feed_partition} DROP CONSTRAINT {feed_partition}_range;")
+
+def vacuum_staging_partition(year, month, feed):
+    """
+    VACUUM ANALYZE a loaded staging table: sets its visibility map, so
+    index-only scans need not visit the heap, and its planner statistics
+    """
+    run_outside_transaction(f"VACUUM (ANALYZE) {feed_partition_name(year, month, feed)}_staging;")
+
+def analyze_taxi_trips(cursor):
+    """
+    Refresh the statistics of the partitioned parent, which autovacuum never
+    analyzes, so plans over several months see the new one
+    """
+    cursor.execute("ANALYZE taxi_trips;")
+
+def process_month_with_spark(input_file, feed, staging_table, start, end, conn_params, params):
+    """
+    Clean one month of a feed's trips with PySpark and load it into the
+    staging table
+    """
     import time
+    from pyspark import StorageLevel
+    from pyspark.sql import SparkSession
+    from pyspark.sql.functions import col
+    from tlc_feeds import SERVICE_TYPES
+    from trip_lake import LAKE_ROOT, QUARANTINE_ROOT, spark_quarantine_types, write_month_spark
+    from trip_processing import (
+        REJECT_REASONS_COLUMN, compact_trips_spark, derive_trips_spark, reject_reasons_spark, spark_trip_stats,
+        valid_trip_condition_spark,
+    )
     
-    # Use Supabase PostgreSQL database
-    logging.info("Using Supabase PostgreSQL database")
-    supabase_url = os.getenv("SUPABASE_DATABASE_URL")
+    loader = params.get('loader', 'copy')
     
-    if not supabase_url:
-        logging.error("SUPABASE_DATABASE_URL not set")
-        raise ValueError("SUPABASE_DATABASE_URL environment variable is required")
+    # Set Spark home environment variable
+    os.environ['SPARK_HOME'] = '/opt/spark'
+    os.environ['PATH'] = f"/opt/spark/bin:{os.environ.get('PATH', '')}"
     
-    # Parse the connection URL
-    from urllib.parse import urlparse
-    parsed_url = urlparse(supabase_url)
+    # Create Spark session in local mode (the PostgreSQL JDBC driver is
+    # only fetched when the JDBC loader is selected)
+    builder = SparkSession.builder \
+        .appName("NYC_Taxi_Data_Processing") \
+        .config("spark.master", "local[*]") \
+        .config("spark.driver.memory", "2g") \
+        .config("spark.executor.memory", "2g") \
+        .config("spark.sql.adaptive.enabled", "true") \
+        .config("spark.sql.adaptive.coalescePartitions.enabled", "true")
+    if loader == 'jdbc':
+        builder = builder.config("spark.jars.packages", "org.postgresql:postgresql:42.6.0")
+    spark = builder.getOrCreate()
     
-    db_host = parsed_url.hostname
-    db_port = parsed_url.port or 5432
-    db_name = parsed_url.path.lstrip('/')
-    db_user = parsed_url.username
-    db_password = parsed_url.password
+    # Read the parquet file and derive the cleaned columns once; the derived
+    # frame is cached so the stats aggregation and the load share one scan
+    df = spark.read.parquet(input_file)
+    logging.info(f"Columns: {df.columns}")
     
-    # First, drop and recreate the table with correct schema
-    logging.info("Recreating table with correct schema...")
-    try:
-        import psycopg2
-        conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            sslmode='require'  # SSL required for Supabase
-        )
-        cursor = conn.cursor()
-        cursor.execute("DROP TABLE IF EXISTS taxi_trips CASCADE;")
-        cursor.execute("""
-            CREATE TABLE taxi_trips (
-                id SERIAL PRIMARY KEY,
-                pickup_datetime TIMESTAMP,
-                dropoff_datetime TIMESTAMP,
-                pickup_location_id INTEGER,
-                dropoff_location_id INTEGER,
-                trip_distance DECIMAL(10,2),
-                fare_amount DECIMAL(10,2),
-                tip_amount DECIMAL(10,2),
-                total_amount DECIMAL(10,2),
-                payment_type INTEGER,
-                trip_duration_minutes INTEGER,
-                tip_percentage DECIMAL(8,2),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pickup_datetime ON taxi_trips(pickup_datetime);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_pickup_location ON taxi_trips(pickup_location_id);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_dropoff_location ON taxi_trips(dropoff_location_id);")
-        conn.commit()
-        cursor.close()
-        conn.close()
-        logging.info("Table recreated with correct schema")
-    except Exception as e:
-        logging.warning(f"Could not recreate table: {e}")
+    derived_df = derive_trips_spark(df, feed).persist(StorageLevel.MEMORY_AND_DISK)
     
-    # Process the data using PySpark for better performance
-    logging.info("Processing NYC taxi data with PySpark...")
+    # Counts, per-rule rejects and averages in a single aggregation
+    stats = spark_trip_stats(derived_df, start, end, feed)
+    logging.info(f"Loaded {stats['raw_rows']} records from parquet file")
+    logging.info(f"Processed {stats['total_trips']} valid trips")
     
-    try:
-        # Set Spark home environment variable
-        os.environ['SPARK_HOME'] = '/opt/spark'
-        os.environ['PATH'] = f"/opt/spark/bin:{os.environ.get('PATH', '')}"
+    # Clean and transform the data using Spark SQL
+    processed_df = derived_df.filter(valid_trip_condition_spark(start, end, feed))
+    # The loaders write the taxi_trips column types; the lake keeps decimals
+    stored_df = compact_trips_spark(processed_df, SERVICE_TYPES[feed])
+    
+    if loader == 'jdbc':
+        # Save to database using Spark JDBC
+        logging.info("Saving to database using Spark JDBC...")
         
-        # Create Spark session in local mode with PostgreSQL JDBC driver
-        spark = SparkSession.builder \
-            .appName("NYC_Taxi_Data_Processing") \
-            .config("spark.master", "local[*]") \
-            .config("spark.driver.memory", "2g") \
-            .config("spark.executor.memory", "2g") \
-            .config("spark.sql.adaptive.enabled", "true") \
-            .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
-            .config("spark.jars.packages", "org.postgresql:postgresql:42.6.0") \
-            .getOrCreate()
+        # Same host, credentials and SSL settings as the psycopg2 connections
+        stored_df.write \
+            .format("jdbc") \
+            .options(**jdbc_options(conn_params)) \
+            .option("dbtable", staging_table) \
+            .option("batchsize", 1000) \
+            .mode("append") \
+            .save()
+    else:
+        # Stream each Spark partition into the staging table with COPY,
+        # one connection per partition, running in parallel
+        copy_parallelism = int(params.get('copy_parallelism', 4))
+        logging.info(f"Saving to database using COPY over {copy_parallelism} partitions...")
         
-        # Read the parquet file
-        input_file = '/opt/airflow/data/raw/yellow_tripdata_2025-04.parquet'
-        df = spark.read.parquet(input_file)
+        columns = stored_df.columns
         
-        logging.info(f"Loaded {df.count()} records from parquet file")
-        logging.info(f"Columns: {df.columns}")
+        # Ship the loader module to the Python workers
+        spark.sparkContext.addPyFile(os.path.join(os.path.dirname(__file__), 'bulk_load.py'))
         
-        # Clean and transform the data using Spark SQL
-        processed_df = df.select(
-            col("tpep_pickup_datetime").cast("timestamp").alias("pickup_datetime"),
-            col("tpep_dropoff_datetime").cast("timestamp").alias("dropoff_datetime"),
-            col("PULocationID").cast("integer").alias("pickup_location_id"),
-            col("DOLocationID").cast("integer").alias("dropoff_location_id"),
-            col("trip_distance").cast("decimal(10,2)").alias("trip_distance"),
-            col("fare_amount").cast("decimal(10,2)").alias("fare_amount"),
-            col("tip_amount").cast("decimal(10,2)").alias("tip_amount"),
-            col("total_amount").cast("decimal(10,2)").alias("total_amount"),
-            col("payment_type").cast("integer").alias("payment_type")
-        ).withColumn(
-            "trip_duration_minutes",
-            round((unix_timestamp("dropoff_datetime") - unix_timestamp("pickup_datetime")) / 60, 0).cast("integer")
-        ).withColumn(
-            "tip_percentage",
-            when(col("fare_amount") > 0, round((col("tip_amount") / col("fare_amount")) * 100, 2))
-            .otherwise(lit(0)).cast("decimal(8,2)")
-        ).filter(
-            # Remove invalid data
-            (col("pickup_datetime").isNotNull()) &
-            (col("dropoff_datetime").isNotNull()) &
-            (col("trip_distance") > 0) &
-            (col("fare_amount") > 0) &
-            (col("trip_duration_minutes") > 0) &
-            (col("trip_duration_minutes") <= 180)  # Max 3 hours
-        )
+        def copy_partition(index, rows):
+            import time as partition_time
+            from bulk_load import copy_rows_to_postgres
+            started = partition_time.time()
+            copied = copy_rows_to_postgres(rows, staging_table, columns, conn_params)
+            yield index, copied, partition_time.time() - started
         
-        logging.info(f"Processed {processed_df.count()} valid trips")
+        load_started = time.time()
+        # Each connection loads one pickup-time range in order, so the heap is
+        # made of copy_parallelism time-ordered runs
+        partition_stats = stored_df \
+            .repartitionByRange(copy_parallelism, "pickup_datetime") \
+            .sortWithinPartitions("pickup_datetime") \
+            .rdd \
+            .mapPartitionsWithIndex(copy_partition) \
+            .collect()
+        log_copy_throughput(partition_stats, time.time() - load_started)
+    
+    logging.info("Data successfully saved to database using Spark!")
+    
+    # Keep the cleaned month as zstd Parquet for aggregations that read the lake
+    lake_dir = write_month_spark(processed_df, LAKE_ROOT, feed, start.year, start.month)
+    logging.info(f"Wrote cleaned trips to {lake_dir}")
+    
+    # Keep the rejected rows, with the rules they failed, in quarantine
+    rejected_df = derived_df \
+        .withColumn(REJECT_REASONS_COLUMN, reject_reasons_spark(start, end, feed)) \
+        .filter(col(REJECT_REASONS_COLUMN) != 0)
+    stats['quarantine_dir'] = write_month_spark(
+        rejected_df, QUARANTINE_ROOT, feed, start.year, start.month, spark_quarantine_types()
+    )
+    logging.info(f"Wrote {stats['rejected_rows']} rejected rows to {stats['quarantine_dir']}")
+    
+    # Stop Spark session
+    derived_df.unpersist()
+    spark.stop()
+    
+    return stats
+
+def process_month_with_arrow(input_file, feed, staging_table, start, end, conn_params, params):
+    """
+    Clean one month of a feed's trips with PyArrow and load it into the
+    staging table.
+
+    Record batches are streamed from the parquet file, cleaned with vectorized
+    compute kernels and spilled to disk by pickup day. The days are then
+    sorted one at a time and handed to parallel COPY workers in pickup order
+    while being appended to the Parquet lake, so memory is bounded by a day
+    of trips however large the file (high-volume FHV months hold ~20M), and
+    no JVM is started.
+    """
+    import time
+    import pyarrow.compute as pc
+    from bulk_load import copy_tables_to_postgres
+    from tlc_feeds import SERVICE_TYPES
+    from trip_lake import (
+        LAKE_ROOT, QUARANTINE_ROOT, LakeMonthWriter, MonthSpill, month_spill_dir, quarantine_schema,
+    )
+    from trip_processing import TRIP_RULES, compact_trips_arrow, iter_clean_batches
+    
+    totals = {'raw_rows': 0, 'total_trips': 0, 'fare_sum': 0.0, 'fare_count': 0, 'distance_sum': 0.0,
+              'distance_count': 0, 'tip_percentage_sum': 0.0, 'tip_percentage_count': 0}
+    rejects_by_rule = dict.fromkeys(TRIP_RULES, 0)
+    service_type = SERVICE_TYPES[feed]
+    copy_parallelism = int(params.get('copy_parallelism', 4))
+    
+    # Cleaned and rejected rows are spilled by pickup day, to be sorted a day at a time
+    with MonthSpill(month_spill_dir(LAKE_ROOT, feed, start.year, start.month), start, end) as cleaned, \
+            MonthSpill(month_spill_dir(QUARANTINE_ROOT, feed, start.year, start.month), start, end,
+                       quarantine_schema()) as quarantined:
+        for raw_rows, table in iter_clean_batches(input_file, start, end, feed, reject_counts=rejects_by_rule,
+                                                  quarantine=quarantined):
+            totals['raw_rows'] += raw_rows
+            totals['total_trips'] += table.num_rows
+            # Feeds without fares or distances (FHV) leave them null
+            totals['fare_sum'] += pc.sum(table['fare_amount']).as_py() or 0.0
+            totals['fare_count'] += pc.count(table['fare_amount']).as_py()
+            totals['distance_sum'] += pc.sum(table['trip_distance']).as_py() or 0.0
+            totals['distance_count'] += pc.count(table['trip_distance']).as_py()
+            totals['tip_percentage_sum'] += pc.sum(table['tip_percentage']).as_py() or 0.0
+            totals['tip_percentage_count'] += pc.count(table['tip_percentage']).as_py()
+            cleaned.append(table)
         
-        # Save to database using Spark JDBC
-        logging.info("Saving to database using Spark JDBC...")
+        # The month is loaded in pickup order: the COPY workers take consecutive
+        # slices from one queue, so the heap ends up (nearly) time ordered and
+        # the BRIN index on pickup_datetime stays selective. Each sorted day
+        # also goes to the lake month, which is swapped in once complete
+        logging.info(f"Loading {totals['total_trips']} trips from {input_file} into {staging_table} "
+                     f"in pickup order with {copy_parallelism} COPY workers...")
+        load_started = time.time()
+        with LakeMonthWriter(LAKE_ROOT, feed, start.year, start.month) as lake:
+            def slices():
+                for day in cleaned.iter_sorted():
+                    lake.write(day)
+                    for offset in range(0, day.num_rows, LOAD_SLICE_ROWS):
+                        yield compact_trips_arrow(day.slice(offset, LOAD_SLICE_ROWS), service_type)
+            
+            worker_stats = copy_tables_to_postgres(slices(), staging_table, conn_params, copy_parallelism)
+        log_copy_throughput(worker_stats, time.time() - load_started)
+        logging.info(f"Wrote cleaned trips to {lake.path}")
         
-        # Build JDBC URL with SSL for Supabase
-        jdbc_url = f"jdbc:postgresql://{db_host}:{db_port}/{db_name}?sslmode=require"
+        with LakeMonthWriter(QUARANTINE_ROOT, feed, start.year, start.month, quarantine_schema()) as quarantine:
+            for day in quarantined.iter_sorted():
+                quarantine.write(day)
+    
+    total_trips = totals['total_trips']
+    logging.info(f"Wrote {totals['raw_rows'] - total_trips} rejected rows to {quarantine.path}")
+    
+    logging.info(f"Loaded {totals['raw_rows']} records from parquet file")
+    logging.info(f"Processed {totals['total_trips']} valid trips")
+    
+    return {
+        'raw_rows': totals['raw_rows'],
+        'total_trips': total_trips,
+        'rejected_rows': totals['raw_rows'] - total_trips,
+        'rejects_by_rule': rejects_by_rule,
+        'quarantine_dir': quarantine.path,
+        'avg_fare': totals['fare_sum'] / totals['fare_count'] if totals['fare_count'] else 0.0,
+        'avg_distance': totals['distance_sum'] / totals['distance_count'] if totals['distance_count'] else 0.0,
+        'avg_tip_percentage': (totals['tip_percentage_sum'] / totals['tip_percentage_count']
+                               if totals['tip_percentage_count'] else 0.0),
+    }
+
+def log_copy_throughput(stats, load_seconds):
+    """
+    Log rows/sec for each COPY partition or worker and for the whole load
+    """
+    for index, copied, seconds in sorted(stats):
+        rate = copied / seconds if seconds > 0 else 0
+        logging.info(f"  Partition {index}: {copied} rows in {seconds:.1f}s ({rate:,.0f} rows/sec)")
+    loaded_rows = sum(copied for _, copied, _ in stats)
+    logging.info(f"Copied {loaded_rows} rows in {load_seconds:.1f}s "
+                 f"({loaded_rows / max(load_seconds, 1e-9):,.0f} rows/sec)")
+
+def prepare_taxi_trips(**context):
+    """
+    Create (or, with load_mode='full', recreate) the partitioned taxi_trips
+    table and the partitions of the months this run processes once, before
+    the per-feed, per-month processing tasks run in parallel
+    """
+    from trip_lake import LAKE_ROOT, QUARANTINE_ROOT, adopt_legacy_months
+    
+    load_mode = context.get('params', {}).get('load_mode', 'incremental')
+    months = months_to_process(context)
+    
+    def prepare(cursor):
+        ensure_taxi_trips_table(cursor, load_mode)
+        for year, month in months:
+            ensure_month_partition(cursor, year, month)
+    
+    run_in_transaction(prepare)
+    logging.info(f"taxi_trips ready (load mode: {load_mode})")
+    
+    # Lakes written before they were split by feed only held yellow trips
+    for root in (LAKE_ROOT, QUARANTINE_ROOT):
+        for moved in adopt_legacy_months(root):
+            logging.info(f"Moved {moved} under its feed")
+
+def run_spark_processing(input_file, **context):
+    """
+    Run the processing job for one month of a feed's NYC trip data (PySpark
+    or PyArrow engine) and swap it in as that feed's partition of the month
+    """
+    import subprocess
+    import time
+    
+    # Use Supabase PostgreSQL database; the COPY workers open their own
+    # connections from these parameters
+    logging.info("Using Supabase PostgreSQL database")
+    conn_params = connection_params()
+    
+    # Only the feed and month of the input file are reloaded
+    from tlc_feeds import SERVICE_TYPES, parse_trip_file_name
+    params = context.get('params', {})
+    load_mode = params.get('load_mode', 'incremental')
+    engine = params.get('engine', 'arrow')
+    feed, year, month = parse_trip_file_name(input_file)
+    _, partition_start, partition_end = month_partition_bounds(year, month)
+    partition_name = feed_partition_name(year, month, feed)
+    
+    # Stage an empty table for the feed's month (taxi_trips and the month's
+    # partition are set up by prepare_taxi_trips)
+    logging.info(f"Preparing partition {partition_name} (load mode: {load_mode})...")
+    staging_table = run_in_transaction(prepare_staging_partition, year, month, feed)
+    logging.info(f"Staging table {staging_table} ready")
+    
+    try:
+        started = time.time()
+        with stage('process'):
+            if engine == 'arrow':
+                logging.info(f"Processing NYC {feed} trip data with PyArrow...")
+                summary = process_month_with_arrow(
+                    input_file, feed, staging_table, partition_start, partition_end, conn_params, params
+                )
+            else:
+                # Process the data using PySpark for better performance
+                logging.info(f"Processing NYC {feed} trip data with PySpark...")
+                summary = process_month_with_spark(
+                    input_file, feed, staging_table, partition_start, partition_end, conn_params, params
+                )
+        process_seconds = time.time() - started
+        record_rows(rows_in=summary['raw_rows'], rows_out=summary['total_trips'])
+        logging.info(f"{engine} engine finished in {process_seconds:.1f}s")
         
-        processed_df.write \
-            .format("jdbc") \
-            .option("url", jdbc_url) \
-            .option("dbtable", "taxi_trips") \
-            .option("user", db_user) \
-            .option("password", db_password) \
-            .option("driver", "org.postgresql.Driver") \
-            .option("batchsize", 1000) \
-            .option("sslmode", "require") \
-            .mode("append") \
-            .save()
+        # Vacuum and analyze the loaded month, build its indexes and swap it
+        # into taxi_trips
+        logging.info(f"Swapping {staging_table} in as partition {partition_name}...")
+        swap_started = time.time()
+        with stage('vacuum'):
+            vacuum_staging_partition(year, month, feed)
+        with stage('swap'):
+            run_in_transaction(swap_in_partition, year, month, feed)
+        with stage('analyze'):
+            run_in_transaction(analyze_taxi_trips)
+        swap_seconds = time.time() - swap_started
+        logging.info(f"Partition {partition_name} attached")
         
-        logging.info("Data successfully saved to database using Spark!")
+        # Per-rule reject counts of the month, next to its quarantined rows
+        from trip_quality import write_trip_quality
+        run_in_transaction(write_trip_quality, partition_start, summary, SERVICE_TYPES[feed])
         
-        # Show summary statistics using Spark
-        total_trips = processed_df.count()
-        avg_fare = processed_df.agg({"fare_amount": "avg"}).collect()[0][0]
-        avg_distance = processed_df.agg({"trip_distance": "avg"}).collect()[0][0]
-        avg_tip_percentage = processed_df.agg({"tip_percentage": "avg"}).collect()[0][0]
+        # Summarize the month, all feeds together, into mergeable daily
+        # sketches for quantile and distinct-count rollups over any date range
+        from trip_lake import LAKE_ROOT, iter_lake_batches
+        from trip_sketches import (
+            ALL_ZONES, QUANTILE_METRICS, SKETCH_COLUMNS,
+            build_daily_sketches, describe_sketch, lock_sketch_month, merge_sketches, write_daily_sketches,
+        )
         
-        logging.info(f"Summary Statistics:")
-        logging.info(f"  Total trips processed: {total_trips}")
-        logging.info(f"  Average fare: ${avg_fare:.2f}")
-        logging.info(f"  Average distance: {avg_distance:.2f} miles")
-        logging.info(f"  Average tip percentage: {avg_tip_percentage:.2f}%")
+        def rebuild_sketches(cursor):
+            # The feeds of a month finish concurrently; rebuilding under the
+            # month's lock, the last rebuild reads every feed's lake month
+            lock_sketch_month(cursor, partition_start)
+            with stage('sketch_build'):
+                month_sketches = build_daily_sketches(iter_lake_batches(
+                    LAKE_ROOT, SKETCH_COLUMNS, partition_start.isoformat(), partition_end.isoformat()
+                ))
+            with stage('sketch_write'):
+                return month_sketches, write_daily_sketches(cursor, partition_start, partition_end, month_sketches)
         
-        # Stop Spark session
-        spark.stop()
+        sketch_started = time.time()
+        sketches, sketch_rows = run_in_transaction(rebuild_sketches)
+        sketch_seconds = time.time() - sketch_started
+        logging.info(f"Stored {sketch_rows} daily sketches in {sketch_seconds:.1f}s")
+        
+        logging.info(f"Summary Statistics:")
+        logging.info(f"  Total trips processed: {summary['total_trips']}")
+        logging.info(f"  Rejected rows: {summary['rejected_rows']} "
+                     f"({summary['rejected_rows'] / max(summary['raw_rows'], 1):.2%}, "
+                     f"quarantined in {summary['quarantine_dir']})")
+        for rule, rejected in summary['rejects_by_rule'].items():
+            logging.info(f"    {rule}: {rejected}")
+        logging.info(f"  Average fare: ${summary['avg_fare']:.2f}")
+        logging.info(f"  Average distance: {summary['avg_distance']:.2f} miles")
+        logging.info(f"  Average tip percentage: {summary['avg_tip_percentage']:.2f}%")
+        month_quantiles = {}
+        for metric in QUANTILE_METRICS:
+            month_quantiles[metric] = describe_sketch(metric, merge_sketches(
+                metric, [sketch for (_, zone, name), sketch in sketches.items() if zone == ALL_ZONES and name == metric]
+            ))
+            logging.info(f"  {metric} p50/p90/p99: " + ' / '.join(
+                str(month_quantiles[metric].get(rank, 'n/a')) for rank in ('p50', 'p90', 'p99')
+            ))
         
         logging.info("Data processing completed successfully!")
-        return True
+        
+        # The stats record is returned so it is stored with the run as an XCom
+        return {
+            'engine': engine,
+            'load_mode': load_mode,
+            'input_file': input_file,
+            'service_type': feed,
+            'partition': partition_name,
+            'pickup_start': partition_start.isoformat(),
+            'pickup_end': partition_end.isoformat(),
+            **summary,
+            'quantiles': month_quantiles,
+            'sketch_rows': sketch_rows,
+            'timings': {
+                'process_seconds': round(process_seconds, 3),
+                'swap_seconds': round(swap_seconds, 3),
+                'sketch_seconds': round(sketch_seconds, 3),
+            },
+        }
         
     except Exception as e:
         logging.error(f"Data processing failed: {str(e)}")
@@ -249,18 +747,17 @@ def run_spark_processing(**context):
 
 def download_taxi_zones(**context):
     """
-    Download NYC taxi zone lookup data and GeoJSON boundaries
+    Download NYC taxi zone lookup data
     """
     import requests
     import os
-    import json
     
     # Create data directory if it doesn't exist
-    os.makedirs('/opt/airflow/data/zones', exist_ok=True)
+    os.makedirs(os.path.dirname(ZONE_LOOKUP_FILE), exist_ok=True)
     
     # Download zone lookup CSV
     zone_lookup_url = "https://d37ci6vzurychx.cloudfront.net/misc/taxi+_zone_lookup.csv"
-    zone_lookup_file = "/opt/airflow/data/zones/taxi_zone_lookup.csv"
+    zone_lookup_file = ZONE_LOOKUP_FILE
     
     try:
         logging.info(f"Downloading zone lookup from: {zone_lookup_url}")
@@ -272,25 +769,8 @@ def download_taxi_zones(**context):
         
         logging.info(f"Successfully downloaded zone lookup to: {zone_lookup_file}")
         
-        # Download zone GeoJSON boundaries from NYC Open Data
-        zone_geojson_url = "https://data.cityofnewyork.us/api/geospatial/d3c5-ddgc?method=export&format=GeoJSON"
-        zone_geojson_file = "/opt/airflow/data/zones/taxi_zones.geojson"
-        
-        logging.info(f"Downloading zone GeoJSON from: {zone_geojson_url}")
-        response = requests.get(zone_geojson_url)
-        response.raise_for_status()
-        
-        with open(zone_geojson_file, 'wb') as f:
-            f.write(response.content)
-        
-        logging.info(f"Successfully downloaded zone GeoJSON to: {zone_geojson_file}")
-        
-        return zone_lookup_file, zone_geojson_file
-        
-    except requests.exceptions.HTTPError as e:
-        logging.warning(f"Could not download GeoJSON file: {e}")
-        logging.info("Proceeding with zone lookup only - will create simplified zone mapping")
-        return zone_lookup_file, None
+        # Zone boundaries for the map come from build_zone_geometry_artifacts
+        return zone_lookup_file
         
     except Exception as e:
         logging.error(f"Error downloading zone data: {str(e)}")
@@ -300,311 +780,365 @@ def create_zone_aggregations(**context):
     """
     Create zone-level aggregations for choropleth visualization
     """
-    import pandas as pd
-    import psycopg2
-    import json
-    import os
+    from zone_aggregations import load_zone_lookup, refresh_zone_aggregations
     
     # Use Supabase PostgreSQL database
     logging.info("Using Supabase PostgreSQL database for zone aggregations")
-    supabase_url = os.getenv("SUPABASE_DATABASE_URL")
-    
-    if not supabase_url:
-        logging.error("SUPABASE_DATABASE_URL not set")
-        raise ValueError("SUPABASE_DATABASE_URL environment variable is required")
-    
-    # Parse the connection URL
-    from urllib.parse import urlparse
-    parsed_url = urlparse(supabase_url)
-    
-    db_host = parsed_url.hostname
-    db_port = parsed_url.port or 5432
-    db_name = parsed_url.path.lstrip('/')
-    db_user = parsed_url.username
-    db_password = parsed_url.password
     
     try:
-        # Read zone lookup data
-        zone_lookup_file = "/opt/airflow/data/zones/taxi_zone_lookup.csv"
-        zones_df = pd.read_csv(zone_lookup_file)
-        
-        # Check if GeoJSON file exists
-        zone_geojson_file = "/opt/airflow/data/zones/taxi_zones.geojson"
-        has_geojson = os.path.exists(zone_geojson_file)
-        
-        if has_geojson:
-            logging.info("Using GeoJSON boundaries for zone mapping")
-            # Load GeoJSON for future use (we'll implement this later)
-            with open(zone_geojson_file, 'r') as f:
-                geojson_data = json.load(f)
-        else:
-            logging.info("No GeoJSON file available - using simplified zone mapping")
-            geojson_data = None
-        
-        # Connect to database with SSL for Supabase
-        conn = psycopg2.connect(
-            host=db_host,
-            port=db_port,
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            sslmode='require'  # SSL required for Supabase
-        )
-        
-        # Get pickup zone aggregations
-        pickup_query = """
-        SELECT 
-            pickup_location_id,
-            COUNT(*) as trip_count,
-            SUM(total_amount) as total_revenue,
-            AVG(trip_distance) as avg_distance,
-            AVG(trip_duration_minutes) as avg_duration,
-            AVG(tip_percentage) as avg_tip_percentage
-        FROM taxi_trips 
-        WHERE pickup_location_id IS NOT NULL
-        GROUP BY pickup_location_id
-        """
-        
-        pickup_df = pd.read_sql(pickup_query, conn)
+        # Lake statistics are computed once, outside the (retried) transaction
+        zone_side_stats = None
+        if context.get('params', {}).get('aggregation_source') == 'lake':
+            from trip_lake import LAKE_ROOT, zone_side_stats_from_lake
+            logging.info(f"Computing per-zone statistics from the lake at {LAKE_ROOT}")
+            zone_side_stats = zone_side_stats_from_lake(LAKE_ROOT)
         
-        # Get dropoff zone aggregations
-        dropoff_query = """
-        SELECT 
-            dropoff_location_id,
-            COUNT(*) as trip_count,
-            SUM(total_amount) as total_revenue,
-            AVG(trip_distance) as avg_distance,
-            AVG(trip_duration_minutes) as avg_duration,
-            AVG(tip_percentage) as avg_tip_percentage
-        FROM taxi_trips 
-        WHERE dropoff_location_id IS NOT NULL
-        GROUP BY dropoff_location_id
-        """
-        
-        dropoff_df = pd.read_sql(dropoff_query, conn)
-        
-        # Join with zone names
-        pickup_df = pickup_df.merge(
-            zones_df[['LocationID', 'Zone', 'Borough']], 
-            left_on='pickup_location_id', 
-            right_on='LocationID', 
-            how='left'
-        ).rename(columns={'Zone': 'pickup_zone', 'Borough': 'pickup_borough'})
-        
-        dropoff_df = dropoff_df.merge(
-            zones_df[['LocationID', 'Zone', 'Borough']], 
-            left_on='dropoff_location_id', 
-            right_on='LocationID', 
-            how='left'
-        ).rename(columns={'Zone': 'dropoff_zone', 'Borough': 'dropoff_borough'})
-        
-        # Create zone aggregations table
-        cursor = conn.cursor()
-        cursor.execute("DROP TABLE IF EXISTS zone_aggregations CASCADE;")
-        cursor.execute("""
-            CREATE TABLE zone_aggregations (
-                location_id INTEGER PRIMARY KEY,
-                zone_name VARCHAR(255),
-                borough VARCHAR(100),
-                pickup_trips INTEGER,
-                pickup_revenue DECIMAL(12,2),
-                pickup_avg_distance DECIMAL(8,2),
-                pickup_avg_duration DECIMAL(8,2),
-                pickup_avg_tip DECIMAL(8,2),
-                dropoff_trips INTEGER,
-                dropoff_revenue DECIMAL(12,2),
-                dropoff_avg_distance DECIMAL(8,2),
-                dropoff_avg_duration DECIMAL(8,2),
-                dropoff_avg_tip DECIMAL(8,2),
-                total_trips INTEGER,
-                total_revenue DECIMAL(12,2),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
-        """)
-        
-        # Combine pickup and dropoff data
-        combined_df = pd.merge(
-            pickup_df, 
-            dropoff_df, 
-            left_on='pickup_location_id', 
-            right_on='dropoff_location_id', 
-            how='outer',
-            suffixes=('_pickup', '_dropoff')
-        )
-        
-        # Fill NaN values
-        combined_df = combined_df.fillna(0)
-        
-        # Calculate totals
-        combined_df['total_trips'] = combined_df['trip_count_pickup'] + combined_df['trip_count_dropoff']
-        combined_df['total_revenue'] = combined_df['total_revenue_pickup'] + combined_df['total_revenue_dropoff']
-        
-        # Insert data into zone_aggregations table
-        for _, row in combined_df.iterrows():
-            location_id = row.get('pickup_location_id') or row.get('dropoff_location_id')
-            zone_name = row.get('pickup_zone') or row.get('dropoff_zone') or 'Unknown'
-            borough = row.get('pickup_borough') or row.get('dropoff_borough') or 'Unknown'
-            
-            cursor.execute("""
-                INSERT INTO zone_aggregations (
-                    location_id, zone_name, borough,
-                    pickup_trips, pickup_revenue, pickup_avg_distance, pickup_avg_duration, pickup_avg_tip,
-                    dropoff_trips, dropoff_revenue, dropoff_avg_distance, dropoff_avg_duration, dropoff_avg_tip,
-                    total_trips, total_revenue
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                location_id,
-                zone_name,
-                borough,
-                row['trip_count_pickup'],
-                row['total_revenue_pickup'],
-                row['avg_distance_pickup'],
-                row['avg_duration_pickup'],
-                row['avg_tip_percentage_pickup'],
-                row['trip_count_dropoff'],
-                row['total_revenue_dropoff'],
-                row['avg_distance_dropoff'],
-                row['avg_duration_dropoff'],
-                row['avg_tip_percentage_dropoff'],
-                row['total_trips'],
-                row['total_revenue']
-            ))
+        # Refresh the zone lookup and aggregate pickups and dropoffs in a
+        # single server-side pass; nothing trip-level crosses the wire.
+        # Zone lookup data is joined inside the database
+        def refresh(cursor):
+            load_zone_lookup(cursor, ZONE_LOOKUP_FILE)
+            if zone_side_stats is not None:
+                return refresh_zone_aggregations(cursor, zone_side_stats)
+            return refresh_zone_aggregations(cursor)
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+        zone_count = run_in_transaction(refresh)
         
-        logging.info(f"Created zone aggregations for {len(combined_df)} zones")
+        logging.info(f"Created zone aggregations for {zone_count} zones")
+        record_rows(rows_out=zone_count)
         return True
         
     except Exception as e:
         logging.error(f"Error creating zone aggregations: {str(e)}")
         raise
 
+def build_zone_geometry_artifacts(**context):
+    """
+    Build the simplified, content-hashed zone geometry served to the map,
+    if taxi_zones.shp changed since the last build
+    """
+    from zone_geometry import ZONE_GEOMETRY_DIR, build_zone_geometry
+    
+    manifest = build_zone_geometry()
+    for level, entry in manifest['levels'].items():
+        logging.info(f"Zone geometry {level}: {ZONE_GEOMETRY_DIR}/{entry['file']} "
+                     f"({entry['bytes']} bytes, {entry['vertices']} vertices)")
+    return manifest['levels']
+
+def loaded_pickup_ranges(context):
+    """
+    Return the distinct [pickup_start, pickup_end) ranges loaded by this
+    run's processing tasks, or None if everything should be recomputed (a full
+    reload, or no stats XCom to go by)
+    """
+    loaded = context['ti'].xcom_pull(task_ids='spark_processing_task') if 'ti' in context else None
+    # A mapped processing task yields one stats record per month
+    records = [loaded] if isinstance(loaded, dict) else list(loaded or [])
+    if not records or any(
+        not isinstance(record, dict) or not record.get('pickup_start') or record.get('load_mode') == 'full'
+        for record in records
+    ):
+        return None
+    # The feeds of a month share its pickup range
+    return sorted({(record['pickup_start'], record['pickup_end']) for record in records})
+
 def create_summary_stats(**context):
     """
     Aggregate daily summary statistics and upsert into summary table.
     """
-    import psycopg2
-    import os
-    from urllib.parse import urlparse
-
-    supabase_url = os.getenv("SUPABASE_DATABASE_URL")
-    if not supabase_url:
-        raise ValueError("SUPABASE_DATABASE_URL environment variable is required")
-
-    parsed_url = urlparse(supabase_url)
-    db_host = parsed_url.hostname
-    db_port = parsed_url.port or 5432
-    db_name = parsed_url.path.lstrip('/')
-    db_user = parsed_url.username
-    db_password = parsed_url.password
-
-    conn = psycopg2.connect(
-        host=db_host,
-        port=db_port,
-        database=db_name,
-        user=db_user,
-        password=db_password,
-        sslmode='require'
-    )
-    cursor = conn.cursor()
+    def refresh_daily_summary(cursor):
+        # Daily rows hold sums and counts so any range of days can be combined
+        # exactly (averages are derived at query time)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS taxi_trip_summary (
+                stat_date DATE PRIMARY KEY,
+                total_trips INTEGER,
+                total_revenue DECIMAL(14,2)
+            );
+        """)
+        cursor.execute("""
+            ALTER TABLE taxi_trip_summary
+                ADD COLUMN IF NOT EXISTS fare_sum DECIMAL(14,2),
+                ADD COLUMN IF NOT EXISTS fare_count INTEGER,
+                ADD COLUMN IF NOT EXISTS tip_sum DECIMAL(14,2),
+                ADD COLUMN IF NOT EXISTS tip_count INTEGER,
+                ADD COLUMN IF NOT EXISTS distance_sum DECIMAL(14,2),
+                ADD COLUMN IF NOT EXISTS distance_count INTEGER,
+                DROP COLUMN IF EXISTS avg_fare,
+                DROP COLUMN IF EXISTS avg_tip,
+                DROP COLUMN IF EXISTS avg_distance;
+        """)
 
-    # Upsert daily stats
-    cursor.execute("""
-        INSERT INTO taxi_trip_summary (stat_date, total_trips, avg_fare, avg_tip, total_revenue, avg_distance)
-        SELECT
-            DATE(pickup_datetime) as stat_date,
-            COUNT(*) as total_trips,
-            AVG(fare_amount) as avg_fare,
-            AVG(tip_amount) as avg_tip,
-            SUM(total_amount) as total_revenue,
-            AVG(trip_distance) as avg_distance
-        FROM taxi_trips
-        GROUP BY stat_date
-        ON CONFLICT (stat_date) DO UPDATE
-          SET total_trips = EXCLUDED.total_trips,
-              avg_fare = EXCLUDED.avg_fare,
-              avg_tip = EXCLUDED.avg_tip,
-              total_revenue = EXCLUDED.total_revenue,
-              avg_distance = EXCLUDED.avg_distance;
-    """)
-    conn.commit()
+        # Only the days loaded by this run are recomputed; the pickup ranges come
+        # from the processing tasks and are served by partition pruning and the
+        # partitions' pickup_brin index (TAXI_TRIPS_INDEXES). Without them (or
+        # after a full reload) every day is, as after adding the fare and
+        # distance counts (feeds such as FHV report neither, so averages are
+        # taken over the trips that do).
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM taxi_trip_summary WHERE fare_count IS NULL);")
+        pickup_ranges = None if cursor.fetchone()[0] else loaded_pickup_ranges(context)
+        if pickup_ranges:
+            scopes = []
+            for pickup_start, pickup_end in pickup_ranges:
+                logging.info(f"Recomputing daily stats for pickups in [{pickup_start}, {pickup_end})")
+                cursor.execute("""
+                    DELETE FROM taxi_trip_summary
+                    WHERE stat_date >= DATE(%(start)s) AND stat_date < DATE(%(end)s);
+                """, {'start': pickup_start, 'end': pickup_end})
+                scopes.append((
+                    "WHERE pickup_datetime >= %(start)s AND pickup_datetime < %(end)s",
+                    {'start': pickup_start, 'end': pickup_end},
+                ))
+        else:
+            logging.info("Recomputing daily stats for all days")
+            cursor.execute("DELETE FROM taxi_trip_summary;")
+            scopes = [("", {})]
+
+        # Upsert daily stats, aggregated either by Postgres or from the lake
+        aggregation_source = context.get('params', {}).get('aggregation_source', 'postgres')
+        upserted = 0
+        for range_filter, range_params in scopes:
+            if aggregation_source == 'lake':
+                from bulk_load import copy_arrow_table
+                from trip_lake import LAKE_ROOT, daily_summary_from_lake
+                daily = daily_summary_from_lake(LAKE_ROOT, range_params.get('start'), range_params.get('end'))
+                if daily is None:
+                    continue
+                cursor.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS taxi_trip_summary_lake
+                    (LIKE taxi_trip_summary) ON COMMIT DROP;
+                    TRUNCATE taxi_trip_summary_lake;
+                """)
+                copy_arrow_table(cursor, daily, 'taxi_trip_summary_lake')
+                daily_select = """
+                    SELECT stat_date, total_trips, total_revenue, fare_sum, fare_count, tip_sum, tip_count,
+                           distance_sum, distance_count
+                    FROM taxi_trip_summary_lake
+                """
+            else:
+                daily_select = f"""
+                    SELECT
+                        DATE(pickup_datetime) as stat_date,
+                        COUNT(*) as total_trips,
+                        SUM(total_cents) / 100.0 as total_revenue,
+                        SUM(fare_cents) / 100.0 as fare_sum,
+                        COUNT(fare_cents) as fare_count,
+                        SUM(tip_cents) / 100.0 as tip_sum,
+                        COUNT(tip_cents) as tip_count,
+                        SUM(trip_distance::float8) as distance_sum,
+                        COUNT(trip_distance) as distance_count
+                    FROM taxi_trips
+                    {range_filter}
+                    GROUP BY stat_date
+                """
+            cursor.execute(f"""
+                INSERT INTO taxi_trip_summary
+                    (stat_date, total_trips, total_revenue, fare_sum, fare_count, tip_sum, tip_count,
+                     distance_sum, distance_count)
+                {daily_select}
+                ON CONFLICT (stat_date) DO UPDATE
+                  SET total_trips = EXCLUDED.total_trips,
+                      total_revenue = EXCLUDED.total_revenue,
+                      fare_sum = EXCLUDED.fare_sum,
+                      fare_count = EXCLUDED.fare_count,
+                      tip_sum = EXCLUDED.tip_sum,
+                      tip_count = EXCLUDED.tip_count,
+                      distance_sum = EXCLUDED.distance_sum,
+                      distance_count = EXCLUDED.distance_count;
+            """, range_params)
+            upserted += cursor.rowcount
+        return upserted
+
+    upserted = run_in_transaction(refresh_daily_summary)
+    logging.info(f"Upserted {upserted} daily summary rows")
+    record_rows(rows_out=upserted)
     # Check for duplicates (should never happen with PRIMARY KEY, but for safety/logging)
-    cursor.execute("""
-        SELECT stat_date, COUNT(*) 
-        FROM taxi_trip_summary 
-        GROUP BY stat_date 
-        HAVING COUNT(*) > 1;
-    """)
-    duplicates = cursor.fetchall()
+    with transaction() as cursor:
+        cursor.execute("""
+            SELECT stat_date, COUNT(*) 
+            FROM taxi_trip_summary 
+            GROUP BY stat_date 
+            HAVING COUNT(*) > 1;
+        """)
+        duplicates = cursor.fetchall()
     if duplicates:
         logging.warning(f"Duplicate summary rows found: {duplicates}")
     else:
         logging.info("No duplicate summary rows found in taxi_trip_summary.")
-    cursor.close()
-    conn.close()
 
-def update_streamlit_metrics(**context):
+def create_trip_rollups(**context):
     """
-    Update Streamlit metrics and trigger dashboard refresh
+    Refresh the hourly/daily rollup tables that serve the analytics API.
     """
-    import requests
-    import time
-    
-    # Wait a bit for the database to be updated
-    time.sleep(5)
-    
-    # In a real scenario, you might trigger a Streamlit app refresh
-    # For now, we'll just log that metrics should be updated
-    logging.info("Streamlit metrics should be refreshed with new data")
-    
-    # You could also make an API call to refresh the Streamlit app
-    # requests.post('http://streamlit:8501/_stcore/forward')
+    from trip_rollups import refresh_trip_rollups
+
+    # Same scoping as the daily summary: only the loaded months are rebuilt
+    # unless this was a full reload
+    pickup_ranges = loaded_pickup_ranges(context)
+
+    def refresh(cursor):
+        if not pickup_ranges:
+            logging.info("Rebuilding trip rollups for all trips")
+            return refresh_trip_rollups(cursor)
+        row_counts = {}
+        for pickup_start, pickup_end in pickup_ranges:
+            logging.info(f"Rebuilding trip rollups for pickups in [{pickup_start}, {pickup_end})")
+            for table, rows in refresh_trip_rollups(cursor, pickup_start, pickup_end).items():
+                row_counts[table] = row_counts.get(table, 0) + rows
+        return row_counts
+
+    row_counts = run_in_transaction(refresh)
+    for table, rows in row_counts.items():
+        logging.info(f"Wrote {rows} rows to {table}")
+    record_rows(rows_out=sum(row_counts.values()))
+    return row_counts
+
+def create_od_matrix(**context):
+    """
+    Build the origin-destination matrix of each processed month from the
+    lake and store it in trip_od_matrix
+    """
+    from datetime import date
+    from od_matrix import OD_COLUMNS, build_od_matrix, write_od_matrix
+    from trip_lake import LAKE_ROOT, iter_lake_batches
+
+    row_counts = {}
+    for year, month in months_to_process(context):
+        month_start = date(year, month, 1)
+        month_end = date(year + month // 12, month % 12 + 1, 1)
+        matrix = build_od_matrix(iter_lake_batches(
+            LAKE_ROOT, OD_COLUMNS, month_start.isoformat(), month_end.isoformat()
+        ))
+        rows = run_in_transaction(write_od_matrix, month_start, matrix)
+        row_counts[f"{year}-{month:02d}"] = rows
+        record_rows(rows_in=int(matrix['trips'].sum()) + matrix['skipped'], rows_out=rows)
+        logging.info(f"OD matrix {year}-{month:02d}: {int(matrix['trips'].sum())} trips in "
+                     f"{int((matrix['trips'] > 0).sum())} cells, {rows} rows "
+                     f"({matrix['skipped']} trips without both zones skipped)")
+
+    return row_counts
+
+def export_trip_extracts(**context):
+    """
+    Publish each processed month's trips as downloadable Parquet/CSV.gz
+    extracts, streamed out of taxi_trips with COPY
+    """
+    from trip_export import EXPORT_DIR, publish_month_extracts
+
+    formats = context.get('params', {}).get('export_formats', ['parquet', 'csv.gz'])
+    if not formats:
+        logging.info("No export formats requested; skipping trip extracts")
+        return {}
+    extracts = {}
+    for year, month in months_to_process(context):
+        entry = publish_month_extracts(year, month, formats)
+        extracts[f"{year}-{month:02d}"] = entry['rows']
+        record_rows(rows_out=entry['rows'])
+        for export_format, parts in entry['files'].items():
+            logging.info(f"Trip extract {year}-{month:02d} {export_format}: {len(parts)} files, "
+                         f"{sum(part['bytes'] for part in parts)} bytes under {EXPORT_DIR}")
+    return extracts
+
+def publish_new_data_version(**context):
+    """
+    Refresh the dashboard's materialized views and bump the data version,
+    notifying the API's result caches once the new data is committed
+    """
+    from dashboard_views import DATA_VERSION_CHANNEL, publish_data_version
     
-    return "Metrics updated successfully"
+    run_id = context['dag_run'].run_id if context.get('dag_run') else None
+    months = [f"{year}-{month:02d}" for year, month in months_to_process(context)]
+    version, row_counts = run_in_transaction(publish_data_version, run_id, months)
+    for view, rows in row_counts.items():
+        logging.info(f"Refreshed {view}: {rows} rows")
+    logging.info(f"Published data version {version} on {DATA_VERSION_CHANNEL} for {', '.join(months)}")
+    record_rows(rows_out=sum(row_counts.values()))
+    return version
 
-# Task 1: Download NYC taxi data
+# Task 1: Download NYC taxi data for the months this run processes
 download_data_task = PythonOperator(
     task_id='download_data_task',
-    python_callable=download_nyc_taxi_data,
+    python_callable=instrument(download_nyc_taxi_data),
     dag=dag,
 )
 
-# Task 2: Run PySpark processing (includes table creation)
-spark_processing_task = PythonOperator(
-    task_id='spark_processing_task',
-    python_callable=run_spark_processing,
+# Task 2: Create the partitioned taxi_trips table
+prepare_taxi_trips_task = PythonOperator(
+    task_id='prepare_taxi_trips_task',
+    python_callable=instrument(prepare_taxi_trips),
     dag=dag,
 )
 
-# Task 3: Download taxi zone data
+# Task 3: Process each downloaded file (a month of one feed) as its own
+# mapped task instance, each loading its own partition. Every instance opens
+# copy_parallelism connections, so the number running at once is capped.
+spark_processing_task = PythonOperator.partial(
+    task_id='spark_processing_task',
+    python_callable=instrument(run_spark_processing),
+    max_active_tis_per_dagrun=MAX_PARALLEL_MONTHS,
+    dag=dag,
+).expand(op_kwargs=download_data_task.output.map(lambda input_file: {'input_file': input_file}))
+
+# Task 4: Download taxi zone data
 download_zones_task = PythonOperator(
     task_id='download_zones_task',
-    python_callable=download_taxi_zones,
+    python_callable=instrument(download_taxi_zones),
+    dag=dag,
+)
+
+# Task 4b: Build the simplified zone geometry served to the map
+zone_geometry_task = PythonOperator(
+    task_id='zone_geometry_task',
+    python_callable=instrument(build_zone_geometry_artifacts),
     dag=dag,
 )
 
-# Task 4: Create zone aggregations
+# Task 5: Create zone aggregations
 zone_aggregations_task = PythonOperator(
     task_id='zone_aggregations_task',
-    python_callable=create_zone_aggregations,
+    python_callable=instrument(create_zone_aggregations),
     dag=dag,
 )
 
-# Task 5: Aggregate daily summary statistics
+# Task 6: Aggregate daily summary statistics
 summary_stats_task = PythonOperator(
     task_id='summary_stats_task',
-    python_callable=create_summary_stats,
+    python_callable=instrument(create_summary_stats),
+    dag=dag,
+)
+
+# Task 7: Refresh the rollups behind the analytics API
+trip_rollups_task = PythonOperator(
+    task_id='trip_rollups_task',
+    python_callable=instrument(create_trip_rollups),
+    dag=dag,
+)
+
+# Task 7b: Build the origin-destination matrix of each processed month
+od_matrix_task = PythonOperator(
+    task_id='od_matrix_task',
+    python_callable=instrument(create_od_matrix),
+    dag=dag,
+)
+
+# Task 7c: Publish downloadable trip extracts of each processed month
+export_trips_task = PythonOperator(
+    task_id='export_trips_task',
+    python_callable=instrument(export_trip_extracts),
     dag=dag,
 )
 
-# Task 6: Update Streamlit metrics
-update_metrics_task = PythonOperator(
-    task_id='update_metrics_task',
-    python_callable=update_streamlit_metrics,
+# Task 8: Refresh the dashboard views and publish the new data version, once
+# everything the dashboard reads is rebuilt
+publish_data_version_task = PythonOperator(
+    task_id='publish_data_version_task',
+    python_callable=instrument(publish_new_data_version),
     dag=dag,
 )
 
-# Define task dependencies (removed create_tables_task since it's handled in spark_processing_task)
-download_data_task >> spark_processing_task >> download_zones_task >> zone_aggregations_task >> summary_stats_task >> update_metrics_task 
\ No newline at end of file
+# Define task dependencies
+download_data_task >> prepare_taxi_trips_task >> spark_processing_task >> download_zones_task >> zone_aggregations_task >> summary_stats_task >> publish_data_version_task
+spark_processing_task >> trip_rollups_task >> publish_data_version_task
+spark_processing_task >> od_matrix_task >> publish_data_version_task
+spark_processing_task >> export_trips_task >> publish_data_version_task
+download_zones_task >> zone_geometry_task 
\ No newline at end of file
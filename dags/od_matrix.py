@@ -0,0 +1,155 @@
+"""
+Origin-destination flows per hour of the week.
+
+build_od_matrix() turns a month of cleaned trips into dense 168 x 265 x 265
+NumPy arrays (hour of week, pickup zone, dropoff zone) of trip counts,
+revenue and median trip duration. Counts and revenue are accumulated with
+np.bincount over a flat cell index; medians come from one sort of the
+month's durations by cell.
+
+The month is stored in trip_od_matrix with one row per (month, pickup zone,
+hour of week) holding parallel arrays over the dropoff zones that saw trips,
+so "top destinations from zone X at 8am on weekdays" reads a handful of rows
+by primary key instead of scanning taxi_trips.
+
+Hours of the week count from Monday 00:00 (0) to Sunday 23:00 (167), in
+the local time the TLC timestamps are recorded in.
+"""
+import io
+
+import numpy as np
+
+ZONE_COUNT = 265
+HOURS_OF_WEEK = 7 * 24
+OD_CELLS = HOURS_OF_WEEK * ZONE_COUNT * ZONE_COUNT
+OD_COLUMNS = ['pickup_datetime', 'pickup_location_id', 'dropoff_location_id', 'total_amount', 'trip_duration_minutes']
+
+OD_MATRIX_DDL = """
+    CREATE TABLE IF NOT EXISTS trip_od_matrix (
+        month DATE NOT NULL,
+        pickup_location_id SMALLINT NOT NULL,
+        hour_of_week SMALLINT NOT NULL,
+        dropoff_location_ids SMALLINT[] NOT NULL,
+        trips INTEGER[] NOT NULL,
+        revenue DECIMAL(14,2)[] NOT NULL,
+        median_duration_minutes REAL[] NOT NULL,
+        PRIMARY KEY (month, pickup_location_id, hour_of_week)
+    );
+"""
+
+# 1970-01-01 was a Thursday, three days after a Monday
+_EPOCH_WEEKDAY = 3
+_MICROSECONDS_PER_HOUR = 3600 * 1000 * 1000
+
+
+def hour_of_week(pickup_datetime):
+    """Hour of the week (Monday 00:00 = 0) for a datetime64 array"""
+    hours = pickup_datetime.astype('datetime64[us]').astype(np.int64) // _MICROSECONDS_PER_HOUR
+    return ((hours // 24 + _EPOCH_WEEKDAY) % 7) * 24 + hours % 24
+
+
+def _batch_cells(batch):
+    """Flat OD cell index, revenue and duration of a batch's trips with known zones"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    def column(name, fill, arrow_type):
+        return pc.fill_null(pc.cast(batch.column(name), arrow_type), fill).to_numpy(zero_copy_only=False)
+
+    pickup = column('pickup_location_id', 0, pa.int32())
+    dropoff = column('dropoff_location_id', 0, pa.int32())
+    duration = column('trip_duration_minutes', -1, pa.int32())
+    known = (pickup >= 1) & (pickup <= ZONE_COUNT) & (dropoff >= 1) & (dropoff <= ZONE_COUNT) & (duration >= 0)
+    known &= pc.is_valid(batch.column('pickup_datetime')).to_numpy(zero_copy_only=False)
+
+    hours = hour_of_week(batch.column('pickup_datetime').to_numpy(zero_copy_only=False)[known])
+    cells = (hours * ZONE_COUNT + pickup[known] - 1) * ZONE_COUNT + dropoff[known] - 1
+    revenue = column('total_amount', 0.0, pa.float64())[known]
+    return cells.astype(np.int32), revenue, duration[known], int(np.count_nonzero(~known))
+
+
+def build_od_matrix(batches):
+    """
+    Accumulate record batches (OD_COLUMNS) into dense arrays shaped
+    (HOURS_OF_WEEK, ZONE_COUNT, ZONE_COUNT): 'trips' (int64), 'revenue'
+    (float64) and 'median_duration_minutes' (float32, NaN for empty cells).
+    Zone n is at index n - 1. 'skipped' counts trips without both zones.
+    """
+    cells, revenue, duration = [], [], []
+    skipped = 0
+    for batch in batches:
+        if batch.num_rows:
+            batch_cells, batch_revenue, batch_duration, batch_skipped = _batch_cells(batch)
+            cells.append(batch_cells)
+            revenue.append(batch_revenue)
+            duration.append(batch_duration)
+            skipped += batch_skipped
+    cells = np.concatenate(cells) if cells else np.empty(0, dtype=np.int32)
+    revenue = np.concatenate(revenue) if revenue else np.empty(0)
+    duration = np.concatenate(duration) if duration else np.empty(0, dtype=np.int32)
+
+    trips = np.bincount(cells, minlength=OD_CELLS)
+    revenue_sum = np.bincount(cells, weights=revenue, minlength=OD_CELLS)
+
+    # Sort durations by cell; each occupied cell is then one contiguous run
+    # and its median (as percentile_cont(0.5)) sits in the middle
+    sorted_duration = duration[np.lexsort((duration, cells))].astype(np.float32)
+    occupied = np.flatnonzero(trips)
+    counts = trips[occupied]
+    starts = np.cumsum(counts) - counts
+    median = np.full(OD_CELLS, np.nan, dtype=np.float32)
+    median[occupied] = (sorted_duration[starts + (counts - 1) // 2] + sorted_duration[starts + counts // 2]) / 2
+
+    shape = (HOURS_OF_WEEK, ZONE_COUNT, ZONE_COUNT)
+    return {
+        'trips': trips.reshape(shape),
+        'revenue': revenue_sum.reshape(shape),
+        'median_duration_minutes': median.reshape(shape),
+        'skipped': skipped,
+    }
+
+
+def _array_literal(values, format_value=str):
+    return '{' + ','.join(map(format_value, values)) + '}'
+
+
+def write_od_matrix(cursor, month_start, matrix):
+    """
+    Replace one month of trip_od_matrix (month_start is the month's first
+    day) with a build_od_matrix() result. Returns the number of rows written.
+    """
+    trips = matrix['trips'].ravel()
+    occupied = np.flatnonzero(trips)
+    # Occupied cells are in (hour, pickup, dropoff) order, so each
+    # (hour, pickup) row is one contiguous run of dropoffs
+    row_keys = occupied // ZONE_COUNT
+    row_starts = np.flatnonzero(np.r_[True, row_keys[1:] != row_keys[:-1]])
+    row_ends = np.r_[row_starts[1:], len(occupied)]
+
+    dropoffs = (occupied % ZONE_COUNT + 1).tolist()
+    cell_trips = trips[occupied].tolist()
+    revenue = matrix['revenue'].ravel()[occupied].tolist()
+    median = matrix['median_duration_minutes'].ravel()[occupied].tolist()
+
+    buffer = io.StringIO()
+    for start, end in zip(row_starts.tolist(), row_ends.tolist()):
+        hour, pickup = divmod(int(row_keys[start]), ZONE_COUNT)
+        buffer.write('\t'.join((
+            str(month_start),
+            str(pickup + 1),
+            str(hour),
+            _array_literal(dropoffs[start:end]),
+            _array_literal(cell_trips[start:end]),
+            _array_literal(revenue[start:end], '{:.2f}'.format),
+            _array_literal(median[start:end], '{:g}'.format),
+        )) + '\n')
+
+    cursor.execute(OD_MATRIX_DDL)
+    cursor.execute("DELETE FROM trip_od_matrix WHERE month = %s;", (month_start,))
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY trip_od_matrix (month, pickup_location_id, hour_of_week, dropoff_location_ids, "
+        "trips, revenue, median_duration_minutes) FROM STDIN",
+        buffer,
+    )
+    return len(row_starts)
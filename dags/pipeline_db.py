@@ -0,0 +1,222 @@
+"""
+Database access for the NYC taxi DAG.
+
+Every task reaches Postgres (Supabase in production) through
+SUPABASE_DATABASE_URL. This module parses it once and gives the tasks:
+
+- connection_params(): psycopg2 keyword arguments for the URL, with
+  sslmode 'require' unless the URL's query string sets another (e.g.
+  ?sslmode=disable for the local benchmark database), and TCP keepalives
+  so long COPYs survive idle NAT timeouts. The dict is plain and picklable,
+  so COPY workers and Spark executors can open their own connections.
+- a per-process connection pool. A task reuses one SSL session for all
+  its statements instead of paying a handshake per step.
+- transaction(): a pooled connection's cursor that commits on success,
+  rolls back on error and always returns the connection to the pool.
+- run_in_transaction(work, ...): runs work(cursor, ...) in a transaction
+  and retries the whole transaction with exponential backoff on transient
+  errors (dropped connections, pooler restarts, serialization failures,
+  deadlocks). work must be safe to repeat; the DAG's steps replace whole
+  partitions and date ranges, so they are.
+- run_outside_transaction(): statements Postgres refuses inside a
+  transaction block, such as VACUUM, in autocommit mode (also retried).
+- iter_rows(): large reads through a server-side (named) cursor, fetched
+  itersize rows at a time.
+- jdbc_options(): the same settings for Spark's JDBC writer.
+
+Cursors count their round trips into the running task's metrics
+(pipeline_metrics.TimedCursor).
+
+Named cursors only live inside a transaction. Supabase's session pooler
+(port 5432) supports them; its transaction pooler (port 6543) also works,
+as long as each iter_rows() is consumed before its transaction ends.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.errorcodes
+import psycopg2.pool
+
+from pipeline_metrics import TimedCursor
+
+DATABASE_URL_ENV = 'SUPABASE_DATABASE_URL'
+POOL_MAX_CONNECTIONS = 8
+RETRY_ATTEMPTS = 4
+RETRY_BACKOFF_SECONDS = 1.0
+
+# SQLSTATEs worth retrying: the transaction failed but may succeed if rerun
+TRANSIENT_ERROR_CODES = {
+    psycopg2.errorcodes.SERIALIZATION_FAILURE,
+    psycopg2.errorcodes.DEADLOCK_DETECTED,
+    psycopg2.errorcodes.ADMIN_SHUTDOWN,
+    psycopg2.errorcodes.CRASH_SHUTDOWN,
+    psycopg2.errorcodes.CANNOT_CONNECT_NOW,
+    psycopg2.errorcodes.TOO_MANY_CONNECTIONS,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def connection_params(database_url=None):
+    """psycopg2.connect() keyword arguments for database_url (default: SUPABASE_DATABASE_URL)"""
+    from urllib.parse import parse_qs, urlparse
+
+    database_url = database_url or os.getenv(DATABASE_URL_ENV)
+    if not database_url:
+        raise ValueError(f"{DATABASE_URL_ENV} environment variable is required")
+    parsed_url = urlparse(database_url)
+    return dict(
+        host=parsed_url.hostname,
+        port=parsed_url.port or 5432,
+        database=parsed_url.path.lstrip('/'),
+        user=parsed_url.username,
+        password=parsed_url.password,
+        # SSL required for Supabase
+        sslmode=parse_qs(parsed_url.query).get('sslmode', ['require'])[0],
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=5,
+    )
+
+
+def jdbc_options(conn_params):
+    """Spark JDBC writer options for connection_params()"""
+    return {
+        'url': f"jdbc:postgresql://{conn_params['host']}:{conn_params['port']}/{conn_params['database']}"
+               f"?sslmode={conn_params['sslmode']}&tcpKeepAlive=true",
+        'user': conn_params['user'],
+        'password': conn_params['password'],
+        'driver': 'org.postgresql.Driver',
+    }
+
+
+def is_transient(error):
+    """Whether a psycopg2 error is worth retrying the transaction for"""
+    if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+        return True
+    return getattr(error, 'pgcode', None) in TRANSIENT_ERROR_CODES
+
+
+def _retrying(action, attempts, backoff):
+    for attempt in range(1, attempts + 1):
+        try:
+            return action()
+        except psycopg2.Error as e:
+            if attempt == attempts or not is_transient(e):
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            message = str(e).strip().splitlines()[0] if str(e).strip() else ''
+            logging.warning(f"Transient database error ({e.__class__.__name__}: {message}); "
+                            f"retrying in {delay:.1f}s (attempt {attempt + 1}/{attempts})")
+            time.sleep(delay)
+
+
+def _pool(database_url=None):
+    """The connection pool for database_url in this process"""
+    params = connection_params(database_url)
+    key = (os.getpid(), params['host'], params['port'], params['database'], params['user'])
+    with _pools_lock:
+        if key not in _pools:
+            # Connections of a forked parent's pool belong to the parent
+            _pools[key] = psycopg2.pool.ThreadedConnectionPool(
+                0, POOL_MAX_CONNECTIONS, cursor_factory=TimedCursor, **params
+            )
+        return _pools[key]
+
+
+def close_pools():
+    """Close every pooled connection opened by this process"""
+    with _pools_lock:
+        for key in [key for key in _pools if key[0] == os.getpid()]:
+            _pools.pop(key).closeall()
+
+
+atexit.register(close_pools)
+
+
+@contextmanager
+def connection(database_url=None, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF_SECONDS):
+    """
+    A pooled connection, opened (with retries) if the pool has none idle.
+    Any open transaction is rolled back when the block exits; broken
+    connections are discarded instead of returned.
+    """
+    pool = _pool(database_url)
+    conn = _retrying(pool.getconn, attempts, backoff)
+    try:
+        yield conn
+    finally:
+        broken = bool(conn.closed)
+        if not broken:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        pool.putconn(conn, close=broken)
+
+
+@contextmanager
+def transaction(database_url=None):
+    """A cursor in a transaction on a pooled connection; committed if the block succeeds"""
+    with connection(database_url) as conn:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        finally:
+            cursor.close()
+
+
+def run_in_transaction(work, *args, database_url=None, attempts=RETRY_ATTEMPTS,
+                       backoff=RETRY_BACKOFF_SECONDS, **kwargs):
+    """
+    Run work(cursor, *args, **kwargs) in a transaction and return its
+    result. On a transient error the transaction is rolled back and run
+    again on a fresh connection, up to `attempts` times.
+    """
+    def attempt():
+        with transaction(database_url) as cursor:
+            return work(cursor, *args, **kwargs)
+
+    return _retrying(attempt, attempts, backoff)
+
+
+def run_outside_transaction(sql, database_url=None, attempts=RETRY_ATTEMPTS, backoff=RETRY_BACKOFF_SECONDS):
+    """Execute sql in autocommit mode on a pooled connection, e.g. VACUUM, which cannot run in a transaction"""
+    def attempt():
+        with connection(database_url) as conn:
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(sql)
+            finally:
+                if not conn.closed:
+                    conn.autocommit = False
+
+    _retrying(attempt, attempts, backoff)
+
+
+def iter_rows(sql, params=None, itersize=100_000, database_url=None, name='pipeline_read'):
+    """
+    Yield lists of at most itersize rows of a query, read through a
+    server-side cursor so the result set never sits in memory at once
+    """
+    with connection(database_url) as conn:
+        cursor = conn.cursor(name=name)
+        cursor.itersize = itersize
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
@@ -0,0 +1,316 @@
+"""
+Per-task metrics for the NYC taxi DAG.
+
+Every PythonOperator callable is wrapped with instrument(), which records
+for each task instance:
+
+- wall time of the task and of any named stages inside it (stage())
+- rows in and out, as reported by the task (record_rows())
+- bytes read and written by the task process (read/write syscalls on files
+  and sockets, from /proc/self/io where available)
+- peak RSS of the task process and of its finished child processes
+- the number and total time of database round trips made through cursors
+  of connections opened with cursor_factory=TimedCursor
+
+The record is logged as one JSON line prefixed with PIPELINE_METRICS and
+stored in the pipeline_runs table, so slow stages can be compared across
+runs and months. A failing task is recorded with status 'failed' and the
+error re-raised.
+
+With the DAG param profile='cprofile' (or 'py-spy', if py-spy is installed
+and may attach to the process) a profile of the task is written under
+PROFILE_DIR/<dag_id>/<run_id>/ and its path stored with the record.
+"""
+import functools
+import json
+import logging
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extensions
+
+PROFILE_DIR = '/opt/airflow/logs/profiles'
+
+PIPELINE_RUNS_DDL = """
+    CREATE TABLE IF NOT EXISTS pipeline_runs (
+        dag_id VARCHAR(250) NOT NULL,
+        run_id VARCHAR(250) NOT NULL,
+        task_id VARCHAR(250) NOT NULL,
+        map_index INTEGER NOT NULL DEFAULT -1,
+        try_number INTEGER NOT NULL DEFAULT 1,
+        logical_date TIMESTAMP,
+        started_at TIMESTAMP NOT NULL,
+        ended_at TIMESTAMP NOT NULL,
+        status VARCHAR(16) NOT NULL,
+        wall_seconds DOUBLE PRECISION NOT NULL,
+        rows_in BIGINT,
+        rows_out BIGINT,
+        bytes_read BIGINT,
+        bytes_written BIGINT,
+        peak_rss_kb BIGINT,
+        db_round_trips INTEGER,
+        db_seconds DOUBLE PRECISION,
+        metrics JSONB NOT NULL,
+        PRIMARY KEY (dag_id, run_id, task_id, map_index, try_number)
+    );
+    CREATE INDEX IF NOT EXISTS idx_pipeline_runs_task_started ON pipeline_runs (task_id, started_at);
+"""
+
+# Metrics of the task instance running in this process
+_current = None
+
+
+class TaskMetrics:
+    """Metrics collected while one task instance runs"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.rows_in = None
+        self.rows_out = None
+        self.db_round_trips = 0
+        self.db_seconds = 0.0
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_rows(self, rows_in=None, rows_out=None):
+        with self._lock:
+            if rows_in is not None:
+                self.rows_in = (self.rows_in or 0) + int(rows_in)
+            if rows_out is not None:
+                self.rows_out = (self.rows_out or 0) + int(rows_out)
+
+    def add_db_call(self, seconds):
+        with self._lock:
+            self.db_round_trips += 1
+            self.db_seconds += seconds
+
+
+@contextmanager
+def stage(name):
+    """Time a named stage of the running task (a no-op outside instrument())"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _current is not None:
+            _current.add_stage(name, time.perf_counter() - started)
+
+
+def record_rows(rows_in=None, rows_out=None):
+    """Add to the rows read and written by the running task"""
+    if _current is not None:
+        _current.add_rows(rows_in, rows_out)
+
+
+class TimedCursor(psycopg2.extensions.cursor):
+    """Cursor that counts its round trips and their time into the running task's metrics"""
+
+    def _timed(self, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            if _current is not None:
+                _current.add_db_call(time.perf_counter() - started)
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(super().copy_expert, sql, file, size)
+
+    def fetchone(self):
+        # Named (server-side) cursors fetch from the server
+        return self._timed(super().fetchone) if self.name else super().fetchone()
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        return self._timed(super().fetchmany, size) if self.name else super().fetchmany(size)
+
+    def fetchall(self):
+        return self._timed(super().fetchall) if self.name else super().fetchall()
+
+
+def _io_counters():
+    """(bytes read, bytes written) through read/write syscalls by this process"""
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        # Block counts (512-byte units) where /proc is not available
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_inblock * 512, usage.ru_oublock * 512
+
+
+def _peak_rss_kb(who):
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    return resource.getrusage(who).ru_maxrss
+
+
+def _task_identity(context):
+    ti = context.get('ti')
+    dag_run = context.get('dag_run')
+    return {
+        'dag_id': getattr(ti, 'dag_id', None) or 'nyc_taxi_pipeline',
+        'run_id': getattr(dag_run, 'run_id', None) or context.get('run_id') or 'manual',
+        'task_id': getattr(ti, 'task_id', None) or 'unknown',
+        'map_index': getattr(ti, 'map_index', -1),
+        'try_number': getattr(ti, 'try_number', 1),
+        'logical_date': context.get('logical_date'),
+    }
+
+
+@contextmanager
+def _profiled(mode, path):
+    """Run the body under cProfile or py-spy, writing the profile to path"""
+    if mode == 'cprofile':
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield path
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+    elif mode == 'py-spy':
+        import shutil
+        import subprocess
+
+        if not shutil.which('py-spy'):
+            logging.warning("profile='py-spy' requested but py-spy is not installed")
+            yield None
+            return
+        sampler = subprocess.Popen(
+            ['py-spy', 'record', '--pid', str(os.getpid()), '--subprocesses',
+             '--format', 'speedscope', '--output', path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            yield path
+        finally:
+            # py-spy writes the profile when interrupted
+            sampler.send_signal(2)
+            try:
+                sampler.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                sampler.kill()
+    else:
+        yield None
+
+
+def write_pipeline_run(cursor, record):
+    """Insert (or replace) one task instance's record in pipeline_runs"""
+    cursor.execute(PIPELINE_RUNS_DDL)
+    cursor.execute(
+        """
+        INSERT INTO pipeline_runs (
+            dag_id, run_id, task_id, map_index, try_number, logical_date, started_at, ended_at,
+            status, wall_seconds, rows_in, rows_out, bytes_read, bytes_written, peak_rss_kb,
+            db_round_trips, db_seconds, metrics
+        ) VALUES (
+            %(dag_id)s, %(run_id)s, %(task_id)s, %(map_index)s, %(try_number)s, %(logical_date)s,
+            %(started_at)s, %(ended_at)s, %(status)s, %(wall_seconds)s, %(rows_in)s, %(rows_out)s,
+            %(bytes_read)s, %(bytes_written)s, %(peak_rss_kb)s, %(db_round_trips)s, %(db_seconds)s,
+            %(metrics)s
+        )
+        ON CONFLICT (dag_id, run_id, task_id, map_index, try_number) DO UPDATE
+          SET ended_at = EXCLUDED.ended_at,
+              status = EXCLUDED.status,
+              wall_seconds = EXCLUDED.wall_seconds,
+              rows_in = EXCLUDED.rows_in,
+              rows_out = EXCLUDED.rows_out,
+              bytes_read = EXCLUDED.bytes_read,
+              bytes_written = EXCLUDED.bytes_written,
+              peak_rss_kb = EXCLUDED.peak_rss_kb,
+              db_round_trips = EXCLUDED.db_round_trips,
+              db_seconds = EXCLUDED.db_seconds,
+              metrics = EXCLUDED.metrics;
+        """,
+        {**record, 'metrics': json.dumps(record, default=str)},
+    )
+
+
+def _store(record):
+    """Write a record to pipeline_runs; metrics never fail the task"""
+    from pipeline_db import DATABASE_URL_ENV, run_in_transaction
+
+    if not os.getenv(DATABASE_URL_ENV):
+        logging.warning(f"{DATABASE_URL_ENV} not set; pipeline metrics are only logged")
+        return
+    try:
+        run_in_transaction(write_pipeline_run, record, attempts=2)
+    except psycopg2.Error as e:
+        logging.warning(f"Could not store pipeline metrics: {e}")
+
+
+def instrument(python_callable):
+    """
+    Wrap a PythonOperator callable so each run of it records a pipeline_runs
+    row. The wrapper keeps the callable's signature, so Airflow passes it
+    the same arguments.
+    """
+    @functools.wraps(python_callable)
+    def wrapper(*args, **context):
+        global _current
+
+        identity = _task_identity(context)
+        profile = (context.get('params') or {}).get('profile')
+        profile_path = None
+        if profile in ('cprofile', 'py-spy'):
+            profile_dir = os.path.join(PROFILE_DIR, identity['dag_id'], identity['run_id'])
+            os.makedirs(profile_dir, exist_ok=True)
+            suffix = '' if identity['map_index'] < 0 else f".{identity['map_index']}"
+            extension = 'prof' if profile == 'cprofile' else 'speedscope.json'
+            profile_path = os.path.join(
+                profile_dir, f"{identity['task_id']}{suffix}.try{identity['try_number']}.{extension}"
+            )
+
+        _current = metrics = TaskMetrics()
+        read_before, written_before = _io_counters()
+        started_at = datetime.utcnow()
+        started = time.perf_counter()
+        status = 'success'
+        try:
+            with _profiled(profile, profile_path) as profile_path:
+                return python_callable(*args, **context)
+        except BaseException:
+            status = 'failed'
+            raise
+        finally:
+            _current = None
+            read_after, written_after = _io_counters()
+            record = {
+                **identity,
+                'started_at': started_at,
+                'ended_at': datetime.utcnow(),
+                'status': status,
+                'wall_seconds': round(time.perf_counter() - started, 3),
+                'rows_in': metrics.rows_in,
+                'rows_out': metrics.rows_out,
+                'bytes_read': read_after - read_before,
+                'bytes_written': written_after - written_before,
+                'peak_rss_kb': _peak_rss_kb(resource.RUSAGE_SELF),
+                'children_peak_rss_kb': _peak_rss_kb(resource.RUSAGE_CHILDREN),
+                'db_round_trips': metrics.db_round_trips,
+                'db_seconds': round(metrics.db_seconds, 3),
+                'stages': {name: round(seconds, 3) for name, seconds in metrics.stages.items()},
+                'profile': profile_path,
+            }
+            logging.info("PIPELINE_METRICS " + json.dumps(record, default=str))
+            _store(record)
+
+    return wrapper
@@ -0,0 +1,164 @@
+"""
+Downloader for TLC trip record files.
+
+The files of every requested feed and month are fetched concurrently by a
+bounded thread pool. Each file streams in large chunks into a `.part` file
+that is resumed with an HTTP Range request after a failure, and is renamed
+into place only once complete.
+A manifest.json next to the files records the size, ETag and SHA-256 of
+each finished download, so files that still match the server are skipped.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+TLC_BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+MANIFEST_NAME = "manifest.json"
+# Network reads are 1 MiB (a dropped connection loses at most one read) and
+# are written through an 8 MiB file buffer
+CHUNK_SIZE = 1024 * 1024
+WRITE_BUFFER_SIZE = 8 * 1024 * 1024
+
+_manifest_lock = threading.Lock()
+
+
+def trip_file_name(year, month, feed='yellow'):
+    """Return the TLC file name for a month of a feed's trips (see dags/tlc_feeds.py)"""
+    return f"{feed}_tripdata_{year}-{month:02d}.parquet"
+
+
+def read_manifest(dest_dir):
+    path = os.path.join(dest_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _record_in_manifest(dest_dir, file_name, entry):
+    """Add one finished file to the manifest, rewriting it atomically"""
+    with _manifest_lock:
+        manifest = read_manifest(dest_dir)
+        manifest[file_name] = entry
+        path = os.path.join(dest_dir, MANIFEST_NAME)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+
+def _hash_file(path, digest):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+
+def download_file(url, dest_dir, session=None, chunk_size=CHUNK_SIZE, timeout=60):
+    """
+    Download url into dest_dir, resuming a leftover .part file if possible.
+
+    Skips the download if the manifest already holds the server's size and
+    ETag and the file on disk has that size. Returns a report dict with the
+    local path, bytes transferred, seconds and bytes/sec.
+    """
+    session = session or requests.Session()
+    file_name = url.rsplit('/', 1)[-1]
+    dest_path = os.path.join(dest_dir, file_name)
+    part_path = dest_path + '.part'
+
+    head = session.head(url, allow_redirects=True, timeout=timeout)
+    head.raise_for_status()
+    size = int(head.headers['Content-Length']) if 'Content-Length' in head.headers else None
+    etag = head.headers.get('ETag')
+
+    entry = read_manifest(dest_dir).get(file_name)
+    if (entry and entry.get('size') == size and entry.get('etag') == etag
+            and os.path.exists(dest_path) and os.path.getsize(dest_path) == size):
+        logging.info(f"{file_name} is up to date, skipping download")
+        return {'path': dest_path, 'skipped': True, 'bytes': 0, 'seconds': 0.0, 'bytes_per_sec': 0.0}
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if size is not None and offset > size:
+        offset = 0
+
+    digest = hashlib.sha256()
+    started = time.time()
+    if size is not None and offset == size:
+        # A previous attempt finished writing but failed before the rename
+        _hash_file(part_path, digest)
+    else:
+        headers = {}
+        if offset:
+            headers['Range'] = f"bytes={offset}-"
+            if etag:
+                # Only resume if the file has not changed since the .part was written
+                headers['If-Range'] = etag
+        with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            if offset and response.status_code == 206:
+                logging.info(f"Resuming {file_name} from byte {offset}")
+                _hash_file(part_path, digest)
+                mode = 'ab'
+            else:
+                offset = 0
+                mode = 'wb'
+            with open(part_path, mode, buffering=WRITE_BUFFER_SIZE) as f:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    f.write(chunk)
+                    digest.update(chunk)
+    seconds = time.time() - started
+
+    written = os.path.getsize(part_path)
+    if size is not None and written != size:
+        raise IOError(f"{file_name}: expected {size} bytes, got {written}; keeping {part_path} to resume")
+    os.replace(part_path, dest_path)
+
+    _record_in_manifest(dest_dir, file_name, {
+        'url': url,
+        'size': written,
+        'etag': etag,
+        'sha256': digest.hexdigest(),
+        'downloaded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    })
+
+    transferred = written - offset
+    bytes_per_sec = transferred / seconds if seconds > 0 else 0.0
+    logging.info(f"Downloaded {file_name}: {transferred} bytes in {seconds:.1f}s ({bytes_per_sec / 1e6:.1f} MB/s)")
+    return {
+        'path': dest_path,
+        'skipped': False,
+        'bytes': transferred,
+        'seconds': seconds,
+        'bytes_per_sec': bytes_per_sec,
+    }
+
+
+def download_months(months, dest_dir, feeds=('yellow',), base_url=TLC_BASE_URL, max_workers=4):
+    """
+    Download the TLC files of each feed for (year, month) pairs concurrently.
+
+    Every file is attempted; if any fail, the first error is raised after
+    the others finish. Returns the per-file reports, by month and then feed
+    in input order.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    urls = [f"{base_url}/{trip_file_name(year, month, feed)}" for year, month in months for feed in feeds]
+    local = threading.local()
+
+    def fetch(url):
+        # requests.Session is not thread-safe, so each worker keeps its own
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return download_file(url, dest_dir, session=local.session)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(fetch, url) for url in urls]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+    if errors:
+        raise errors[0]
+    return [future.result() for future in futures]
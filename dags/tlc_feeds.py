@@ -0,0 +1,191 @@
+"""
+TLC trip record feeds and how their files map onto one trip schema.
+
+TLC publishes a monthly parquet file per feed, named
+<feed>_tripdata_YYYY-MM.parquet:
+
+- yellow: medallion taxis (tpep_* timestamps)
+- green: street-hail livery (boro) taxis (lpep_* timestamps)
+- fhv: for-hire vehicles dispatched by bases; no fare, distance or
+  payment columns
+- fhvhv: high-volume for-hire services (Uber, Lyft, ...), about 20M trips a
+  month; fares and tips are reported, but the rider's total is not
+
+Each feed's columns are renamed to TRIP_SOURCE_COLUMNS before cleaning, so
+every feed runs through the same rules (dags/trip_processing.py) and loads
+into the same taxi_trips partitions and lake months, tagged with its
+SERVICE_TYPES code. Columns a feed does not report are NULL, and the rules
+on them pass every row of that feed.
+
+File column names are matched case-insensitively: TLC has changed their
+case over the years (PUlocationID / PULocationID, Airport_fee / airport_fee).
+"""
+import os
+import re
+
+# Raw trip columns every feed is normalized to, before casting and cleaning
+TRIP_SOURCE_COLUMNS = [
+    'pickup_datetime',
+    'dropoff_datetime',
+    'pickup_location_id',
+    'dropoff_location_id',
+    'trip_distance',
+    'fare_amount',
+    'tip_amount',
+    'total_amount',
+    'payment_type',
+]
+
+# taxi_trips.service_type code of each feed
+SERVICE_TYPES = {
+    'yellow': 1,
+    'green': 2,
+    'fhv': 3,
+    'fhvhv': 4,
+}
+
+# TRIP_SOURCE_COLUMNS each feed reports, by the file column they come from.
+# A list stands for the sum of those of its columns present in the file,
+# with nulls in all but the first counted as zero.
+FEED_COLUMNS = {
+    'yellow': {
+        'pickup_datetime': 'tpep_pickup_datetime',
+        'dropoff_datetime': 'tpep_dropoff_datetime',
+        'pickup_location_id': 'PULocationID',
+        'dropoff_location_id': 'DOLocationID',
+        'trip_distance': 'trip_distance',
+        'fare_amount': 'fare_amount',
+        'tip_amount': 'tip_amount',
+        'total_amount': 'total_amount',
+        'payment_type': 'payment_type',
+    },
+    'green': {
+        'pickup_datetime': 'lpep_pickup_datetime',
+        'dropoff_datetime': 'lpep_dropoff_datetime',
+        'pickup_location_id': 'PULocationID',
+        'dropoff_location_id': 'DOLocationID',
+        'trip_distance': 'trip_distance',
+        'fare_amount': 'fare_amount',
+        'tip_amount': 'tip_amount',
+        'total_amount': 'total_amount',
+        'payment_type': 'payment_type',
+    },
+    'fhv': {
+        'pickup_datetime': 'pickup_datetime',
+        'dropoff_datetime': 'dropOff_datetime',
+        'pickup_location_id': 'PUlocationID',
+        'dropoff_location_id': 'DOlocationID',
+    },
+    'fhvhv': {
+        'pickup_datetime': 'pickup_datetime',
+        'dropoff_datetime': 'dropoff_datetime',
+        'pickup_location_id': 'PULocationID',
+        'dropoff_location_id': 'DOLocationID',
+        'trip_distance': 'trip_miles',
+        'fare_amount': 'base_passenger_fare',
+        'tip_amount': 'tips',
+        # What the rider paid: the fare plus tolls, fees, taxes and tip
+        'total_amount': ['base_passenger_fare', 'tolls', 'bcf', 'sales_tax', 'congestion_surcharge',
+                         'airport_fee', 'cbd_congestion_fee', 'tips'],
+    },
+}
+
+# Arrow types of the normalized columns a feed does not report
+_UNREPORTED_TYPES = {
+    'trip_distance': 'float64',
+    'fare_amount': 'float64',
+    'tip_amount': 'float64',
+    'total_amount': 'float64',
+    'payment_type': 'int64',
+}
+
+_FILE_NAME = re.compile(r'^(?P<feed>[a-z]+)_tripdata_(?P<year>\d{4})-(?P<month>\d{2})\.parquet$')
+
+
+def parse_trip_file_name(path):
+    """(feed, year, month) of a TLC trip file path (see tlc_download.trip_file_name)"""
+    match = _FILE_NAME.match(os.path.basename(path))
+    if not match or match['feed'] not in FEED_COLUMNS:
+        raise ValueError(f"Not a TLC trip file of a known feed ({', '.join(FEED_COLUMNS)}): {path}")
+    return match['feed'], int(match['year']), int(match['month'])
+
+
+def reported_columns(feed):
+    """The TRIP_SOURCE_COLUMNS a feed reports"""
+    return set(FEED_COLUMNS[feed])
+
+
+def _resolve(feed, file_columns):
+    """
+    Map each reported column of a feed to the file's column name(s): a
+    name, or for summed columns the list of names present in the file
+    """
+    by_lower = {name.lower(): name for name in file_columns}
+    resolved = {}
+    for name, source in FEED_COLUMNS[feed].items():
+        if isinstance(source, list):
+            present = [by_lower[part.lower()] for part in source if part.lower() in by_lower]
+            if not present or present[0].lower() != source[0].lower():
+                raise KeyError(f"{feed} file has no {source[0]} column (for {name})")
+            resolved[name] = present
+        elif source.lower() in by_lower:
+            resolved[name] = by_lower[source.lower()]
+        else:
+            raise KeyError(f"{feed} file has no {source} column (for {name})")
+    return resolved
+
+
+def feed_file_columns(feed, file_columns):
+    """The columns of a feed's file (given its column names) to read for TRIP_SOURCE_COLUMNS"""
+    names = []
+    for source in _resolve(feed, file_columns).values():
+        for name in source if isinstance(source, list) else [source]:
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def normalize_trips_arrow(batch, feed):
+    """
+    Rename a record batch (or table) of a feed's file to TRIP_SOURCE_COLUMNS,
+    in their raw types. Unreported columns are all-null. Returns a
+    pyarrow.Table.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    resolved = _resolve(feed, batch.schema.names)
+    columns = {}
+    for name in TRIP_SOURCE_COLUMNS:
+        source = resolved.get(name)
+        if source is None:
+            columns[name] = pa.nulls(batch.num_rows, _UNREPORTED_TYPES[name])
+        elif isinstance(source, list):
+            first, *rest = (pc.cast(batch.column(part), pa.float64()) for part in source)
+            for part in rest:
+                first = pc.add(first, pc.fill_null(part, 0.0))
+            columns[name] = first
+        else:
+            columns[name] = batch.column(source)
+    return pa.table(columns)
+
+
+def normalize_trips_spark(df, feed):
+    """Select a Spark DataFrame of a feed's file as TRIP_SOURCE_COLUMNS. Mirrors normalize_trips_arrow."""
+    from pyspark.sql.functions import coalesce, col, lit
+
+    resolved = _resolve(feed, df.columns)
+    columns = []
+    for name in TRIP_SOURCE_COLUMNS:
+        source = resolved.get(name)
+        if source is None:
+            column = lit(None).cast('bigint' if _UNREPORTED_TYPES[name] == 'int64' else 'double')
+        elif isinstance(source, list):
+            first, *rest = (col(part).cast('double') for part in source)
+            column = first
+            for part in rest:
+                column = column + coalesce(part, lit(0.0))
+        else:
+            column = col(source)
+        columns.append(column.alias(name))
+    return df.select(*columns)
@@ -0,0 +1,322 @@
+"""
+Precomputed trip extracts for download.
+
+Handing out raw trips per web request means buffering a whole date range of
+taxi_trips in the API process. Instead, export_trips() streams the trips of
+a date range (optionally only some pickup zones) out of Postgres with
+COPY ... TO STDOUT and writes them as files of at most file_rows trips each,
+in constant memory however long the range:
+
+- 'csv.gz': the COPY output is gzipped as it arrives and cut into parts at
+  line boundaries, each part starting with the header row
+- 'parquet': the same CSV stream is parsed block by block by PyArrow into the
+  lake's column types (decimals stay exact) and written as
+  zstd-compressed Parquet, in row groups of ROW_GROUP_ROWS
+
+Extracts cover every feed; each trip's service_type column names its feed
+(yellow, green, fhv, fhvhv).
+
+File names carry a hash of their content, so they can be cached forever.
+
+The DAG publishes every processed month with publish_month_extracts() under
+EXPORT_DIR/trips/YYYY-MM/ and lists it in EXPORT_DIR/manifest.json, which
+the web app's /api/taxi-data/extracts route reads to hand out the files
+covering a requested date range.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from datetime import date
+
+from pipeline_db import transaction
+from tlc_feeds import SERVICE_TYPES
+from trip_lake import ROW_GROUP_ROWS, lake_schema
+
+EXPORT_DIR = '/opt/airflow/public/exports'
+EXPORT_MANIFEST = 'manifest.json'
+EXPORT_FORMATS = ('parquet', 'csv.gz')
+FILE_ROWS = 1_000_000
+
+EXPORT_COLUMNS = lake_schema().names + ['service_type']
+
+# taxi_trips stores amounts in cents, distances as real and feeds as codes;
+# extracts carry the lake's exact two-decimal values and the feed's name
+_EXPORT_EXPRESSIONS = {
+    'service_type': "CASE service_type {} END".format(
+        ' '.join(f"WHEN {code} THEN '{feed}'" for feed, code in SERVICE_TYPES.items())
+    ),
+    'trip_distance': "trip_distance::numeric(10,2)",
+    'fare_amount': "(fare_cents / 100.0)::numeric(10,2)",
+    'tip_amount': "(tip_cents / 100.0)::numeric(10,2)",
+    'total_amount': "(total_cents / 100.0)::numeric(10,2)",
+    'tip_percentage': "tip_percentage::numeric(8,2)",
+}
+
+# Bytes of CSV PyArrow parses at a time
+_CSV_BLOCK_BYTES = 4 * 2**20
+_HASH_CHUNK_BYTES = 2**20
+
+
+def export_query(cursor, start, end, zones=None):
+    """COPY statement for the trips picked up in [start, end), optionally only in some pickup zones"""
+    zone_filter = "AND pickup_location_id = ANY(%(zones)s)" if zones else ""
+    select = cursor.mogrify(f"""
+        SELECT {', '.join(f"{_EXPORT_EXPRESSIONS[name]} AS {name}" if name in _EXPORT_EXPRESSIONS else name
+                          for name in EXPORT_COLUMNS)}
+        FROM taxi_trips
+        WHERE pickup_datetime >= %(start)s AND pickup_datetime < %(end)s
+        {zone_filter}
+        ORDER BY pickup_datetime
+    """, {'start': start, 'end': end, 'zones': list(zones or [])}).decode()
+    return f"COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)"
+
+
+def _content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _finish_part(path, rows):
+    """Rename a written part to carry its content hash; returns its file entry"""
+    stem, extension = os.path.basename(path).split('.', 1)
+    hashed = os.path.join(os.path.dirname(path), f"{stem}.{_content_hash(path)}.{extension}")
+    os.rename(path, hashed)
+    return {'file': os.path.basename(hashed), 'rows': rows, 'bytes': os.path.getsize(hashed)}
+
+
+class _CsvGzParts:
+    """
+    File-like sink for COPY ... TO STDOUT (FORMAT csv, HEADER) writing gzipped
+    parts of at most file_rows rows, each starting with the header. The
+    exported columns hold no text, so every newline ends a row.
+    """
+
+    def __init__(self, output_dir, prefix, file_rows):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.file_rows = file_rows
+        self.parts = []
+        self._header = None
+        self._pending = b''
+        self._file = None
+        self._path = None
+        self._rows = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if self._header is None:
+            self._pending += data
+            end = self._pending.find(b'\n')
+            if end < 0:
+                return
+            self._header, data = self._pending[:end + 1], self._pending[end + 1:]
+            self._pending = b''
+        while data:
+            if self._file is None or self._rows == self.file_rows:
+                self._next_part()
+            room = self.file_rows - self._rows
+            newlines = data.count(b'\n')
+            if newlines < room or (newlines == room and data.endswith(b'\n')):
+                self._file.write(data)
+                self._rows += newlines
+                return
+            # Cut after the row that fills this part
+            cut = -1
+            for _ in range(room):
+                cut = data.find(b'\n', cut + 1)
+            self._file.write(data[:cut + 1])
+            self._rows += room
+            data = data[cut + 1:]
+
+    def _next_part(self):
+        self._close_part()
+        self._path = os.path.join(self.output_dir, f"{self.prefix}-part-{len(self.parts):05d}.csv.gz")
+        self._file = gzip.open(self._path, 'wb', compresslevel=6)
+        self._file.write(self._header)
+        self._rows = 0
+
+    def _close_part(self):
+        if self._file is not None:
+            self._file.close()
+            self.parts.append(_finish_part(self._path, self._rows))
+            self._file = None
+
+    def close(self):
+        self._close_part()
+        return self.parts
+
+
+def _export_csv_gz(cursor, copy_sql, output_dir, prefix, file_rows):
+    sink = _CsvGzParts(output_dir, prefix, file_rows)
+    try:
+        cursor.copy_expert(copy_sql, sink)
+    finally:
+        parts = sink.close()
+    return parts
+
+
+def _export_parquet(cursor, copy_sql, output_dir, prefix, file_rows):
+    """
+    Parse the COPY stream with PyArrow while a thread feeds it through a pipe,
+    rolling over to a new Parquet file every file_rows rows
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    schema = lake_schema().append(pa.field('service_type', pa.string()))
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def produce():
+        try:
+            with os.fdopen(write_fd, 'wb') as sink:
+                cursor.copy_expert(copy_sql, sink)
+        except BaseException as e:
+            errors.append(e)
+
+    producer = threading.Thread(target=produce, name='trip-export-copy', daemon=True)
+    producer.start()
+
+    parts = []
+    writer, path, rows, pending = None, None, 0, []
+
+    def flush():
+        nonlocal writer, path, pending
+        if not pending:
+            return
+        table = pa.Table.from_batches(pending, schema)
+        pending = []
+        if writer is None:
+            path = os.path.join(output_dir, f"{prefix}-part-{len(parts):05d}.parquet")
+            writer = pq.ParquetWriter(path, schema, compression='zstd')
+        writer.write_table(table, row_group_size=ROW_GROUP_ROWS)
+
+    def close_part():
+        nonlocal writer, rows
+        flush()
+        if writer is not None:
+            writer.close()
+            parts.append(_finish_part(path, rows))
+            writer, rows = None, 0
+
+    try:
+        with os.fdopen(read_fd, 'rb') as source:
+            reader = pa_csv.open_csv(
+                source,
+                read_options=pa_csv.ReadOptions(block_size=_CSV_BLOCK_BYTES),
+                convert_options=pa_csv.ConvertOptions(column_types=schema),
+            )
+            pending_rows = 0
+            for batch in reader:
+                while batch.num_rows:
+                    take = min(batch.num_rows, file_rows - rows)
+                    pending.append(batch.slice(0, take))
+                    pending_rows += take
+                    rows += take
+                    batch = batch.slice(take)
+                    if rows == file_rows:
+                        close_part()
+                        pending_rows = 0
+                    elif pending_rows >= ROW_GROUP_ROWS:
+                        flush()
+                        pending_rows = 0
+        close_part()
+    finally:
+        if writer is not None:
+            writer.close()
+        producer.join()
+        # A failed COPY ends the stream early; its error is the one to report
+        if errors:
+            raise errors[0]
+    return parts
+
+
+_EXPORTERS = {
+    'csv.gz': _export_csv_gz,
+    'parquet': _export_parquet,
+}
+
+
+def export_trips(output_dir, start, end, zones=None, formats=EXPORT_FORMATS, file_rows=FILE_ROWS,
+                 prefix='trips', database_url=None):
+    """
+    Write the trips picked up in [start, end) (in the given pickup zones, or
+    all) to output_dir in each format. Returns {format: [{'file', 'rows',
+    'bytes'}, ...]}; a range without trips has no parquet parts.
+    """
+    unknown = set(formats) - set(_EXPORTERS)
+    if unknown:
+        raise ValueError(f"Unknown export formats {sorted(unknown)}; expected some of {list(_EXPORTERS)}")
+    os.makedirs(output_dir, exist_ok=True)
+    files = {}
+    for export_format in formats:
+        # One COPY per format; each reads the range in pickup order
+        with transaction(database_url) as cursor:
+            copy_sql = export_query(cursor, start, end, zones)
+            files[export_format] = _EXPORTERS[export_format](cursor, copy_sql, output_dir, prefix, file_rows)
+        logging.info(f"Exported {sum(part['rows'] for part in files[export_format])} trips in "
+                     f"[{start}, {end}) to {len(files[export_format])} {export_format} files")
+    return files
+
+
+def _write_manifest(export_dir, manifest):
+    path = os.path.join(export_dir, EXPORT_MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def read_manifest(export_dir=EXPORT_DIR):
+    try:
+        with open(os.path.join(export_dir, EXPORT_MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'months': {}}
+
+
+def publish_month_extracts(year, month, formats=EXPORT_FORMATS, export_dir=EXPORT_DIR, file_rows=FILE_ROWS,
+                           database_url=None):
+    """
+    Export one month of trips to export_dir/trips/YYYY-MM/ and list it in
+    the manifest. The month's directory is written aside and renamed into
+    place, so the manifest never names a missing or partial file.
+    """
+    label = f"{year}-{month:02d}"
+    start = date(year, month, 1)
+    end = date(year + month // 12, month % 12 + 1, 1)
+    month_dir = os.path.join(export_dir, 'trips', label)
+    staging = os.path.join(export_dir, 'trips', f".{label}.staging")
+    previous = os.path.join(export_dir, 'trips', f".{label}.old")
+    shutil.rmtree(staging, ignore_errors=True)
+
+    files = export_trips(staging, start.isoformat(), end.isoformat(), formats=formats, file_rows=file_rows,
+                         prefix=f"trips-{label}", database_url=database_url)
+
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(month_dir):
+        os.rename(month_dir, previous)
+    os.rename(staging, month_dir)
+
+    entry = {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'rows': max((sum(part['rows'] for part in parts) for parts in files.values()), default=0),
+        'files': {
+            export_format: [{**part, 'file': f"trips/{label}/{part['file']}"} for part in parts]
+            for export_format, parts in files.items()
+        },
+    }
+    manifest = read_manifest(export_dir)
+    manifest.setdefault('months', {})[label] = entry
+    _write_manifest(export_dir, manifest)
+    shutil.rmtree(previous, ignore_errors=True)
+    return entry
@@ -0,0 +1,448 @@
+"""
+Curated Parquet lake of cleaned trips.
+
+Every processed month of every feed is also written to
+data/processed/taxi_trips/service_type=<feed>/year=YYYY/month=MM/ as
+zstd-compressed Parquet, sorted by pickup_datetime and pickup_location_id
+with row-group statistics, so readers prune months by directory and row
+groups by min/max; a dataset over the root has the feed as its service_type
+column. Both engines write the same column types, with exact two-decimal
+amounts (taxi_trips stores them compactly, as integer cents), and a month
+is replaced by renaming a fully written directory into place.
+
+The PyArrow engine never holds a whole month: MonthSpill buckets the cleaned
+batches by pickup day on disk, and each day is sorted and appended to the
+month's file by a LakeMonthWriter, so memory is bounded by the busiest day.
+
+Trips rejected by the cleaning rules go to a quarantine lake of the same
+layout under data/quarantine/taxi_trips/, with the lake's columns plus the
+reject_reasons bitmask of dags/trip_processing.py.
+
+Aggregation tasks can read the lake instead of taxi_trips: the helpers below
+scan it batch by batch and return per-group sums and counts as Arrow tables,
+merging partial aggregates so memory does not grow with the history.
+"""
+import os
+import shutil
+from datetime import datetime
+
+LAKE_ROOT = '/opt/airflow/data/processed/taxi_trips'
+QUARANTINE_ROOT = '/opt/airflow/data/quarantine/taxi_trips'
+LAKE_SORT_KEYS = ['pickup_datetime', 'pickup_location_id']
+ROW_GROUP_ROWS = 128 * 1024
+
+# Lake column types as Spark SQL types; lake_schema() is the Arrow equivalent
+SPARK_LAKE_TYPES = {
+    'pickup_datetime': 'timestamp_ntz',
+    'dropoff_datetime': 'timestamp_ntz',
+    'pickup_location_id': 'int',
+    'dropoff_location_id': 'int',
+    'trip_distance': 'decimal(10,2)',
+    'fare_amount': 'decimal(10,2)',
+    'tip_amount': 'decimal(10,2)',
+    'total_amount': 'decimal(10,2)',
+    'payment_type': 'int',
+    'trip_duration_minutes': 'int',
+    'tip_percentage': 'decimal(8,2)',
+}
+
+
+def lake_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('pickup_datetime', pa.timestamp('us')),
+        ('dropoff_datetime', pa.timestamp('us')),
+        ('pickup_location_id', pa.int32()),
+        ('dropoff_location_id', pa.int32()),
+        ('trip_distance', pa.decimal128(10, 2)),
+        ('fare_amount', pa.decimal128(10, 2)),
+        ('tip_amount', pa.decimal128(10, 2)),
+        ('total_amount', pa.decimal128(10, 2)),
+        ('payment_type', pa.int32()),
+        ('trip_duration_minutes', pa.int32()),
+        ('tip_percentage', pa.decimal128(8, 2)),
+    ])
+
+
+def quarantine_schema():
+    import pyarrow as pa
+    from trip_processing import REJECT_REASONS_COLUMN
+
+    return lake_schema().append(pa.field(REJECT_REASONS_COLUMN, pa.int16()))
+
+
+def spark_quarantine_types():
+    from trip_processing import REJECT_REASONS_COLUMN
+
+    return {**SPARK_LAKE_TYPES, REJECT_REASONS_COLUMN: 'smallint'}
+
+
+def feed_dir(root, feed):
+    return os.path.join(root, f"service_type={feed}")
+
+
+def month_dir(root, feed, year, month):
+    return os.path.join(feed_dir(root, feed), f"year={year}", f"month={month:02d}")
+
+
+def _hidden_month_dir(root, feed, year, month, suffix):
+    # Dot-prefixed directories are ignored by dataset discovery
+    return os.path.join(feed_dir(root, feed), f"year={year}", f".month={month:02d}.{suffix}")
+
+
+def month_spill_dir(root, feed, year, month):
+    """Where a MonthSpill of a feed's month being written to a lake keeps its files"""
+    return _hidden_month_dir(root, feed, year, month, 'spill')
+
+
+def _swap_in_month(root, feed, year, month):
+    """Replace a month directory with its fully written staging directory"""
+    target = month_dir(root, feed, year, month)
+    previous = _hidden_month_dir(root, feed, year, month, 'old')
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(target):
+        os.rename(target, previous)
+    os.rename(_hidden_month_dir(root, feed, year, month, 'staging'), target)
+    shutil.rmtree(previous, ignore_errors=True)
+    return target
+
+
+def adopt_legacy_months(root, feed='yellow'):
+    """
+    Move the months of a lake written before it was split by feed
+    (root/year=YYYY/month=MM/, which only ever held yellow trips) under
+    root/service_type=<feed>/. Months already present there are kept.
+    Returns the moved month directories.
+    """
+    moved = []
+    if not os.path.isdir(root):
+        return moved
+    for year_name in sorted(os.listdir(root)):
+        legacy_year = os.path.join(root, year_name)
+        if not year_name.startswith('year=') or not os.path.isdir(legacy_year):
+            continue
+        for month_name in sorted(os.listdir(legacy_year)):
+            target = os.path.join(feed_dir(root, feed), year_name, month_name)
+            if month_name.startswith('month=') and not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.rename(os.path.join(legacy_year, month_name), target)
+                moved.append(target)
+        shutil.rmtree(legacy_year)
+    return moved
+
+
+def sort_month_arrow(tables, schema=None):
+    """
+    Combine cleaned Arrow tables (PROCESSED_COLUMNS, float64 amounts) into
+    one table with the lake's (or the given) schema, sorted by LAKE_SORT_KEYS
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    schema = schema or lake_schema()
+    table = pa.concat_tables(tables) if tables else schema.empty_table()
+    columns = []
+    for field in schema:
+        column = table[field.name]
+        if pa.types.is_decimal(field.type) and pa.types.is_floating(column.type):
+            # float64 -> decimal casts truncate (0.29 is stored as 0.2899...),
+            # so go through the shortest decimal string of each value instead
+            column = pc.cast(pc.cast(column, pa.string()), field.type)
+        columns.append(pc.cast(column, field.type))
+    table = pa.Table.from_arrays(columns, schema=schema)
+    return table.sort_by([(key, 'ascending') for key in LAKE_SORT_KEYS])
+
+
+class MonthSpill:
+    """
+    Cleaned Arrow tables (PROCESSED_COLUMNS, float64 amounts) of one month
+    spilled to disk by pickup day, so the month is sorted a day at a time.
+
+    append() splits each table by pickup day into per-day Arrow IPC files
+    (LZ4-compressed) in directory; iter_sorted() reads them back in day
+    order, each day sorted by sort_month_arrow() into the lake's (or the
+    given) schema. Rows picked up outside [start, end) or without a pickup
+    time, which only rejected trips have, come last as one bucket. Used as a
+    context manager, the spill files are removed on exit.
+    """
+
+    def __init__(self, directory, start, end, schema=None):
+        self.directory = directory
+        self.start = start
+        self.schema = schema
+        self.days = (end - start).days
+        self._paths = {}
+        self._writers = {}
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._close_writers()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _close_writers(self):
+        for writer in self._writers.values():
+            writer.close()
+        self._writers = {}
+
+    def append(self, table):
+        import numpy as np
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        if not table.num_rows:
+            return
+        day = pc.days_between(pa.scalar(self.start, pa.timestamp('us')), table['pickup_datetime'])
+        buckets = pc.fill_null(day, self.days).to_numpy(zero_copy_only=False)
+        buckets = np.where((buckets >= 0) & (buckets < self.days), buckets, self.days)
+        counts = np.bincount(buckets, minlength=self.days + 1)
+        table = table.take(np.argsort(buckets, kind='stable'))
+        offset = 0
+        for bucket in np.flatnonzero(counts):
+            if bucket not in self._writers:
+                self._paths[bucket] = os.path.join(self.directory, f"day-{bucket:02d}.arrow")
+                self._writers[bucket] = pa.ipc.new_file(
+                    self._paths[bucket], table.schema, options=pa.ipc.IpcWriteOptions(compression='lz4')
+                )
+            self._writers[bucket].write_table(table.slice(offset, counts[bucket]))
+            offset += counts[bucket]
+
+    def iter_sorted(self):
+        """Yield the spilled trips a day at a time, each day sorted, in day order"""
+        import pyarrow as pa
+
+        self._close_writers()
+        for bucket in sorted(self._paths):
+            with pa.memory_map(self._paths[bucket]) as source:
+                table = pa.ipc.open_file(source).read_all()
+            yield sort_month_arrow([table], self.schema)
+
+
+class LakeMonthWriter:
+    """
+    Writes one month of a feed to a lake from tables already in the lake's
+    (or the given) schema and sort order, e.g. from sort_month_arrow() or
+    MonthSpill.iter_sorted(), in row groups of ROW_GROUP_ROWS. Used as a
+    context manager: the month is swapped in when the block succeeds (its
+    directory is then .path) and the staging directory discarded if not.
+    """
+
+    def __init__(self, root, feed, year, month, schema=None):
+        self.root, self.feed, self.year, self.month = root, feed, year, month
+        self.schema = schema or lake_schema()
+        self.path = None
+        self._staging = _hidden_month_dir(root, feed, year, month, 'staging')
+        self._pending = []
+        self._pending_rows = 0
+        self._writer = None
+
+    def __enter__(self):
+        import pyarrow.parquet as pq
+
+        shutil.rmtree(self._staging, ignore_errors=True)
+        os.makedirs(self._staging)
+        self._writer = pq.ParquetWriter(
+            os.path.join(self._staging, 'part-0.parquet'),
+            self.schema,
+            compression='zstd',
+            write_statistics=True,
+        )
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self._flush(final=True)
+            self._writer.close()
+            self.path = _swap_in_month(self.root, self.feed, self.year, self.month)
+        else:
+            self._writer.close()
+            shutil.rmtree(self._staging, ignore_errors=True)
+
+    def write(self, table):
+        self._pending.append(table)
+        self._pending_rows += table.num_rows
+        if self._pending_rows >= ROW_GROUP_ROWS:
+            self._flush(final=False)
+
+    def _flush(self, final):
+        """Write the buffered rows as whole row groups, and the remainder too if final"""
+        import pyarrow as pa
+
+        if not self._pending:
+            return
+        table = pa.concat_tables(self._pending)
+        whole = table.num_rows if final else table.num_rows - table.num_rows % ROW_GROUP_ROWS
+        if whole:
+            self._writer.write_table(table.slice(0, whole), row_group_size=ROW_GROUP_ROWS)
+        rest = table.slice(whole)
+        self._pending = [rest] if rest.num_rows else []
+        self._pending_rows = rest.num_rows
+
+
+def write_month_arrow(tables, root, feed, year, month, schema=None):
+    """
+    Write cleaned Arrow tables (PROCESSED_COLUMNS, float64 amounts) as one
+    month of a feed in the lake, or in another lake with the given schema
+    (e.g. quarantine_schema()). Returns the month directory.
+    """
+    return write_sorted_month_arrow(sort_month_arrow(tables, schema), root, feed, year, month)
+
+
+def write_sorted_month_arrow(table, root, feed, year, month):
+    """Write a table from sort_month_arrow() as one month of a feed in a lake. Returns the month directory."""
+    with LakeMonthWriter(root, feed, year, month, table.schema) as writer:
+        writer.write(table)
+    return writer.path
+
+
+def write_month_spark(df, root, feed, year, month, spark_types=None):
+    """
+    Write a cleaned Spark DataFrame (PROCESSED_COLUMNS) as one month of a
+    feed in the lake, or in another lake with the given column types (e.g.
+    spark_quarantine_types()). Returns the month directory.
+    """
+    from pyspark.sql.functions import col
+
+    spark_types = spark_types or SPARK_LAKE_TYPES
+    staging = _hidden_month_dir(root, feed, year, month, 'staging')
+    shutil.rmtree(staging, ignore_errors=True)
+    df.select(*[col(name).cast(spark_type).alias(name) for name, spark_type in spark_types.items()]) \
+        .orderBy(*LAKE_SORT_KEYS) \
+        .coalesce(1) \
+        .write \
+        .option("compression", "zstd") \
+        .parquet(staging)
+    return _swap_in_month(root, feed, year, month)
+
+
+def iter_lake_batches(root, columns, start=None, end=None):
+    """
+    Yield record batches of the lake's trips of every feed, optionally only
+    pickups in [start, end) (datetimes or ISO strings). Months outside the
+    range are pruned by partition and row groups by their pickup_datetime
+    statistics.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if not os.path.isdir(root):
+        raise FileNotFoundError(f"No trip lake at {root}")
+    dataset = ds.dataset(root, format='parquet', partitioning='hive')
+
+    condition = None
+    if start is not None:
+        start, end = (value if isinstance(value, datetime) else datetime.fromisoformat(value)
+                      for value in (start, end))
+        months = range(start.year * 12 + start.month - 1, end.year * 12 + end.month)
+        in_months = None
+        for index in months:
+            month_condition = (ds.field('year') == index // 12) & (ds.field('month') == index % 12 + 1)
+            in_months = month_condition if in_months is None else in_months | month_condition
+        condition = in_months \
+            & (ds.field('pickup_datetime') >= pa.scalar(start, pa.timestamp('us'))) \
+            & (ds.field('pickup_datetime') < pa.scalar(end, pa.timestamp('us')))
+    return dataset.to_batches(columns=columns, filter=condition)
+
+
+def _merge_partials(partials, keys, aggregations):
+    """Combine per-batch group_by results by summing their sums and counts"""
+    import pyarrow as pa
+
+    names = [f"{column}_{function}" for column, function in aggregations]
+    merged = pa.concat_tables(partials).group_by(keys).aggregate([(name, 'sum') for name in names])
+    return pa.table({
+        **{key: merged[key] for key in keys},
+        **{name: merged[f"{name}_sum"] for name in names},
+    })
+
+
+def daily_summary_from_lake(root, start=None, end=None):
+    """
+    Per pickup day: the taxi_trip_summary columns (trips, revenue, and the
+    fare, tip and distance sums and counts) for trips in the lake.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    aggregations = [
+        ('pickup_datetime', 'count'),
+        ('total_amount', 'sum'),
+        ('fare_amount', 'sum'),
+        ('fare_amount', 'count'),
+        ('tip_amount', 'sum'),
+        ('tip_amount', 'count'),
+        ('trip_distance', 'sum'),
+        ('trip_distance', 'count'),
+    ]
+    columns = ['pickup_datetime', 'total_amount', 'fare_amount', 'tip_amount', 'trip_distance']
+    partials = []
+    for batch in iter_lake_batches(root, columns, start, end):
+        if batch.num_rows:
+            table = pa.Table.from_batches([batch])
+            table = table.append_column('stat_date', pc.cast(table['pickup_datetime'], pa.date32()))
+            partials.append(table.group_by('stat_date').aggregate(aggregations))
+    if not partials:
+        return None
+    merged = _merge_partials(partials, ['stat_date'], aggregations)
+    return pa.table({
+        'stat_date': merged['stat_date'],
+        'total_trips': merged['pickup_datetime_count'],
+        'total_revenue': merged['total_amount_sum'],
+        'fare_sum': merged['fare_amount_sum'],
+        'fare_count': merged['fare_amount_count'],
+        'tip_sum': merged['tip_amount_sum'],
+        'tip_count': merged['tip_amount_count'],
+        'distance_sum': merged['trip_distance_sum'],
+        'distance_count': merged['trip_distance_count'],
+    })
+
+
+def zone_side_stats_from_lake(root):
+    """
+    Per zone and side (pickup/dropoff): trips, revenue, and the sums and
+    counts behind the distance, duration and tip percentage averages.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    value_aggregations = [
+        ('total_amount', 'sum'),
+        ('trip_distance', 'sum'),
+        ('trip_distance', 'count'),
+        ('trip_duration_minutes', 'sum'),
+        ('trip_duration_minutes', 'count'),
+        ('tip_percentage', 'sum'),
+        ('tip_percentage', 'count'),
+    ]
+    columns = ['pickup_location_id', 'dropoff_location_id', 'total_amount',
+               'trip_distance', 'trip_duration_minutes', 'tip_percentage']
+    sides = {'pickup_location_id': [], 'dropoff_location_id': []}
+    for batch in iter_lake_batches(root, columns):
+        if batch.num_rows:
+            table = pa.Table.from_batches([batch])
+            for key, partials in sides.items():
+                partials.append(table.group_by(key).aggregate([(key, 'count')] + value_aggregations))
+
+    side_tables = []
+    for key, partials in sides.items():
+        if not partials:
+            continue
+        merged = _merge_partials(partials, [key], [(key, 'count')] + value_aggregations)
+        merged = merged.filter(pc.is_valid(merged[key]))
+        side_tables.append(pa.table({
+            'is_pickup': pa.array([key == 'pickup_location_id'] * merged.num_rows, pa.bool_()),
+            'location_id': merged[key],
+            'trips': merged[f"{key}_count"],
+            'revenue': merged['total_amount_sum'],
+            'distance_sum': merged['trip_distance_sum'],
+            'distance_count': merged['trip_distance_count'],
+            'duration_sum': merged['trip_duration_minutes_sum'],
+            'duration_count': merged['trip_duration_minutes_count'],
+            'tip_sum': merged['tip_percentage_sum'],
+            'tip_count': merged['tip_percentage_count'],
+        }))
+    return pa.concat_tables(side_tables) if side_tables else None
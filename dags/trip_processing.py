@@ -0,0 +1,456 @@
+"""
+Trip cleaning logic for the NYC taxi DAG.
+
+The same select/derive/filter rules are implemented twice: once on Spark
+DataFrames and once on PyArrow record batches, so a single month can be
+processed without starting a JVM. Both engines must stay in sync; use
+scripts/check_engine_parity.py to compare them on a parquet file.
+
+Every TLC feed is first renamed to the same raw columns (dags/tlc_feeds.py),
+so the rules below apply to yellow, green, FHV and high-volume FHV trips
+alike; a rule on a column the feed does not report passes all its rows.
+"""
+import functools
+
+from tlc_feeds import feed_file_columns, normalize_trips_arrow, normalize_trips_spark, reported_columns
+
+# Columns produced by both engines (and kept in the Parquet lake)
+PROCESSED_COLUMNS = [
+    'pickup_datetime',
+    'dropoff_datetime',
+    'pickup_location_id',
+    'dropoff_location_id',
+    'trip_distance',
+    'fare_amount',
+    'tip_amount',
+    'total_amount',
+    'payment_type',
+    'trip_duration_minutes',
+    'tip_percentage',
+]
+
+# taxi_trips columns, in table order. Amounts are stored as integer cents,
+# distance and tip percentage (only ever averaged or binned) as real, and
+# small codes as smallint; in this order every column falls on its type's
+# alignment, so there is no padding between columns. A row holds 46 bytes
+# of data, padded to 48 by the 8-byte tuple alignment (the layout before
+# service_type was 44, also padded to 48). service_type is the feed's
+# SERVICE_TYPES code (dags/tlc_feeds.py)
+TAXI_TRIPS_COLUMNS = [
+    'pickup_datetime',
+    'dropoff_datetime',
+    'pickup_location_id',
+    'dropoff_location_id',
+    'trip_distance',
+    'fare_cents',
+    'tip_cents',
+    'total_cents',
+    'payment_type',
+    'trip_duration_minutes',
+    'tip_percentage',
+    'service_type',
+]
+
+# PROCESSED_COLUMNS amounts stored in cents, by taxi_trips column
+CENTS_COLUMNS = {
+    'fare_cents': 'fare_amount',
+    'tip_cents': 'tip_amount',
+    'total_cents': 'total_amount',
+}
+
+# Amounts at or beyond this many dollars do not fit an integer of cents and
+# are stored as NULL, as decimal(10,2) overflows are
+MAX_CENTS_DOLLARS = 21_474_836.47
+
+MAX_TRIP_MINUTES = 180  # Max 3 hours
+
+# Validation rules applied by both engines; a trip is kept only if it passes
+# all of them. Reject counts are reported per rule, so one trip can count
+# against several rules.
+TRIP_RULES = [
+    'missing_pickup_datetime',
+    'missing_dropoff_datetime',
+    'non_positive_distance',
+    'non_positive_fare',
+    'non_positive_duration',
+    'duration_over_max',
+    'outside_month',
+]
+
+# Rejected trips carry a reject_reasons bitmask: bit i is set when the trip
+# fails TRIP_RULES[i]
+REJECT_REASON_BITS = {name: 1 << bit for bit, name in enumerate(TRIP_RULES)}
+REJECT_REASONS_COLUMN = 'reject_reasons'
+
+# Rules on a column some feeds do not report (e.g. FHV has no fares); they
+# pass every row of those feeds
+RULE_COLUMNS = {
+    'non_positive_distance': 'trip_distance',
+    'non_positive_fare': 'fare_amount',
+}
+
+
+def skipped_rules(feed):
+    """The TRIP_RULES a feed's trips pass unchecked"""
+    reported = reported_columns(feed)
+    return {name for name, column in RULE_COLUMNS.items() if column not in reported}
+
+
+def reject_reason_names(reasons):
+    """The TRIP_RULES a reject_reasons bitmask stands for"""
+    return [name for name, bit in REJECT_REASON_BITS.items() if reasons & bit]
+
+
+def derive_trips_spark(df, feed='yellow'):
+    """
+    Cast the raw columns of a feed's TLC file and derive
+    trip_duration_minutes/tip_percentage with Spark SQL, without dropping
+    any rows.
+    """
+    from pyspark.sql.functions import col, when, lit, round, unix_timestamp
+
+    return normalize_trips_spark(df, feed).select(
+        col("pickup_datetime").cast("timestamp").alias("pickup_datetime"),
+        col("dropoff_datetime").cast("timestamp").alias("dropoff_datetime"),
+        col("pickup_location_id").cast("integer").alias("pickup_location_id"),
+        col("dropoff_location_id").cast("integer").alias("dropoff_location_id"),
+        col("trip_distance").cast("decimal(10,2)").alias("trip_distance"),
+        col("fare_amount").cast("decimal(10,2)").alias("fare_amount"),
+        col("tip_amount").cast("decimal(10,2)").alias("tip_amount"),
+        col("total_amount").cast("decimal(10,2)").alias("total_amount"),
+        col("payment_type").cast("integer").alias("payment_type")
+    ).withColumn(
+        "trip_duration_minutes",
+        round((unix_timestamp("dropoff_datetime") - unix_timestamp("pickup_datetime")) / 60, 0).cast("integer")
+    ).withColumn(
+        "tip_percentage",
+        when(col("fare_amount") > 0, round((col("tip_amount") / col("fare_amount")) * 100, 2))
+        .when(col("fare_amount").isNotNull(), lit(0)).cast("decimal(8,2)")
+    )
+
+
+def compact_trips_spark(df, service_type):
+    """
+    Cast cleaned trips (PROCESSED_COLUMNS) of a feed, given its service_type
+    code, to the taxi_trips column types (TAXI_TRIPS_COLUMNS)
+    """
+    from pyspark.sql.functions import abs, col, lit, when
+
+    cents = {
+        name: when(abs(col(source)) <= MAX_CENTS_DOLLARS, (col(source) * 100).cast("int")).alias(name)
+        for name, source in CENTS_COLUMNS.items()
+    }
+    return df.select(
+        col("pickup_datetime"),
+        col("dropoff_datetime"),
+        col("pickup_location_id").cast("smallint"),
+        col("dropoff_location_id").cast("smallint"),
+        col("trip_distance").cast("float"),
+        cents['fare_cents'],
+        cents['tip_cents'],
+        cents['total_cents'],
+        col("payment_type").cast("smallint"),
+        col("trip_duration_minutes").cast("smallint"),
+        col("tip_percentage").cast("float"),
+        lit(service_type).cast("smallint").alias("service_type"),
+    )
+
+
+def trip_rules_spark(start, end, feed='yellow'):
+    """
+    Return (rule name, Column) pairs, in TRIP_RULES order, that are true for
+    rows of a feed passing each rule. Nulls are treated as failures.
+    """
+    from pyspark.sql.functions import coalesce, col, lit
+
+    conditions = [
+        col("pickup_datetime").isNotNull(),
+        col("dropoff_datetime").isNotNull(),
+        col("trip_distance") > 0,
+        col("fare_amount") > 0,
+        col("trip_duration_minutes") > 0,
+        col("trip_duration_minutes") <= MAX_TRIP_MINUTES,
+        (col("pickup_datetime") >= lit(start)) & (col("pickup_datetime") < lit(end)),
+    ]
+    skipped = skipped_rules(feed)
+    return [(name, lit(True) if name in skipped else coalesce(condition, lit(False)))
+            for name, condition in zip(TRIP_RULES, conditions)]
+
+
+def reject_reasons_spark(start, end, feed='yellow'):
+    """Return an integer Column with the reject_reasons bitmask of each row (0 if valid)"""
+    from pyspark.sql.functions import lit, when
+
+    return functools.reduce(lambda left, right: left + right, [
+        when(condition, lit(0)).otherwise(lit(REJECT_REASON_BITS[name]))
+        for name, condition in trip_rules_spark(start, end, feed)
+    ]).cast("smallint")
+
+
+def valid_trip_condition_spark(start, end, feed='yellow'):
+    """Return a Column that is true only for rows passing every rule"""
+    return functools.reduce(lambda left, right: left & right,
+                            [condition for _, condition in trip_rules_spark(start, end, feed)])
+
+
+def clean_trips_spark(df, start, end, feed='yellow'):
+    """
+    Clean and transform the raw trips of a feed's TLC file with Spark SQL.
+
+    Only trips picked up in [start, end) are kept, since TLC files contain a
+    few stray trips from other months.
+    """
+    return derive_trips_spark(df, feed).filter(valid_trip_condition_spark(start, end, feed))
+
+
+def spark_trip_stats(derived_df, start, end, feed='yellow'):
+    """
+    Compute row counts, per-rule reject counts and averages of the valid
+    trips in a single aggregation over a derived (unfiltered) DataFrame.
+    """
+    from pyspark.sql import functions as F
+
+    rules = trip_rules_spark(start, end, feed)
+    valid = valid_trip_condition_spark(start, end, feed)
+    row = derived_df.agg(
+        F.count(F.lit(1)).alias('raw_rows'),
+        F.sum(F.when(valid, 1).otherwise(0)).alias('total_trips'),
+        F.avg(F.when(valid, F.col('fare_amount'))).alias('avg_fare'),
+        F.avg(F.when(valid, F.col('trip_distance'))).alias('avg_distance'),
+        F.avg(F.when(valid, F.col('tip_percentage'))).alias('avg_tip_percentage'),
+        *[F.sum(F.when(condition, 0).otherwise(1)).alias(name) for name, condition in rules]
+    ).collect()[0]
+
+    raw_rows = int(row['raw_rows'])
+    total_trips = int(row['total_trips'] or 0)
+    return {
+        'raw_rows': raw_rows,
+        'total_trips': total_trips,
+        'rejected_rows': raw_rows - total_trips,
+        'rejects_by_rule': {name: int(row[name] or 0) for name in TRIP_RULES},
+        'avg_fare': float(row['avg_fare'] or 0),
+        'avg_distance': float(row['avg_distance'] or 0),
+        'avg_tip_percentage': float(row['avg_tip_percentage'] or 0),
+    }
+
+
+def _round_half_up(values, ndigits=0):
+    """
+    Round float64 values half away from zero, like Spark's decimal HALF_UP.
+
+    Spark rounds the shortest decimal representation of a double, so 1.005 is
+    a tie that rounds up; a tiny nudge away from zero reproduces that for the
+    cent-scale values found in TLC data.
+    """
+    import pyarrow.compute as pc
+
+    nudged = pc.add(values, pc.multiply(pc.sign(values), 1e-9))
+    return pc.round(nudged, ndigits=ndigits, round_mode='half_towards_infinity')
+
+
+def _to_decimal(values, precision):
+    """
+    Mimic Spark's cast to decimal(precision, 2) on float64 values: round half
+    up to cents and null out anything that overflows the precision.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    rounded = _round_half_up(pc.cast(values, pa.float64()), ndigits=2)
+    fits = pc.less(pc.abs(rounded), 10.0 ** (precision - 2))
+    return pc.if_else(fits, rounded, pa.scalar(None, pa.float64()))
+
+
+def derive_trips_arrow(batch, feed='yellow'):
+    """
+    Cast the raw columns of a record batch of a feed's TLC file and derive
+    trip_duration_minutes/tip_percentage with PyArrow compute, without
+    dropping any rows.
+
+    Mirrors derive_trips_spark; decimal columns are kept as float64 rounded to
+    two places. Returns a pyarrow.Table with PROCESSED_COLUMNS.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    batch = normalize_trips_arrow(batch, feed)
+    pickup = pc.cast(batch.column('pickup_datetime'), pa.timestamp('us'))
+    dropoff = pc.cast(batch.column('dropoff_datetime'), pa.timestamp('us'))
+    fare_amount = _to_decimal(batch.column('fare_amount'), 10)
+    tip_amount = _to_decimal(batch.column('tip_amount'), 10)
+
+    # unix_timestamp() works in whole seconds, so truncate before subtracting
+    duration_seconds = pc.divide(
+        pc.cast(
+            pc.subtract(
+                pc.cast(pc.floor_temporal(dropoff, unit='second'), pa.int64()),
+                pc.cast(pc.floor_temporal(pickup, unit='second'), pa.int64()),
+            ),
+            pa.float64(),
+        ),
+        1_000_000.0,
+    )
+    trip_duration_minutes = pc.cast(
+        _round_half_up(pc.divide(duration_seconds, 60.0)), pa.int32()
+    )
+
+    # 0 when the fare is not positive, unknown when there is no fare
+    has_fare = pc.fill_null(pc.greater(fare_amount, 0), False)
+    tip_percentage = _to_decimal(
+        pc.if_else(
+            has_fare,
+            _round_half_up(pc.multiply(pc.divide(tip_amount, fare_amount), 100.0), ndigits=2),
+            pc.if_else(pc.is_valid(fare_amount), 0.0, pa.scalar(None, pa.float64())),
+        ),
+        8,
+    )
+
+    return pa.table({
+        'pickup_datetime': pickup,
+        'dropoff_datetime': dropoff,
+        'pickup_location_id': pc.cast(batch.column('pickup_location_id'), pa.int32()),
+        'dropoff_location_id': pc.cast(batch.column('dropoff_location_id'), pa.int32()),
+        'trip_distance': _to_decimal(batch.column('trip_distance'), 10),
+        'fare_amount': fare_amount,
+        'tip_amount': tip_amount,
+        'total_amount': _to_decimal(batch.column('total_amount'), 10),
+        'payment_type': pc.cast(batch.column('payment_type'), pa.int32()),
+        'trip_duration_minutes': trip_duration_minutes,
+        'tip_percentage': tip_percentage,
+    })
+
+
+def trip_rules_arrow(table, start, end, feed='yellow'):
+    """
+    Return (rule name, boolean mask) pairs, in TRIP_RULES order, that are
+    true for rows of a feed passing each rule. Nulls are treated as failures.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    pickup = table['pickup_datetime']
+    duration = table['trip_duration_minutes']
+    conditions = [
+        pc.is_valid(pickup),
+        pc.is_valid(table['dropoff_datetime']),
+        pc.greater(table['trip_distance'], 0),
+        pc.greater(table['fare_amount'], 0),
+        pc.greater(duration, 0),
+        pc.less_equal(duration, MAX_TRIP_MINUTES),
+        pc.and_kleene(
+            pc.greater_equal(pickup, pa.scalar(start, pa.timestamp('us'))),
+            pc.less(pickup, pa.scalar(end, pa.timestamp('us'))),
+        ),
+    ]
+    skipped = skipped_rules(feed)
+    every_row = pa.chunked_array([pa.array(np.ones(table.num_rows, dtype=bool))])
+    return [(name, every_row if name in skipped else pc.fill_null(condition, False))
+            for name, condition in zip(TRIP_RULES, conditions)]
+
+
+def reject_reasons_arrow(rules):
+    """
+    Combine (rule name, passed mask) pairs, as from trip_rules_arrow, into
+    one int16 NumPy array of reject_reasons bitmasks (0 for valid rows)
+    """
+    import numpy as np
+
+    reasons = None
+    for name, passed in rules:
+        failed = np.logical_not(passed.to_numpy(zero_copy_only=False))
+        if reasons is None:
+            reasons = np.zeros(len(failed), dtype=np.int16)
+        reasons |= failed.astype(np.int16) << TRIP_RULES.index(name)
+    return reasons if reasons is not None else np.zeros(0, dtype=np.int16)
+
+
+def count_reject_reasons(reasons, reject_counts):
+    """Add the number of rows failing each rule, given their reject_reasons, to reject_counts"""
+    import numpy as np
+
+    histogram = np.bincount(reasons, minlength=1 << len(TRIP_RULES))
+    masks = np.arange(len(histogram))
+    for name, bit in REJECT_REASON_BITS.items():
+        reject_counts[name] = reject_counts.get(name, 0) + int(histogram[(masks & bit) != 0].sum())
+
+
+def clean_trips_arrow(batch, start, end, feed='yellow', reject_counts=None, quarantine=None):
+    """
+    Clean and transform one record batch of a feed's raw TLC trips with
+    PyArrow compute.
+
+    Mirrors clean_trips_spark. If reject_counts is given, the number of rows
+    failing each rule is added to it; if quarantine is given (a list, or
+    anything with an append() method such as trip_lake.MonthSpill), the
+    rejected rows (PROCESSED_COLUMNS plus reject_reasons) are appended to it
+    as a table. Returns a pyarrow.Table with PROCESSED_COLUMNS.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    table = derive_trips_arrow(batch, feed)
+    rules = trip_rules_arrow(table, start, end, feed)
+
+    # Remove invalid data
+    valid = functools.reduce(pc.and_, [passed for _, passed in rules])
+    if reject_counts is not None or quarantine is not None:
+        # Only rejected rows need their reasons, and they are a few percent,
+        # so the rule masks are gathered at their positions
+        rejected = pc.indices_nonzero(pc.invert(valid).combine_chunks())
+        reasons = reject_reasons_arrow([(name, pc.take(passed, rejected)) for name, passed in rules])
+        if reject_counts is not None:
+            count_reject_reasons(reasons, reject_counts)
+        if quarantine is not None and len(reasons):
+            quarantine.append(table.take(rejected).append_column(
+                REJECT_REASONS_COLUMN, pa.array(reasons, pa.int16())
+            ))
+    return table.filter(valid)
+
+
+def compact_trips_arrow(table, service_type):
+    """
+    Cast cleaned trips (PROCESSED_COLUMNS, as float64 or decimal amounts) of
+    a feed, given its service_type code, to the taxi_trips column types
+    (TAXI_TRIPS_COLUMNS). Mirrors compact_trips_spark.
+    """
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    def cents(column):
+        dollars = pc.cast(table[column], pa.float64())
+        fits = pc.less_equal(pc.abs(dollars), MAX_CENTS_DOLLARS)
+        dollars = pc.if_else(fits, dollars, pa.scalar(None, pa.float64()))
+        # Amounts are already whole cents; rounding only absorbs float error
+        return pc.cast(pc.round(pc.multiply(dollars, 100.0)), pa.int32())
+
+    return pa.table({
+        'pickup_datetime': table['pickup_datetime'],
+        'dropoff_datetime': table['dropoff_datetime'],
+        'pickup_location_id': pc.cast(table['pickup_location_id'], pa.int16()),
+        'dropoff_location_id': pc.cast(table['dropoff_location_id'], pa.int16()),
+        'trip_distance': pc.cast(pc.cast(table['trip_distance'], pa.float64()), pa.float32()),
+        **{name: cents(source) for name, source in CENTS_COLUMNS.items()},
+        'payment_type': pc.cast(table['payment_type'], pa.int16()),
+        'trip_duration_minutes': pc.cast(table['trip_duration_minutes'], pa.int16()),
+        'tip_percentage': pc.cast(pc.cast(table['tip_percentage'], pa.float64()), pa.float32()),
+        'service_type': pa.array(np.full(table.num_rows, service_type, dtype=np.int16)),
+    })
+
+
+def iter_clean_batches(input_file, start, end, feed='yellow', batch_size=250_000, reject_counts=None,
+                       quarantine=None):
+    """
+    Stream cleaned trips from a feed's parquet file one record batch at a time.
+
+    Only the columns the feed maps are read and at most one batch is held in
+    memory (plus the rejected rows, if collected into a quarantine list).
+    Yields (raw_row_count, cleaned pyarrow.Table) pairs.
+    """
+    import pyarrow.parquet as pq
+
+    parquet_file = pq.ParquetFile(input_file)
+    columns = feed_file_columns(feed, parquet_file.schema_arrow.names)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.num_rows, clean_trips_arrow(batch, start, end, feed, reject_counts, quarantine)
@@ -0,0 +1,88 @@
+"""
+Data-quality record of each processed month.
+
+Cleaning (dags/trip_processing.py) evaluates every TRIP_RULES rule as a
+vectorized mask and keeps only the trips passing all of them. The rejected
+trips are not dropped silently:
+
+- they are written to the month's quarantine partition
+  (QUARANTINE_ROOT/service_type=<feed>/year=YYYY/month=MM/, see
+  dags/trip_lake.py) with a reject_reasons bitmask, bit i standing for
+  TRIP_RULES[i]
+- the month's raw row count and the number of rows failing each rule are
+  stored in trip_quality_monthly per feed (service_type, see
+  dags/tlc_feeds.py), one row per rule plus an 'any' row with the rows
+  failing at least one (a row can fail several rules)
+
+so reject rates can be compared across months and feeds and a jump traced
+back to the quarantined rows, e.g.
+
+    SELECT * FROM parquet_scan('.../service_type=yellow/year=2025/month=04/*.parquet')
+    WHERE reject_reasons & 64 <> 0   -- outside_month
+
+Rules on a column a feed does not report (FHV fares and distances) count
+no rejects for it.
+"""
+from tlc_feeds import SERVICE_TYPES
+from trip_processing import REJECT_REASON_BITS
+
+# Row holding the rows failing at least one rule; its reason_bit has every bit set
+ANY_RULE = 'any'
+
+TRIP_QUALITY_DDL = """
+    CREATE TABLE IF NOT EXISTS trip_quality_monthly (
+        month DATE NOT NULL,
+        service_type SMALLINT NOT NULL,
+        rule VARCHAR(64) NOT NULL,
+        reason_bit SMALLINT NOT NULL,
+        raw_rows BIGINT NOT NULL,
+        rejected_rows BIGINT NOT NULL,
+        updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (month, service_type, rule)
+    );
+"""
+
+# Rows written before multi-feed loads were all of yellow trips
+TRIP_QUALITY_SERVICE_TYPE_MIGRATION = """
+    ALTER TABLE trip_quality_monthly ADD COLUMN service_type SMALLINT NOT NULL DEFAULT {yellow};
+    ALTER TABLE trip_quality_monthly ALTER COLUMN service_type DROP DEFAULT;
+    ALTER TABLE trip_quality_monthly
+        DROP CONSTRAINT trip_quality_monthly_pkey,
+        ADD PRIMARY KEY (month, service_type, rule);
+"""
+
+
+def write_trip_quality(cursor, month_start, stats, service_type):
+    """
+    Replace the trip_quality_monthly rows of a feed's month with a
+    processing task's stats (raw_rows, rejected_rows, rejects_by_rule).
+    Returns the number of rows written.
+    """
+    from psycopg2.extras import execute_values
+
+    rows = [
+        (month_start, service_type, rule, bit, stats['raw_rows'], stats['rejects_by_rule'].get(rule, 0))
+        for rule, bit in REJECT_REASON_BITS.items()
+    ]
+    rows.append((month_start, service_type, ANY_RULE, sum(REJECT_REASON_BITS.values()), stats['raw_rows'],
+                 stats['rejected_rows']))
+
+    cursor.execute(TRIP_QUALITY_DDL)
+    cursor.execute("""
+        SELECT 1
+        FROM pg_attribute
+        WHERE attrelid = 'trip_quality_monthly'::regclass AND attname = 'service_type' AND NOT attisdropped;
+    """)
+    if cursor.fetchone() is None:
+        cursor.execute(TRIP_QUALITY_SERVICE_TYPE_MIGRATION.format(yellow=SERVICE_TYPES['yellow']))
+    cursor.execute(
+        "DELETE FROM trip_quality_monthly WHERE month = %s::date AND service_type = %s;",
+        (month_start, service_type),
+    )
+    execute_values(
+        cursor,
+        "INSERT INTO trip_quality_monthly (month, service_type, rule, reason_bit, raw_rows, rejected_rows) "
+        "VALUES %s",
+        rows,
+    )
+    return len(rows)
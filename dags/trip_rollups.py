@@ -0,0 +1,145 @@
+"""
+Pre-aggregated rollups that serve the dashboard's analytics API routes.
+
+One GROUPING SETS scan of the loaded pickup range fills three small tables:
+
+- trip_rollup_hourly: (hour_bucket, payment_type) counts and sums, for the
+  hour-of-day time series and the payment type breakdown
+- trip_rollup_zones_daily: (stat_date, location_id) pickup and dropoff
+  counts and revenue, for the zone heatmap and top zones
+- trip_rollup_histograms_daily: (stat_date, metric, bin) trip counts, for
+  the 1-mile distance and 5-minute duration histograms
+
+Zones and histogram bins are kept per day rather than per hour so a full
+year stays in the hundreds of thousands of rows. Every stored value is a
+count or a sum, so any range of buckets combines exactly.
+"""
+
+# NULL payment types and location ids are stored as -1 so they can be part
+# of the primary key; readers map them back with NULLIF(..., -1)
+TRIP_ROLLUPS_DDL = """
+    CREATE TABLE IF NOT EXISTS trip_rollup_hourly (
+        hour_bucket TIMESTAMP NOT NULL,
+        payment_type INTEGER NOT NULL,
+        trip_count INTEGER NOT NULL,
+        total_amount_sum DECIMAL(14,2),
+        tip_amount_sum DECIMAL(14,2),
+        PRIMARY KEY (hour_bucket, payment_type)
+    );
+    CREATE TABLE IF NOT EXISTS trip_rollup_zones_daily (
+        stat_date DATE NOT NULL,
+        location_id INTEGER NOT NULL,
+        pickup_trips INTEGER NOT NULL,
+        pickup_revenue DECIMAL(14,2),
+        dropoff_trips INTEGER NOT NULL,
+        dropoff_revenue DECIMAL(14,2),
+        PRIMARY KEY (stat_date, location_id)
+    );
+    CREATE TABLE IF NOT EXISTS trip_rollup_histograms_daily (
+        stat_date DATE NOT NULL,
+        metric VARCHAR(16) NOT NULL,
+        bin INTEGER NOT NULL,
+        trip_count INTEGER NOT NULL,
+        PRIMARY KEY (stat_date, metric, bin)
+    );
+"""
+
+# Bins match the original raw-table queries: FLOOR(trip_distance) miles and
+# 5-minute duration buckets (durations are always positive after cleaning)
+TRIP_ROLLUP_SCAN = """
+    CREATE TEMP TABLE trip_rollup_scan ON COMMIT DROP AS
+    SELECT
+        CASE
+            WHEN GROUPING(payment_type) = 0 THEN 'payment'
+            WHEN GROUPING(pickup_location_id) = 0 THEN 'pickup'
+            WHEN GROUPING(dropoff_location_id) = 0 THEN 'dropoff'
+            WHEN GROUPING(FLOOR(trip_distance)) = 0 THEN 'distance'
+            ELSE 'duration'
+        END AS grouping_set,
+        date_trunc('hour', pickup_datetime) AS hour_bucket,
+        DATE(pickup_datetime) AS stat_date,
+        COALESCE(payment_type, -1) AS payment_type,
+        COALESCE(pickup_location_id, dropoff_location_id, -1) AS location_id,
+        COALESCE(FLOOR(trip_distance)::integer, trip_duration_minutes / 5 * 5) AS bin,
+        COUNT(*) AS trip_count,
+        SUM(total_cents) / 100.0 AS total_amount_sum,
+        SUM(tip_cents) / 100.0 AS tip_amount_sum
+    FROM taxi_trips
+    {range_filter}
+    GROUP BY GROUPING SETS (
+        (date_trunc('hour', pickup_datetime), payment_type),
+        (DATE(pickup_datetime), pickup_location_id),
+        (DATE(pickup_datetime), dropoff_location_id),
+        (DATE(pickup_datetime), FLOOR(trip_distance)),
+        (DATE(pickup_datetime), trip_duration_minutes / 5 * 5)
+    );
+"""
+
+
+def refresh_trip_rollups(cursor, pickup_start=None, pickup_end=None):
+    """
+    Rebuild the rollup rows for pickups in [pickup_start, pickup_end), or for
+    every trip if no range is given, in the caller's transaction.
+
+    The range should cover whole days, as the processing task's month range
+    does. Returns the number of rows written to each rollup table.
+    """
+    cursor.execute(TRIP_ROLLUPS_DDL)
+
+    if pickup_start is not None:
+        params = {'start': pickup_start, 'end': pickup_end}
+        range_filter = "WHERE pickup_datetime >= %(start)s AND pickup_datetime < %(end)s"
+        cursor.execute("""
+            DELETE FROM trip_rollup_hourly
+            WHERE hour_bucket >= %(start)s AND hour_bucket < %(end)s;
+            DELETE FROM trip_rollup_zones_daily
+            WHERE stat_date >= DATE(%(start)s) AND stat_date < DATE(%(end)s);
+            DELETE FROM trip_rollup_histograms_daily
+            WHERE stat_date >= DATE(%(start)s) AND stat_date < DATE(%(end)s);
+        """, params)
+    else:
+        params = {}
+        range_filter = ""
+        cursor.execute("""
+            TRUNCATE trip_rollup_hourly, trip_rollup_zones_daily, trip_rollup_histograms_daily;
+        """)
+
+    cursor.execute(TRIP_ROLLUP_SCAN.format(range_filter=range_filter), params)
+
+    row_counts = {}
+    cursor.execute("""
+        INSERT INTO trip_rollup_hourly
+            (hour_bucket, payment_type, trip_count, total_amount_sum, tip_amount_sum)
+        SELECT hour_bucket, payment_type, trip_count, total_amount_sum, tip_amount_sum
+        FROM trip_rollup_scan
+        WHERE grouping_set = 'payment';
+    """)
+    row_counts['trip_rollup_hourly'] = cursor.rowcount
+
+    cursor.execute("""
+        INSERT INTO trip_rollup_zones_daily
+            (stat_date, location_id, pickup_trips, pickup_revenue, dropoff_trips, dropoff_revenue)
+        SELECT
+            stat_date,
+            location_id,
+            COALESCE(SUM(trip_count) FILTER (WHERE grouping_set = 'pickup'), 0),
+            SUM(total_amount_sum) FILTER (WHERE grouping_set = 'pickup'),
+            COALESCE(SUM(trip_count) FILTER (WHERE grouping_set = 'dropoff'), 0),
+            SUM(total_amount_sum) FILTER (WHERE grouping_set = 'dropoff')
+        FROM trip_rollup_scan
+        WHERE grouping_set IN ('pickup', 'dropoff')
+        GROUP BY stat_date, location_id;
+    """)
+    row_counts['trip_rollup_zones_daily'] = cursor.rowcount
+
+    cursor.execute("""
+        INSERT INTO trip_rollup_histograms_daily (stat_date, metric, bin, trip_count)
+        SELECT stat_date, grouping_set, bin, trip_count
+        FROM trip_rollup_scan
+        -- Feeds without distances (FHV) have no distance bin
+        WHERE grouping_set IN ('distance', 'duration') AND bin IS NOT NULL;
+    """)
+    row_counts['trip_rollup_histograms_daily'] = cursor.rowcount
+
+    cursor.execute("DROP TABLE trip_rollup_scan;")
+    return row_counts
@@ -0,0 +1,189 @@
+"""
+Server-side zone aggregation for the NYC taxi DAG.
+
+Pickup and dropoff statistics are computed in one scan of taxi_trips with
+GROUPING SETS, joined with the zone lookup inside Postgres and written with
+INSERT ... SELECT, so no trip-level data leaves the database. Alternatively
+the per-side statistics can be computed from the Parquet lake (see
+trip_lake.zone_side_stats_from_lake) and copied in, skipping the scan.
+"""
+
+ZONE_LOOKUP_DDL = """
+    CREATE TABLE IF NOT EXISTS taxi_zone_lookup (
+        location_id INTEGER PRIMARY KEY,
+        borough VARCHAR(100),
+        zone VARCHAR(255),
+        service_zone VARCHAR(100)
+    );
+"""
+
+ZONE_AGGREGATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS zone_aggregations (
+        location_id INTEGER PRIMARY KEY,
+        zone_name VARCHAR(255),
+        borough VARCHAR(100),
+        pickup_trips INTEGER,
+        pickup_revenue DECIMAL(12,2),
+        pickup_avg_distance DECIMAL(8,2),
+        pickup_avg_duration DECIMAL(8,2),
+        pickup_avg_tip DECIMAL(8,2),
+        dropoff_trips INTEGER,
+        dropoff_revenue DECIMAL(12,2),
+        dropoff_avg_distance DECIMAL(8,2),
+        dropoff_avg_duration DECIMAL(8,2),
+        dropoff_avg_tip DECIMAL(8,2),
+        total_trips INTEGER,
+        total_revenue DECIMAL(12,2),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+ZONE_AGGREGATION_COLUMNS = [
+    'location_id', 'zone_name', 'borough',
+    'pickup_trips', 'pickup_revenue', 'pickup_avg_distance', 'pickup_avg_duration', 'pickup_avg_tip',
+    'dropoff_trips', 'dropoff_revenue', 'dropoff_avg_distance', 'dropoff_avg_duration', 'dropoff_avg_tip',
+    'total_trips', 'total_revenue',
+]
+
+# One pass over taxi_trips: GROUPING SETS hashes pickup and dropoff zones in
+# the same scan
+ZONE_SIDE_STATS_SELECT = """
+    SELECT
+        GROUPING(pickup_location_id) = 0 AS is_pickup,
+        COALESCE(pickup_location_id, dropoff_location_id) AS location_id,
+        COUNT(*) AS trips,
+        SUM(total_cents) / 100.0 AS revenue,
+        AVG(trip_distance) AS avg_distance,
+        AVG(trip_duration_minutes) AS avg_duration,
+        AVG(tip_percentage) AS avg_tip
+    FROM taxi_trips
+    GROUP BY GROUPING SETS ((pickup_location_id), (dropoff_location_id))
+"""
+
+# The same per-side statistics from sums and counts computed off the lake
+LAKE_ZONE_SIDE_STATS_DDL = """
+    CREATE TEMP TABLE zone_side_stats (
+        is_pickup BOOLEAN,
+        location_id INTEGER,
+        trips BIGINT,
+        revenue NUMERIC,
+        distance_sum NUMERIC,
+        distance_count BIGINT,
+        duration_sum BIGINT,
+        duration_count BIGINT,
+        tip_sum NUMERIC,
+        tip_count BIGINT
+    ) ON COMMIT DROP;
+"""
+
+LAKE_ZONE_SIDE_STATS_SELECT = """
+    SELECT
+        is_pickup,
+        location_id,
+        trips,
+        revenue,
+        distance_sum / NULLIF(distance_count, 0) AS avg_distance,
+        duration_sum::numeric / NULLIF(duration_count, 0) AS avg_duration,
+        tip_sum / NULLIF(tip_count, 0) AS avg_tip
+    FROM zone_side_stats
+"""
+
+# Each zone's pickup and dropoff rows are pivoted into one
+ZONE_AGGREGATIONS_SELECT = """
+    WITH per_side AS ({per_side}),
+    per_zone AS (
+        SELECT
+            location_id,
+            COALESCE(MAX(trips) FILTER (WHERE is_pickup), 0) AS pickup_trips,
+            MAX(revenue) FILTER (WHERE is_pickup) AS pickup_revenue,
+            MAX(avg_distance) FILTER (WHERE is_pickup) AS pickup_avg_distance,
+            MAX(avg_duration) FILTER (WHERE is_pickup) AS pickup_avg_duration,
+            MAX(avg_tip) FILTER (WHERE is_pickup) AS pickup_avg_tip,
+            COALESCE(MAX(trips) FILTER (WHERE NOT is_pickup), 0) AS dropoff_trips,
+            MAX(revenue) FILTER (WHERE NOT is_pickup) AS dropoff_revenue,
+            MAX(avg_distance) FILTER (WHERE NOT is_pickup) AS dropoff_avg_distance,
+            MAX(avg_duration) FILTER (WHERE NOT is_pickup) AS dropoff_avg_duration,
+            MAX(avg_tip) FILTER (WHERE NOT is_pickup) AS dropoff_avg_tip
+        FROM per_side
+        WHERE location_id IS NOT NULL
+        GROUP BY location_id
+    )
+    SELECT
+        a.location_id,
+        COALESCE(z.zone, 'Unknown'),
+        COALESCE(z.borough, 'Unknown'),
+        a.pickup_trips,
+        COALESCE(a.pickup_revenue, 0),
+        COALESCE(a.pickup_avg_distance, 0),
+        COALESCE(a.pickup_avg_duration, 0),
+        COALESCE(a.pickup_avg_tip, 0),
+        a.dropoff_trips,
+        COALESCE(a.dropoff_revenue, 0),
+        COALESCE(a.dropoff_avg_distance, 0),
+        COALESCE(a.dropoff_avg_duration, 0),
+        COALESCE(a.dropoff_avg_tip, 0),
+        a.pickup_trips + a.dropoff_trips,
+        COALESCE(a.pickup_revenue, 0) + COALESCE(a.dropoff_revenue, 0)
+    FROM per_zone a
+    LEFT JOIN taxi_zone_lookup z ON z.location_id = a.location_id
+"""
+
+
+def load_zone_lookup(cursor, zone_lookup_file):
+    """
+    Replace the contents of taxi_zone_lookup with the TLC lookup CSV.
+
+    Runs inside the caller's transaction, so readers keep seeing the old
+    rows until it commits.
+    """
+    cursor.execute(ZONE_LOOKUP_DDL)
+    cursor.execute("DELETE FROM taxi_zone_lookup;")
+    with open(zone_lookup_file, 'r') as f:
+        cursor.copy_expert(
+            "COPY taxi_zone_lookup (location_id, borough, zone, service_zone) "
+            "FROM STDIN WITH (FORMAT csv, HEADER true)",
+            f
+        )
+
+
+def refresh_zone_aggregations(cursor, side_stats=None):
+    """
+    Recompute zone_aggregations from taxi_trips entirely inside Postgres,
+    or from side_stats (an Arrow table from zone_side_stats_from_lake).
+
+    Results land in a temp staging table and are upserted into the live
+    table, with vanished zones deleted, in the caller's transaction; the
+    live table is never dropped or empty. Returns the number of zones.
+    """
+    columns = ', '.join(ZONE_AGGREGATION_COLUMNS)
+    update_columns = ZONE_AGGREGATION_COLUMNS[1:] + ['created_at']
+
+    cursor.execute(ZONE_AGGREGATIONS_DDL)
+    cursor.execute("""
+        CREATE TEMP TABLE zone_aggregations_staging
+        (LIKE zone_aggregations INCLUDING DEFAULTS) ON COMMIT DROP;
+    """)
+    if side_stats is not None:
+        from bulk_load import copy_arrow_table
+        cursor.execute(LAKE_ZONE_SIDE_STATS_DDL)
+        copy_arrow_table(cursor, side_stats, 'zone_side_stats')
+        per_side = LAKE_ZONE_SIDE_STATS_SELECT
+    else:
+        per_side = ZONE_SIDE_STATS_SELECT
+    cursor.execute(f"INSERT INTO zone_aggregations_staging ({columns}) "
+                   f"{ZONE_AGGREGATIONS_SELECT.format(per_side=per_side)};")
+    zone_count = cursor.rowcount
+
+    cursor.execute(f"""
+        INSERT INTO zone_aggregations ({columns})
+        SELECT {columns} FROM zone_aggregations_staging
+        ON CONFLICT (location_id) DO UPDATE
+          SET {', '.join(f'{column} = EXCLUDED.{column}' for column in update_columns)};
+    """)
+    cursor.execute("""
+        DELETE FROM zone_aggregations z
+        WHERE NOT EXISTS (
+            SELECT 1 FROM zone_aggregations_staging s WHERE s.location_id = z.location_id
+        );
+    """)
+    return zone_count
@@ -0,0 +1,288 @@
+"""
+Point-in-polygon assignment of pickup/dropoff coordinates to taxi zones.
+
+Older TLC files (and some other feeds) carry longitude/latitude instead of
+PULocationID/DOLocationID. ZoneIndex loads taxi_zones.shp once, reprojects
+the 263 zone polygons from NY State Plane feet to WGS84 and builds a
+quadtree over them: cells entirely inside one zone (or outside all of them)
+answer every point they contain with an array lookup, and only points in
+the small leaf cells along zone boundaries get an exact point-in-polygon
+test against the few polygon pieces in their leaf.
+
+Assignment works on NumPy arrays in vectorized batches. Points that are
+missing (NaN or 0/0) get UNKNOWN_LOCATION_ID and points outside every zone
+get OUTSIDE_LOCATION_ID, matching taxi_zone_lookup.csv.
+"""
+import math
+
+import numpy as np
+
+TAXI_ZONES_SHAPEFILE = '/opt/airflow/taxi_zones/taxi_zones.shp'
+UNKNOWN_LOCATION_ID = 264
+OUTSIDE_LOCATION_ID = 265
+
+# Root cells are about 0.85 x 1.1 km at NYC's latitude; six levels of
+# splitting bring boundary leaves down to about 13 x 17 m
+ROOT_CELL_DEGREES = 0.01
+QUADTREE_DEPTH = 6
+
+# Polygon pieces with more vertices than this are clipped to each cell
+# before they are passed down to its children
+CLIP_MIN_VERTICES = 16
+
+_EXACT_TEST = -1
+
+# Index shared with forked worker processes by assign_zones_parallel
+_worker_index = None
+
+
+def read_zone_shapefile(shapefile_path=TAXI_ZONES_SHAPEFILE):
+    """
+    Read the zone shapefile and return (records, polygons, crs): one dict of
+    LocationID, zone and borough per shape, the polygons in the shapefile's
+    own CRS (NY State Plane, US feet) as a shapely geometry array, and that
+    CRS as a pyproj.CRS
+    """
+    import os
+
+    import pyproj
+    import shapefile
+    from shapely.geometry import shape
+
+    with open(os.path.splitext(shapefile_path)[0] + '.prj', 'r') as f:
+        crs = pyproj.CRS.from_wkt(f.read())
+
+    reader = shapefile.Reader(shapefile_path)
+    try:
+        field_names = [field[0] for field in reader.fields[1:]]
+        records, polygons = [], []
+        for shape_record in reader.iterShapeRecords():
+            record = dict(zip(field_names, shape_record.record))
+            records.append({
+                'LocationID': int(record['LocationID']),
+                'zone': record['zone'],
+                'borough': record['borough'],
+            })
+            polygons.append(shape(shape_record.shape.__geo_interface__))
+    finally:
+        reader.close()
+    return records, np.array(polygons, dtype=object), crs
+
+
+def to_wgs84(polygons, crs):
+    """Reproject a shapely geometry array from crs to WGS84 longitude/latitude"""
+    import pyproj
+    import shapely
+
+    transformer = pyproj.Transformer.from_crs(crs, 'EPSG:4326', always_xy=True)
+    return shapely.transform(
+        polygons,
+        lambda coords: np.column_stack(transformer.transform(coords[:, 0], coords[:, 1])),
+    )
+
+
+def read_zone_polygons(shapefile_path=TAXI_ZONES_SHAPEFILE):
+    """
+    Read the zone shapefile and return (LocationID array, polygons in WGS84
+    longitude/latitude as a shapely geometry array)
+    """
+    import shapely
+
+    records, polygons, crs = read_zone_shapefile(shapefile_path)
+    location_ids = np.array([record['LocationID'] for record in records], dtype=np.int32)
+    return location_ids, shapely.make_valid(to_wgs84(polygons, crs))
+
+
+class ZoneIndex:
+    """
+    Quadtree index over the taxi zone polygons.
+
+    The zones' bounding box is cut into a root grid and every cell that
+    straddles a zone boundary is split into four, down to `depth` levels.
+    Cells are classified against their parent's polygon pieces, clipped
+    while they are still detailed, so deep levels only test small pieces. nodes holds one int32 per cell:
+    a LocationID (or OUTSIDE_LOCATION_ID), _EXACT_TEST for boundary leaves,
+    or minus the index of the cell's first child (children come after the
+    root grid, so these are below -1).
+    """
+
+    def __init__(self, location_ids, polygons, root_cell_degrees=ROOT_CELL_DEGREES, depth=QUADTREE_DEPTH):
+        import shapely
+
+        self.location_ids = location_ids
+        self.polygons = polygons
+        self.tree = shapely.STRtree(polygons)
+        self.root_cell = root_cell_degrees
+        self.depth = depth
+
+        min_x, min_y, max_x, max_y = shapely.total_bounds(polygons)
+        self.min_x, self.min_y = min_x, min_y
+        self.nx = math.ceil((max_x - min_x) / root_cell_degrees)
+        self.ny = math.ceil((max_y - min_y) / root_cell_degrees)
+
+        cell_y, cell_x = np.divmod(np.arange(self.nx * self.ny), self.nx)
+        cell_nodes = np.arange(self.nx * self.ny)
+        pair_cell, pair_polygon = self.tree.query(self._cell_boxes(cell_x, cell_y, 0), predicate='intersects')
+        pieces = polygons[pair_polygon]
+
+        nodes = [np.full(self.nx * self.ny, OUTSIDE_LOCATION_ID, dtype=np.int32)]
+        block_start, node_count = 0, self.nx * self.ny
+        for level in range(depth + 1):
+            boxes = self._cell_boxes(cell_x[pair_cell], cell_y[pair_cell], level)
+            hit = shapely.intersects(boxes, pieces)
+            pair_cell, pair_polygon, pieces, boxes = pair_cell[hit], pair_polygon[hit], pieces[hit], boxes[hit]
+
+            values = np.full(len(cell_nodes), OUTSIDE_LOCATION_ID, dtype=np.int32)
+            values[pair_cell] = _EXACT_TEST
+            within = np.flatnonzero(shapely.within(boxes, pieces))
+            # Assign in descending polygon order so the first polygon wins, as in assign_exact
+            within = within[np.argsort(-pair_polygon[within], kind='stable')]
+            values[pair_cell[within]] = location_ids[pair_polygon[within]]
+
+            boundary = np.flatnonzero(values == _EXACT_TEST)
+            keep = values[pair_cell] == _EXACT_TEST
+            pair_cell, pair_polygon, pieces = pair_cell[keep], pair_polygon[keep], pieces[keep]
+            if level == depth or not boundary.size:
+                nodes[-1][cell_nodes - block_start] = values
+                break
+
+            # Clip pieces that are still detailed; small ones are cheap to test as they are
+            detailed = np.flatnonzero(shapely.get_num_coordinates(pieces) > CLIP_MIN_VERTICES)
+            pieces[detailed] = shapely.intersection(boxes[keep][detailed], pieces[detailed])
+
+            # Split boundary cells into 2x2 children stored after everything so far
+            first_child = node_count + 4 * np.arange(boundary.size)
+            values[boundary] = -first_child
+            nodes[-1][cell_nodes - block_start] = values
+            nodes.append(np.zeros(4 * boundary.size, dtype=np.int32))
+            block_start, node_count = node_count, node_count + 4 * boundary.size
+
+            child_y, child_x = np.divmod(np.arange(4), 2)
+            cell_x = (2 * cell_x[boundary][:, None] + child_x).ravel()
+            cell_y = (2 * cell_y[boundary][:, None] + child_y).ravel()
+            cell_nodes = (first_child[:, None] + np.arange(4)).ravel()
+
+            rank = np.full(len(values), -1)
+            rank[boundary] = np.arange(boundary.size)
+            pair_cell = (4 * rank[pair_cell][:, None] + np.arange(4)).ravel()
+            pair_polygon = np.repeat(pair_polygon, 4)
+            pieces = np.repeat(pieces, 4)
+
+        self.nodes = np.concatenate(nodes)
+        # Boundary leaves keep their pieces for the exact test, sorted by leaf
+        # node and then polygon so a leaf's pieces are one contiguous run
+        leaf_nodes = cell_nodes[pair_cell]
+        order = np.lexsort((pair_polygon, leaf_nodes))
+        self.leaf_nodes = leaf_nodes[order]
+        self.leaf_polygons = pair_polygon[order]
+        self.leaf_pieces = pieces[order]
+
+    def _cell_boxes(self, cell_x, cell_y, level):
+        import shapely
+
+        size = self.root_cell / 2 ** level
+        return shapely.box(
+            self.min_x + cell_x * size, self.min_y + cell_y * size,
+            self.min_x + (cell_x + 1) * size, self.min_y + (cell_y + 1) * size,
+        )
+
+    @classmethod
+    def from_shapefile(cls, shapefile_path=TAXI_ZONES_SHAPEFILE, **kwargs):
+        location_ids, polygons = read_zone_polygons(shapefile_path)
+        return cls(location_ids, polygons, **kwargs)
+
+    def assign(self, longitudes, latitudes):
+        """
+        Return an int32 array of LocationIDs for arrays of WGS84 longitudes
+        and latitudes
+        """
+        lon = np.asarray(longitudes, dtype=np.float64)
+        lat = np.asarray(latitudes, dtype=np.float64)
+        result = np.full(lon.shape, OUTSIDE_LOCATION_ID, dtype=np.int32)
+
+        missing = ~(np.isfinite(lon) & np.isfinite(lat)) | ((lon == 0) & (lat == 0))
+        result[missing] = UNKNOWN_LOCATION_ID
+
+        # Cell coordinates in units of the root cell; halving the cell size
+        # doubles these exactly, so every level agrees on which cell a point is in
+        with np.errstate(invalid='ignore'):
+            fx = (lon - self.min_x) / self.root_cell
+            fy = (lat - self.min_y) / self.root_cell
+        rows = np.flatnonzero(~missing & (fx >= 0) & (fx < self.nx) & (fy >= 0) & (fy < self.ny))
+        fx, fy = fx[rows], fy[rows]
+        node = fy.astype(np.int64) * self.nx + fx.astype(np.int64)
+        values = self.nodes[node]
+
+        for level in range(1, self.depth + 1):
+            result[rows] = values
+            descend = values < _EXACT_TEST
+            rows, fx, fy, values = rows[descend], fx[descend], fy[descend], values[descend]
+            if not rows.size:
+                break
+            scale = 2 ** level
+            child = 2 * (np.floor(fy * scale).astype(np.int64) & 1) + (np.floor(fx * scale).astype(np.int64) & 1)
+            node = -values.astype(np.int64) + child
+            values = self.nodes[node]
+        result[rows] = values
+
+        exact = values == _EXACT_TEST
+        if exact.any():
+            result[rows[exact]] = self._assign_in_leaves(node[exact], lon[rows[exact]], lat[rows[exact]])
+        return result
+
+    def _assign_in_leaves(self, leaf_node, lon, lat):
+        """Exact test of points against the few pieces of their boundary leaf"""
+        import shapely
+
+        start = np.searchsorted(self.leaf_nodes, leaf_node, side='left')
+        count = np.searchsorted(self.leaf_nodes, leaf_node, side='right') - start
+        point = np.repeat(np.arange(len(leaf_node)), count)
+        pair = np.arange(len(point)) - np.repeat(np.cumsum(count) - count, count) + start[point]
+
+        hit = shapely.intersects_xy(self.leaf_pieces[pair], lon[point], lat[point])
+        result = np.full(len(leaf_node), OUTSIDE_LOCATION_ID, dtype=np.int32)
+        # Pieces are in polygon order within a leaf, so the first hit is the first polygon
+        hit_points, first = np.unique(point[hit], return_index=True)
+        result[hit_points] = self.location_ids[self.leaf_polygons[pair[hit][first]]]
+        return result
+
+    def assign_exact(self, longitudes, latitudes):
+        """STRtree-only assignment against the full polygons; the reference for assign"""
+        import shapely
+
+        points = shapely.points(longitudes, latitudes)
+        result = np.full(len(points), OUTSIDE_LOCATION_ID, dtype=np.int32)
+        point_rows, polygon = self.tree.query(points, predicate='intersects')
+        # A point on a shared edge matches both zones; keep the first polygon
+        order = np.lexsort((polygon, point_rows))
+        point_rows, polygon = point_rows[order], polygon[order]
+        first_rows, first = np.unique(point_rows, return_index=True)
+        result[first_rows] = self.location_ids[polygon[first]]
+        return result
+
+
+def _assign_chunk(chunk):
+    longitudes, latitudes = chunk
+    return _worker_index.assign(longitudes, latitudes)
+
+
+def assign_zones_parallel(index, longitudes, latitudes, processes=None, chunk_size=1_000_000):
+    """
+    Assign zones with a pool of forked worker processes sharing `index`
+    (inherited copy-on-write, so it is not rebuilt or pickled per worker)
+    """
+    import multiprocessing
+
+    global _worker_index
+    lon = np.asarray(longitudes, dtype=np.float64)
+    lat = np.asarray(latitudes, dtype=np.float64)
+    chunks = [(lon[i:i + chunk_size], lat[i:i + chunk_size]) for i in range(0, len(lon), chunk_size)]
+    if not chunks:
+        return np.empty(0, dtype=np.int32)
+
+    _worker_index = index
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            return np.concatenate(pool.map(_assign_chunk, chunks))
+    finally:
+        _worker_index = None
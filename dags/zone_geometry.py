@@ -0,0 +1,191 @@
+"""
+Simplified, content-hashed taxi zone geometry for the map.
+
+The zone map only needs a few tens of KB of geometry (gzipped), not the
+full shapefile. build_zone_geometry() converts taxi_zones.shp into one
+GeoJSON FeatureCollection per detail level, simplified so that neighbouring
+zones still share their borders (no gaps or overlaps opening up between
+them) and with coordinates snapped to the precision the level needs. File names carry
+a hash of their content, so the web app can cache them forever; a
+manifest.json maps each level to its current file.
+
+The shapefile's polygons do not quite tile: neighbouring zones were
+digitized separately, leaving thousands of sliver gaps and overlaps a few
+square feet in size. They are cleaned into a proper coverage first, by
+cutting the zones along every boundary and giving each piece to the zone
+that covers most of it (or, for gaps, to the neighbour it shares the
+longest edge with). The coverage's boundaries are then merged into arcs
+between junctions, all arcs are simplified together without letting any two
+cross, and every zone is rebuilt from its own arcs.
+"""
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from zone_assignment import TAXI_ZONES_SHAPEFILE, read_zone_shapefile, to_wgs84
+
+ZONE_GEOMETRY_DIR = '/opt/airflow/public/zones'
+ZONE_GEOMETRY_MANIFEST = 'manifest.json'
+
+# Detail level -> (simplification tolerance in the shapefile's US feet,
+# decimal places kept in longitude/latitude; 4 is about 10 m)
+ZONE_GEOMETRY_LEVELS = {
+    'low': (500, 4),
+    'medium': (150, 4),
+    'high': (40, 5),
+}
+
+_SOURCE_EXTENSIONS = ('.shp', '.dbf', '.prj')
+
+
+def clean_coverage(polygons):
+    """
+    Return polygons with the slivers between them resolved, so that each
+    point belongs to at most one zone and neighbours share their borders
+    exactly
+    """
+    import shapely
+
+    pieces = shapely.get_parts(shapely.polygonize(shapely.get_parts(
+        shapely.line_merge(shapely.union_all(shapely.boundary(polygons)))
+    )))
+    piece_area = shapely.area(pieces)
+
+    # Each piece goes to the zone covering most of it
+    piece_index, zone_index = shapely.STRtree(polygons).query(pieces, predicate='intersects')
+    overlap = shapely.area(shapely.intersection(pieces[piece_index], polygons[zone_index]))
+    order = np.lexsort((-overlap, piece_index))
+    piece_index, zone_index, overlap = piece_index[order], zone_index[order], overlap[order]
+    first_pieces, first = np.unique(piece_index, return_index=True)
+    owner = np.full(len(pieces), -1)
+    covered = overlap[first] >= 0.5 * piece_area[first_pieces]
+    owner[first_pieces[covered]] = zone_index[first[covered]]
+
+    # Gaps between zones go to the neighbour sharing the longest edge with them
+    piece_tree = shapely.STRtree(pieces)
+    for gap in np.flatnonzero(owner < 0):
+        neighbours = piece_tree.query(pieces[gap], predicate='touches')
+        neighbours = neighbours[owner[neighbours] >= 0]
+        if neighbours.size:
+            shared = shapely.length(shapely.intersection(
+                shapely.boundary(pieces[neighbours]), shapely.boundary(pieces[gap])
+            ))
+            owner[gap] = owner[neighbours[np.argmax(shared)]]
+
+    return np.array([shapely.union_all(pieces[owner == zone]) for zone in range(len(polygons))], dtype=object)
+
+
+def simplify_coverage(coverage, tolerance):
+    """
+    Simplify a clean coverage (see clean_coverage) so that shared borders
+    are simplified once and stay shared
+    """
+    import shapely
+
+    boundaries = shapely.boundary(coverage)
+    arcs = shapely.get_parts(shapely.line_merge(shapely.union_all(boundaries)))
+    # Which zones each arc borders
+    arc_index, zone_index = shapely.STRtree(boundaries).query(
+        shapely.line_interpolate_point(arcs, 0.5, normalized=True), predicate='dwithin', distance=0.01,
+    )
+    # Simplifying all arcs as one geometry keeps them from crossing each other;
+    # arc end points (the junctions between zones) never move
+    simplified = shapely.get_parts(shapely.simplify(shapely.multilinestrings(arcs), tolerance, preserve_topology=True))
+
+    result = []
+    for zone, polygon in enumerate(coverage):
+        faces = shapely.get_parts(shapely.polygonize(simplified[arc_index[zone_index == zone]]))
+        # Rings of a zone's own arcs also bound its holes; keep only its faces
+        inside = shapely.area(shapely.intersection(faces, polygon)) > 0.5 * shapely.area(faces)
+        if inside.any():
+            result.append(shapely.union_all(faces[inside]))
+        else:
+            result.append(shapely.simplify(polygon, tolerance, preserve_topology=True))
+    return np.array(result, dtype=object)
+
+
+def zone_feature_collection(records, polygons, decimals):
+    """Return compact GeoJSON bytes for WGS84 zone polygons and their records"""
+    import shapely
+
+    # Snapping to the grid (rather than rounding coordinates) keeps polygons valid
+    rounded = shapely.set_precision(polygons, 10 ** -decimals)
+    features = [
+        {'type': 'Feature', 'properties': record, 'geometry': json.loads(shapely.to_geojson(polygon))}
+        for record, polygon in zip(records, rounded)
+    ]
+    return json.dumps({'type': 'FeatureCollection', 'features': features}, separators=(',', ':')).encode()
+
+
+def read_zone_geometry_manifest(out_dir):
+    path = os.path.join(out_dir, ZONE_GEOMETRY_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _source_digest(shapefile_path, levels):
+    """Hash of the shapefile's parts and the level settings the artifacts were built with"""
+    digest = hashlib.sha256(json.dumps(levels, sort_keys=True).encode())
+    for extension in _SOURCE_EXTENSIONS:
+        with open(os.path.splitext(shapefile_path)[0] + extension, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def _write_atomically(path, content):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(content)
+    os.replace(path + '.tmp', path)
+
+
+def build_zone_geometry(shapefile_path=TAXI_ZONES_SHAPEFILE, out_dir=ZONE_GEOMETRY_DIR, levels=None):
+    """
+    Write taxi_zones.<level>.<hash>.geojson for each level and the manifest
+    into out_dir, unless the manifest shows they were already built from the
+    same shapefile and settings. Returns the manifest.
+    """
+    levels = levels or ZONE_GEOMETRY_LEVELS
+    source = _source_digest(shapefile_path, levels)
+    manifest = read_zone_geometry_manifest(out_dir)
+    if manifest.get('source_sha256') == source and all(
+        os.path.exists(os.path.join(out_dir, entry['file'])) for entry in manifest.get('levels', {}).values()
+    ):
+        logging.info(f"Zone geometry in {out_dir} is up to date")
+        return manifest
+
+    import shapely
+
+    records, polygons, crs = read_zone_shapefile(shapefile_path)
+    coverage = clean_coverage(shapely.make_valid(polygons))
+
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {'source_sha256': source, 'levels': {}}
+    for level, (tolerance, decimals) in levels.items():
+        simplified = simplify_coverage(coverage, tolerance)
+        content = zone_feature_collection(records, to_wgs84(simplified, crs), decimals)
+        file_name = f"taxi_zones.{level}.{hashlib.sha256(content).hexdigest()[:12]}.geojson"
+        _write_atomically(os.path.join(out_dir, file_name), content)
+        manifest['levels'][level] = {
+            'file': file_name,
+            'bytes': len(content),
+            'vertices': int(shapely.get_num_coordinates(simplified).sum()),
+            'tolerance_feet': tolerance,
+            'decimals': decimals,
+        }
+        logging.info(f"Wrote {file_name} ({len(content) / 1024:.0f} KB)")
+
+    # The manifest goes last, so it never points at a file that is not there yet
+    _write_atomically(
+        os.path.join(out_dir, ZONE_GEOMETRY_MANIFEST),
+        json.dumps(manifest, indent=2, sort_keys=True).encode(),
+    )
+    current = {entry['file'] for entry in manifest['levels'].values()}
+    for name in os.listdir(out_dir):
+        if name.startswith('taxi_zones.') and name.endswith('.geojson') and name not in current:
+            os.remove(os.path.join(out_dir, name))
+    return manifest
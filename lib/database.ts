@@ -1,4 +1,4 @@
-import { Pool } from 'pg'
+import { Pool, PoolClient, QueryResult } from 'pg'
 
 // Try connection string first, fallback to individual params
 const getPoolConfig = () => {
@@ -54,8 +54,139 @@ export async function query(text: string, params: string[] = []) {
   }
 }
 
+// Results of the dashboard's aggregate queries are cached per data version.
+// After every load the DAG refreshes the dashboard views, bumps the single
+// data_version row and sends NOTIFY taxi_data_version (dags/dashboard_views.py),
+// so a cached result stays valid until the version changes and repeated
+// queries between loads never reach the database. A long-running server
+// LISTENs on one pooled connection and drops the cache as soon as the
+// notification arrives; where that connection cannot be held (LISTEN fails,
+// e.g. through a transaction-mode pooler, or the connection drops) the version
+// row is re-read at most every DATA_VERSION_POLL_MS instead.
+const DATA_VERSION_CHANNEL = 'taxi_data_version'
+const DATA_VERSION_POLL_MS = 30000
+const RESULT_CACHE_ENTRIES = 500
+
+let dataVersion: number | null = null
+let dataVersionReadAt = 0
+let versionListener: PoolClient | null = null
+let versionListenerStarting = false
+// In-flight and finished queries by version, text and params, least recently used first
+const resultCache = new Map<string, Promise<QueryResult>>()
+
+function setDataVersion(version: number) {
+  if (version !== dataVersion) {
+    dataVersion = version
+    resultCache.clear()
+  }
+  dataVersionReadAt = Date.now()
+}
+
+async function readDataVersion(client: Pool | PoolClient) {
+  try {
+    const result = await client.query('SELECT version FROM data_version')
+    setDataVersion(Number(result.rows[0]?.version ?? 0))
+  } catch (error: any) {
+    // No load has published a version yet
+    if (error?.code !== '42P01') throw error
+    setDataVersion(0)
+  }
+}
+
+async function listenForDataVersion() {
+  if (versionListener || versionListenerStarting) return
+  versionListenerStarting = true
+  let client: PoolClient | null = null
+  try {
+    client = await pool.connect()
+    const listener = client
+    listener.on('notification', (message) => {
+      if (message.channel !== DATA_VERSION_CHANNEL || !message.payload) return
+      try {
+        setDataVersion(Number(JSON.parse(message.payload).version))
+      } catch (error) {
+        console.error('Invalid data version notification:', error)
+      }
+    })
+    listener.on('error', (error) => {
+      console.error('Data version listener failed, polling instead:', error)
+      // Errors while starting up are handled below
+      if (versionListener === listener) {
+        versionListener = null
+        listener.release(error)
+      }
+    })
+    await listener.query(`LISTEN ${DATA_VERSION_CHANNEL}`)
+    // Read once the listener is up, so no bump in between is missed
+    await readDataVersion(listener)
+    versionListener = listener
+  } catch (error) {
+    console.error('Could not listen for data versions, polling instead:', error)
+    if (client) client.release(error as Error)
+  } finally {
+    versionListenerStarting = false
+  }
+}
+
+// The current data version, as last notified or (without a listener) read
+export async function getDataVersion(): Promise<number> {
+  if (!versionListener) {
+    void listenForDataVersion()
+  }
+  if (dataVersion === null || (!versionListener && Date.now() - dataVersionReadAt > DATA_VERSION_POLL_MS)) {
+    await readDataVersion(pool)
+  }
+  return dataVersion as number
+}
+
+// query() for the results of the dashboard's aggregate queries, cached until
+// the next data version; concurrent identical requests share one query
+export async function cachedQuery(text: string, params: unknown[] = []): Promise<QueryResult> {
+  const version = await getDataVersion()
+  const key = JSON.stringify([version, text, params])
+  let result = resultCache.get(key)
+  if (result) {
+    resultCache.delete(key)
+  } else {
+    result = pool.query(text, params as any[])
+    if (resultCache.size >= RESULT_CACHE_ENTRIES) {
+      resultCache.delete(resultCache.keys().next().value as string)
+    }
+  }
+  resultCache.set(key, result)
+  try {
+    return await result
+  } catch (error) {
+    resultCache.delete(key)
+    console.error('Database query error:', error)
+    throw error
+  }
+}
+
+// The dashboard views (dags/dashboard_views.py) roll the rollups up to
+// calendar months. A range $1..$2 (inclusive) of whole days or hours (unit)
+// reads the whole months it covers from the views (months) and the rest,
+// the partial months at either edge, from the daily or hourly table
+// (edges(column)). When the range covers no whole month the edges are the
+// whole range. Every bound is a plain expression of $1 and $2, so each edge
+// is an index range scan.
+export function monthSplit(unit: 'day' | 'hour') {
+  const cast = unit === 'day' ? '::date' : ''
+  const start = `(date_trunc('month', date_trunc('${unit}', $1::timestamp) - interval '1 ${unit}') + interval '1 month')${cast}`
+  const end = `date_trunc('month', date_trunc('${unit}', $2::timestamp) + interval '1 ${unit}')${cast}`
+  const [low, high] = unit === 'day'
+    ? ['$1::timestamp::date', '$2::timestamp::date']
+    : [`date_trunc('hour', $1::timestamp)`, '$2::timestamp']
+  return {
+    months: `month >= ${start} AND month < ${end}`,
+    edges: (column: string) => {
+      const within = `${column} >= ${low} AND ${column} <= ${high}`
+      return `((${within} AND ${column} < ${start}) OR (${within} AND ${column} >= GREATEST(${start}, ${end})))`
+    },
+  }
+}
+
 export interface TaxiTrip {
-  id: number
   pickup_datetime: string
   dropoff_datetime: string
   pickup_location_id: number
@@ -67,37 +198,34 @@ export interface TaxiTrip {
   payment_type: number
   trip_duration_minutes: number
   tip_percentage: number
-  created_at: string
 }
 
-export async function getTaxiData(startDate: string, endDate: string, limit: number = 0): Promise<TaxiTrip[]> {
-  let query = `
+// Most trips getTaxiData returns at once. Whole date ranges of trips are not
+// read through the API process; they are published as precomputed extracts
+// (dags/trip_export.py, listed by /api/taxi-data/extracts)
+export const MAX_TRIP_ROWS = 10000
+
+export async function getTaxiData(startDate: string, endDate: string, limit: number = 1000): Promise<TaxiTrip[]> {
+  const query = `
     SELECT 
-      id,
       pickup_datetime,
       dropoff_datetime,
       pickup_location_id,
       dropoff_location_id,
       trip_distance,
-      fare_amount,
-      tip_amount,
-      total_amount,
+      fare_cents / 100.0 as fare_amount,
+      tip_cents / 100.0 as tip_amount,
+      total_cents / 100.0 as total_amount,
       payment_type,
       trip_duration_minutes,
-      tip_percentage,
-      created_at
+      tip_percentage
     FROM taxi_trips 
     WHERE pickup_datetime >= $1 AND pickup_datetime <= $2
     ORDER BY pickup_datetime DESC
+    LIMIT $3
   `
   
-  const params = [startDate, endDate]
-  
-  // Only add LIMIT if limit > 0
-  if (limit > 0) {
-    query += ` LIMIT $3`
-    params.push(limit.toString())
-  }
+  const params = [startDate, endDate, Math.min(Math.max(Math.floor(limit), 1), MAX_TRIP_ROWS).toString()]
   
   try {
     const result = await pool.query(query, params)
@@ -112,11 +240,11 @@ export async function getTaxiStats(startDate: string, endDate: string) {
   const query = `
     SELECT 
       COUNT(*) as total_trips,
-      AVG(fare_amount) as avg_fare,
-      AVG(tip_amount) as avg_tip,
+      AVG(fare_cents) / 100 as avg_fare,
+      AVG(tip_cents) / 100 as avg_tip,
       AVG(trip_duration_minutes) as avg_duration,
       AVG(tip_percentage) as avg_tip_percentage,
-      SUM(total_amount) as total_revenue
+      SUM(total_cents) / 100.0 as total_revenue
     FROM taxi_trips 
     WHERE pickup_datetime >= $1 AND pickup_datetime <= $2
   `
@@ -135,7 +263,7 @@ export async function getPaymentTypeDistribution(startDate: string, endDate: str
     SELECT 
       payment_type,
       COUNT(*) as count,
-      AVG(fare_amount) as avg_fare,
+      AVG(fare_cents) / 100 as avg_fare,
       AVG(tip_percentage) as avg_tip_percentage
     FROM taxi_trips 
     WHERE pickup_datetime >= $1 AND pickup_datetime <= $2
@@ -157,7 +285,7 @@ export async function getHourlyDistribution(startDate: string, endDate: string)
     SELECT 
       EXTRACT(HOUR FROM pickup_datetime) as hour,
       COUNT(*) as trip_count,
-      AVG(fare_amount) as avg_fare
+      AVG(fare_cents) / 100 as avg_fare
     FROM taxi_trips 
     WHERE pickup_datetime >= $1 AND pickup_datetime <= $2
     GROUP BY EXTRACT(HOUR FROM pickup_datetime)
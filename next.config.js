@@ -7,6 +7,21 @@ const nextConfig = {
     NEXT_PUBLIC_SUPABASE_URL: process.env.NEXT_PUBLIC_SUPABASE_URL,
     NEXT_PUBLIC_SUPABASE_ANON_KEY: process.env.NEXT_PUBLIC_SUPABASE_ANON_KEY,
   },
+  async headers() {
+    // Zone geometry files are named by a hash of their content, so they never
+    // change; manifest.json keeps the default caching
+    return [
+      {
+        source: '/zones/:file(taxi_zones\\..*\\.geojson)',
+        headers: [{ key: 'Cache-Control', value: 'public, max-age=31536000, immutable' }],
+      },
+      {
+        // Trip extracts are named the same way (public/exports/trips/YYYY-MM/)
+        source: '/exports/trips/:month/:file',
+        headers: [{ key: 'Cache-Control', value: 'public, max-age=31536000, immutable' }],
+      },
+    ];
+  },
   experimental: {
     esmExternals: 'loose'
   },
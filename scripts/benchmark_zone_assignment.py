@@ -0,0 +1,94 @@
+"""
+Benchmark point-in-polygon zone assignment over taxi_zones.shp.
+
+Generates random pickup coordinates over the zones' bounding box (plus a
+share of missing 0/0 and NaN coordinates), assigns them with the quadtree
+index in dags/zone_assignment.py, checks a sample against a plain STRtree
+query of the full polygons, and reports points per second on one core and,
+with --processes, through the multiprocessing path.
+
+Usage:
+    python scripts/benchmark_zone_assignment.py [--points 5000000] [--processes 4]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import shapely
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_ROOT, 'dags'))
+
+from zone_assignment import (  # noqa: E402
+    OUTSIDE_LOCATION_ID,
+    UNKNOWN_LOCATION_ID,
+    ZoneIndex,
+    assign_zones_parallel,
+)
+
+SHAPEFILE = os.path.join(REPO_ROOT, 'taxi_zones', 'taxi_zones.shp')
+
+
+def random_points(index, count, missing_share, seed=0):
+    rng = np.random.default_rng(seed)
+    min_x, min_y, max_x, max_y = shapely.total_bounds(index.polygons)
+    lon = rng.uniform(min_x, max_x, count)
+    lat = rng.uniform(min_y, max_y, count)
+    missing = rng.random(count) < missing_share
+    lon[missing], lat[missing] = 0.0, 0.0
+    lat[missing & (rng.random(count) < 0.5)] = np.nan
+    return lon, lat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--shapefile', default=SHAPEFILE)
+    parser.add_argument('--points', type=int, default=5_000_000)
+    parser.add_argument('--check-points', type=int, default=200_000,
+                        help='points compared against the plain STRtree query')
+    parser.add_argument('--missing-share', type=float, default=0.01)
+    parser.add_argument('--processes', type=int, help='also time assign_zones_parallel with this many workers')
+    args = parser.parse_args()
+
+    started = time.time()
+    index = ZoneIndex.from_shapefile(args.shapefile)
+    build_seconds = time.time() - started
+    lon, lat = random_points(index, args.points, args.missing_share)
+
+    started = time.time()
+    zones = index.assign(lon, lat)
+    assign_seconds = time.time() - started
+
+    sample = slice(0, args.check_points)
+    started = time.time()
+    expected = index.assign_exact(lon[sample], lat[sample])
+    exact_seconds = time.time() - started
+    # assign_exact has no notion of missing coordinates
+    expected[np.isnan(lat[sample]) | ((lon[sample] == 0) & (lat[sample] == 0))] = UNKNOWN_LOCATION_ID
+    mismatches = int(np.sum(zones[sample] != expected))
+
+    result = {
+        'points': args.points,
+        'build_seconds': round(build_seconds, 2),
+        'quadtree_nodes': len(index.nodes),
+        'boundary_leaf_pieces': len(index.leaf_pieces),
+        'points_per_sec': round(args.points / assign_seconds),
+        'strtree_points_per_sec': round(args.check_points / exact_seconds),
+        'outside_share': round(float(np.mean(zones == OUTSIDE_LOCATION_ID)), 3),
+        'mismatches': mismatches,
+    }
+    if args.processes:
+        started = time.time()
+        parallel = assign_zones_parallel(index, lon, lat, processes=args.processes)
+        result['parallel_points_per_sec'] = round(args.points / (time.time() - started))
+        result['parallel_matches'] = bool(np.array_equal(parallel, zones))
+
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if mismatches == 0 and result.get('parallel_matches', True) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Build the simplified zone geometry for the map outside Airflow.
+
+Runs dags/zone_geometry.py on the repository's taxi_zones/taxi_zones.shp and
+writes the content-hashed GeoJSON files and manifest.json to public/zones/,
+then reports each level's size (raw and gzipped), vertex count, and whether
+every zone is still present and valid.
+
+Usage:
+    python scripts/build_zone_geometry.py [--out-dir public/zones] [--force]
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_ROOT, 'dags'))
+
+from zone_geometry import ZONE_GEOMETRY_MANIFEST, build_zone_geometry  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--shapefile', default=os.path.join(REPO_ROOT, 'taxi_zones', 'taxi_zones.shp'))
+    parser.add_argument('--out-dir', default=os.path.join(REPO_ROOT, 'public', 'zones'))
+    parser.add_argument('--force', action='store_true', help='rebuild even if the manifest is up to date')
+    args = parser.parse_args()
+
+    import shapely
+    from shapely.geometry import shape
+
+    if args.force and os.path.exists(os.path.join(args.out_dir, ZONE_GEOMETRY_MANIFEST)):
+        os.remove(os.path.join(args.out_dir, ZONE_GEOMETRY_MANIFEST))
+    manifest = build_zone_geometry(args.shapefile, args.out_dir)
+
+    result = {}
+    ok = True
+    for level, entry in manifest['levels'].items():
+        with open(os.path.join(args.out_dir, entry['file']), 'rb') as f:
+            content = f.read()
+        features = json.loads(content)['features']
+        polygons = [shape(feature['geometry']) for feature in features]
+        invalid = sum(not polygon.is_valid or polygon.is_empty for polygon in polygons)
+        ok = ok and invalid == 0
+        result[level] = {
+            'file': entry['file'],
+            'kb': round(len(content) / 1024, 1),
+            'gzip_kb': round(len(gzip.compress(content)) / 1024, 1),
+            'vertices': entry['vertices'],
+            'features': len(features),
+            'invalid_or_empty': invalid,
+            'total_area': round(sum(shapely.area(polygons)), 6),
+        }
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+Check the DAG's final stage: dashboard view refresh and data version publish.
+
+Runs publish_data_version() (dags/dashboard_views.py) in a transaction, as
+publish_data_version_task does, while a second connection LISTENs on the
+data version channel and a third reads the dashboard views. Checks that:
+
+- readers are not blocked while the views are refreshed
+- the notification arrives only after the commit, with the new version
+- the version is one above the previous one and matches the data_version row
+- every view holds exactly what its query over the rollups returns
+
+Each run publishes a new version, so API caches are dropped as after a load.
+
+Usage:
+    DATABASE_URL=postgresql://... python scripts/check_data_version.py
+"""
+import argparse
+import json
+import os
+import select
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dags'))
+
+from dashboard_views import (  # noqa: E402
+    DASHBOARD_VIEWS,
+    DATA_VERSION_CHANNEL,
+    DATA_VERSION_DDL,
+    publish_data_version,
+)
+
+
+def notifications(conn, timeout):
+    """Notifications received on conn within timeout seconds, as parsed payloads"""
+    deadline = time.time() + timeout
+    while time.time() < deadline and not conn.notifies:
+        select.select([conn], [], [], max(deadline - time.time(), 0))
+        conn.poll()
+    payloads = [json.loads(notify.payload) for notify in conn.notifies]
+    conn.notifies.clear()
+    return payloads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--run-id', default='check_data_version')
+    parser.add_argument('--lock-timeout-ms', type=int, default=500,
+                        help='how long a view read may wait during the refresh')
+    args = parser.parse_args()
+
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is required")
+
+    failures = []
+
+    def check(ok, message):
+        if not ok:
+            failures.append(message)
+
+    publisher = psycopg2.connect(database_url)
+    listener = psycopg2.connect(database_url)
+    listener.autocommit = True
+    reader = psycopg2.connect(database_url)
+    reader.autocommit = True
+
+    cursor = publisher.cursor()
+    cursor.execute(DATA_VERSION_DDL)
+    cursor.execute("SELECT matviewname FROM pg_matviews WHERE schemaname = current_schema();")
+    if set(DASHBOARD_VIEWS) - {name for name, in cursor.fetchall()}:
+        # A first publish creates the views; only refreshes are concurrent
+        publish_data_version(cursor, args.run_id)
+    publisher.commit()
+    cursor.execute("SELECT version FROM data_version;")
+    previous = cursor.fetchone()[0]
+    publisher.commit()
+
+    listener.cursor().execute(f"LISTEN {DATA_VERSION_CHANNEL};")
+
+    started = time.time()
+    version, row_counts = publish_data_version(cursor, args.run_id)
+    refresh_seconds = time.time() - started
+
+    reader_cursor = reader.cursor()
+    reader_cursor.execute("SET lock_timeout = %s;", (f"{args.lock_timeout_ms}ms",))
+    for name in DASHBOARD_VIEWS:
+        try:
+            reader_cursor.execute(f"SELECT COUNT(*) FROM {name};")
+            reader_cursor.fetchone()
+        except psycopg2.errors.LockNotAvailable:
+            check(False, f"{name}: read blocked during the refresh")
+    check(not notifications(listener, 0.5), "notification delivered before the commit")
+
+    publisher.commit()
+    received = notifications(listener, 5)
+    check(version == previous + 1, f"version {version} after {previous}")
+    check([payload['version'] for payload in received] == [version],
+          f"notifications after the commit: {received}, expected version {version}")
+    check(all(payload['run_id'] == args.run_id for payload in received), f"run_id missing from {received}")
+    cursor.execute("SELECT version FROM data_version;")
+    check(cursor.fetchone()[0] == version, "data_version row differs from the published version")
+
+    for name, (view_select, _) in DASHBOARD_VIEWS.items():
+        cursor.execute(f"""
+            SELECT (SELECT COUNT(*) FROM (TABLE {name} EXCEPT ALL ({view_select})) extra),
+                   (SELECT COUNT(*) FROM (({view_select}) EXCEPT ALL TABLE {name}) missing)
+        """)
+        extra, missing = cursor.fetchone()
+        check(not extra and not missing, f"{name}: {extra} stale and {missing} missing rows")
+    publisher.commit()
+
+    for conn in (publisher, listener, reader):
+        conn.close()
+
+    print(json.dumps({
+        'previous_version': previous,
+        'version': version,
+        'refresh_seconds': round(refresh_seconds, 3),
+        'view_rows': row_counts,
+        'notifications': received,
+        'failures': failures,
+    }, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Exercise dags/tlc_download.py against a local stand-in for the TLC server.
+
+A threaded HTTP server serves random "parquet" files with Content-Length,
+ETag and Range support, and can cut a response short to simulate a dropped
+connection. The check downloads a range of months concurrently, re-runs to
+confirm up-to-date files are skipped, resumes an interrupted transfer from
+its .part file, and re-downloads a file whose ETag changed.
+
+Usage:
+    python scripts/check_downloader.py [--months 6] [--size-mb 8]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dags'))
+
+from tlc_download import download_months, read_manifest, trip_file_name  # noqa: E402
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves server.files ({name: bytes}) with ETag and single-range support"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _lookup(self):
+        name = self.path.rsplit('/', 1)[-1]
+        if name not in self.server.files:
+            self.send_error(404)
+            return None, None
+        return name, self.server.files[name]
+
+    def _etag(self, name):
+        return f'"{self.server.etags[name]}"'
+
+    def do_HEAD(self):
+        name, body = self._lookup()
+        if name is None:
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', self._etag(name))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+
+    def do_GET(self):
+        name, body = self._lookup()
+        if name is None:
+            return
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range', self._etag(name)) == self._etag(name):
+            start = int(range_header.split('=')[1].split('-')[0])
+        self.server.requests.append((name, start))
+
+        if start:
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(body) - 1}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body) - start))
+        self.send_header('ETag', self._etag(name))
+        self.end_headers()
+
+        # Drop the connection part way through if asked to
+        cut = self.server.cut_after.pop(name, None)
+        payload = body[start:cut] if cut is not None else body[start:]
+        self.wfile.write(payload)
+        if cut is not None:
+            self.close_connection = True
+
+
+def start_server(files):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.files = files
+    server.etags = {name: hashlib.md5(body).hexdigest() for name, body in files.items()}
+    server.cut_after = {}
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--months', type=int, default=6)
+    parser.add_argument('--size-mb', type=int, default=8)
+    args = parser.parse_args()
+
+    months = [(2024, month) for month in range(1, args.months + 1)]
+    files = {trip_file_name(year, month): os.urandom(args.size_mb * 1024 * 1024) for year, month in months}
+    server = start_server(files)
+    base_url = f"http://127.0.0.1:{server.server_port}/trip-data"
+    dest_dir = tempfile.mkdtemp()
+    results = {}
+
+    def matches_server(name):
+        with open(os.path.join(dest_dir, name), 'rb') as f:
+            on_disk = hashlib.sha256(f.read()).hexdigest()
+        return on_disk == hashlib.sha256(files[name]).hexdigest() == read_manifest(dest_dir)[name]['sha256']
+
+    # 1. Fresh concurrent download
+    reports = download_months(months, dest_dir, base_url=base_url, max_workers=4)
+    results['fresh'] = {
+        'ok': all(matches_server(name) for name in files),
+        'mb_per_sec': [round(report['bytes_per_sec'] / 1e6, 1) for report in reports],
+    }
+
+    # 2. Everything is up to date, nothing is fetched
+    server.requests.clear()
+    reports = download_months(months, dest_dir, base_url=base_url)
+    results['skip'] = {'ok': all(report['skipped'] for report in reports) and not server.requests}
+
+    # 3. A dropped connection leaves a .part file that the next run resumes
+    name = trip_file_name(*months[0])
+    os.remove(os.path.join(dest_dir, name))
+    half = len(files[name]) // 2
+    server.cut_after[name] = half
+    try:
+        download_months(months[:1], dest_dir, base_url=base_url)
+        interrupted = False
+    except Exception:
+        interrupted = True
+    part_path = os.path.join(dest_dir, name + '.part')
+    resumed_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    server.requests.clear()
+    reports = download_months(months[:1], dest_dir, base_url=base_url)
+    results['resume'] = {
+        'ok': interrupted and resumed_from > 0 and server.requests == [(name, resumed_from)]
+              and reports[0]['bytes'] == len(files[name]) - resumed_from
+              and matches_server(name) and not os.path.exists(part_path),
+        'resumed_from': resumed_from,
+    }
+
+    # 4. A file that changed on the server is downloaded again
+    files[name] = os.urandom(len(files[name]))
+    server.etags[name] = hashlib.md5(files[name]).hexdigest()
+    reports = download_months(months[:1], dest_dir, base_url=base_url)
+    results['changed'] = {'ok': not reports[0]['skipped'] and matches_server(name)}
+
+    server.shutdown()
+    print(json.dumps(results, indent=2))
+    sys.exit(0 if all(result['ok'] for result in results.values()) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Check that the PySpark and PyArrow cleaning engines agree.
+
+Runs clean_trips_spark and clean_trips_arrow over the same parquet file and
+compares row counts, per-rule reject counts, the number of rejected rows
+per reject_reasons bitmask, and aggregates. Without a file
+argument a small synthetic yellow_tripdata fixture (including invalid and
+out-of-month rows) is used.
+
+Usage:
+    python scripts/check_engine_parity.py [path/to/yellow_tripdata_YYYY-MM.parquet]
+"""
+import math
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dags'))
+
+from trip_processing import (  # noqa: E402
+    REJECT_REASONS_COLUMN,
+    TRIP_RULES,
+    clean_trips_spark,
+    derive_trips_spark,
+    iter_clean_batches,
+    reject_reasons_spark,
+    spark_trip_stats,
+)
+
+START = datetime(2025, 4, 1)
+END = datetime(2025, 5, 1)
+
+SUM_COLUMNS = [
+    'trip_distance',
+    'fare_amount',
+    'tip_amount',
+    'total_amount',
+    'trip_duration_minutes',
+    'tip_percentage',
+]
+
+
+def write_fixture(path, rows=20000, seed=42):
+    """Write a small yellow_tripdata-style parquet file with some bad rows"""
+    import random
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rng = random.Random(seed)
+    pickups, dropoffs = [], []
+    for _ in range(rows):
+        # A few trips fall outside the month, some have null timestamps
+        pickup = START - timedelta(days=1) + timedelta(seconds=rng.randint(0, 32 * 86400))
+        duration = timedelta(seconds=rng.randint(-60, 4 * 3600))
+        pickups.append(None if rng.random() < 0.01 else pickup)
+        dropoffs.append(None if rng.random() < 0.01 else pickup + duration)
+
+    def amount(low, high):
+        return [None if rng.random() < 0.01 else rng.uniform(low, high) for _ in range(rows)]
+
+    table = pa.table({
+        'tpep_pickup_datetime': pa.array(pickups, pa.timestamp('us')),
+        'tpep_dropoff_datetime': pa.array(dropoffs, pa.timestamp('us')),
+        'PULocationID': pa.array([rng.randint(1, 265) for _ in range(rows)], pa.int32()),
+        'DOLocationID': pa.array([rng.randint(1, 265) for _ in range(rows)], pa.int32()),
+        'trip_distance': pa.array(amount(-1, 30), pa.float64()),
+        'fare_amount': pa.array(amount(-5, 120), pa.float64()),
+        'tip_amount': pa.array(amount(0, 25), pa.float64()),
+        'total_amount': pa.array(amount(-5, 160), pa.float64()),
+        'payment_type': pa.array([rng.randint(0, 4) for _ in range(rows)], pa.int64()),
+    })
+    pq.write_table(table, path)
+
+
+def spark_aggregates(input_file):
+    from pyspark.sql import SparkSession
+    from pyspark.sql import functions as F
+
+    spark = SparkSession.builder \
+        .appName("NYC_Taxi_Engine_Parity") \
+        .config("spark.master", "local[*]") \
+        .getOrCreate()
+    try:
+        raw_df = spark.read.parquet(input_file)
+        df = clean_trips_spark(raw_df, START, END)
+        row = df.agg(
+            F.count(F.lit(1)).alias('rows'),
+            *[F.sum(column).alias(column) for column in SUM_COLUMNS]
+        ).collect()[0]
+        totals = {key: float(value or 0) for key, value in row.asDict().items()}
+        rejects = spark_trip_stats(derive_trips_spark(raw_df), START, END)['rejects_by_rule']
+        totals.update({name: float(count) for name, count in rejects.items()})
+        reasons = derive_trips_spark(raw_df) \
+            .withColumn(REJECT_REASONS_COLUMN, reject_reasons_spark(START, END)) \
+            .filter(F.col(REJECT_REASONS_COLUMN) != 0) \
+            .groupBy(REJECT_REASONS_COLUMN).count().collect()
+        totals.update({f"reasons={row[0]}": float(row[1]) for row in reasons})
+        return totals
+    finally:
+        spark.stop()
+
+
+def arrow_aggregates(input_file):
+    import pyarrow.compute as pc
+
+    totals = dict.fromkeys(['rows'] + SUM_COLUMNS, 0.0)
+    rejects, quarantine = {}, []
+    for _, table in iter_clean_batches(input_file, START, END, batch_size=4096, reject_counts=rejects,
+                                       quarantine=quarantine):
+        totals['rows'] += table.num_rows
+        for column in SUM_COLUMNS:
+            totals[column] += pc.sum(table[column]).as_py() or 0.0
+    totals.update({name: float(rejects.get(name, 0)) for name in TRIP_RULES})
+    for table in quarantine:
+        for reasons, count in zip(*np.unique(table[REJECT_REASONS_COLUMN].to_numpy(), return_counts=True)):
+            key = f"reasons={reasons}"
+            totals[key] = totals.get(key, 0.0) + float(count)
+    return totals
+
+
+def main():
+    if len(sys.argv) > 1:
+        input_file = sys.argv[1]
+    else:
+        input_file = os.path.join(tempfile.mkdtemp(), 'yellow_tripdata_2025-04.parquet')
+        write_fixture(input_file)
+
+    spark_totals = spark_aggregates(input_file)
+    arrow_totals = arrow_aggregates(input_file)
+
+    failures = 0
+    reason_keys = sorted({key for key in [*spark_totals, *arrow_totals] if key.startswith('reasons=')},
+                         key=lambda key: int(key.split('=')[1]))
+    for key in ['rows'] + SUM_COLUMNS + TRIP_RULES + reason_keys:
+        spark_value, arrow_value = spark_totals.get(key, 0.0), arrow_totals.get(key, 0.0)
+        ok = math.isclose(spark_value, arrow_value, rel_tol=1e-9, abs_tol=1e-6)
+        failures += not ok
+        print(f"{key:24s} spark={spark_value:<20.2f} arrow={arrow_value:<20.2f} {'OK' if ok else 'MISMATCH'}")
+
+    if failures:
+        print(f"{failures} aggregate(s) differ between engines")
+        sys.exit(1)
+    print("Engines agree")
+
+
+if __name__ == '__main__':
+    main()
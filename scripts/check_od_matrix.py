@@ -0,0 +1,142 @@
+"""
+Check the origin-destination matrix against the raw taxi_trips table.
+
+Builds the OD matrix for one month from taxi_trips (read in batches, as the
+DAG reads the lake), writes it to trip_od_matrix, then for the busiest
+pickup zones and a few hours of the week compares each destination's trips,
+revenue and median duration with a GROUP BY over taxi_trips, and reports
+build time and lookup latency for both.
+
+Usage:
+    DATABASE_URL=postgresql://... python scripts/check_od_matrix.py --month 2025-04
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+
+import psycopg2
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_ROOT, 'dags'))
+
+from od_matrix import OD_COLUMNS, build_od_matrix, write_od_matrix  # noqa: E402
+from pipeline_db import iter_rows  # noqa: E402
+
+# Monday to Friday, 8am
+WEEKDAY_8AM = [day * 24 + 8 for day in range(5)]
+
+LOOKUP_SQL = """
+    SELECT d.dropoff_location_id, d.trips, d.revenue, d.median_duration_minutes
+    FROM trip_od_matrix m
+    CROSS JOIN LATERAL unnest(m.dropoff_location_ids, m.trips, m.revenue, m.median_duration_minutes)
+        AS d(dropoff_location_id, trips, revenue, median_duration_minutes)
+    WHERE m.month = %(month)s AND m.pickup_location_id = %(origin)s AND m.hour_of_week = %(hour)s
+"""
+
+RAW_SQL = """
+    SELECT dropoff_location_id, COUNT(*), SUM(total_cents) / 100.0,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY trip_duration_minutes)
+    FROM taxi_trips
+    WHERE pickup_datetime >= %(month)s AND pickup_datetime < %(month)s::date + INTERVAL '1 month'
+      AND pickup_location_id = %(origin)s
+      AND dropoff_location_id BETWEEN 1 AND 265
+      AND (EXTRACT(ISODOW FROM pickup_datetime) - 1) * 24 + EXTRACT(HOUR FROM pickup_datetime) = %(hour)s
+    GROUP BY dropoff_location_id
+"""
+
+
+def month_batches(database_url, month, batch_rows=100000):
+    """Yield the month's trips from taxi_trips as Arrow record batches"""
+    import pyarrow as pa
+
+    # taxi_trips stores amounts in cents
+    select = ', '.join('total_cents / 100.0' if column == 'total_amount' else column for column in OD_COLUMNS)
+    for rows in iter_rows(
+        f"SELECT {select} FROM taxi_trips "
+        "WHERE pickup_datetime >= %s AND pickup_datetime < %s::date + INTERVAL '1 month'",
+        (month, month),
+        itersize=batch_rows,
+        database_url=database_url,
+        name='od_matrix_check',
+    ):
+        columns = list(zip(*rows))
+        yield pa.record_batch([
+            pa.array(columns[0], pa.timestamp('us')),
+            pa.array(columns[1], pa.int32()),
+            pa.array(columns[2], pa.int32()),
+            pa.array([None if value is None else float(value) for value in columns[3]], pa.float64()),
+            pa.array(columns[4], pa.int32()),
+        ], names=OD_COLUMNS)
+
+
+def timed_groups(cursor, sql, params):
+    started = time.time()
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    elapsed_ms = (time.time() - started) * 1000
+    return {int(dropoff): (int(trips), round(float(revenue or 0), 2), float(median))
+            for dropoff, trips, revenue, median in rows}, elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--month', required=True, help='YYYY-MM')
+    parser.add_argument('--origins', type=int, default=5, help='number of busiest pickup zones to check')
+    args = parser.parse_args()
+
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is required")
+    year, month_number = (int(part) for part in args.month.split('-'))
+    month = date(year, month_number, 1)
+
+    conn = psycopg2.connect(database_url)
+    started = time.time()
+    matrix = build_od_matrix(month_batches(database_url, month))
+    build_seconds = time.time() - started
+    cursor = conn.cursor()
+    rows = write_od_matrix(cursor, month, matrix)
+    conn.commit()
+
+    cursor.execute(
+        "SELECT pickup_location_id FROM taxi_trips "
+        "WHERE pickup_datetime >= %s AND pickup_datetime < %s::date + INTERVAL '1 month' "
+        "GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT %s",
+        (month, month, args.origins),
+    )
+    origins = [origin for origin, in cursor.fetchall()]
+
+    checks, lookup_ms, raw_ms = 0, [], []
+    mismatched = []
+    for origin in origins:
+        for hour in WEEKDAY_8AM:
+            params = {'month': month, 'origin': origin, 'hour': hour}
+            stored, stored_elapsed = timed_groups(cursor, LOOKUP_SQL, params)
+            raw, raw_elapsed = timed_groups(cursor, RAW_SQL, params)
+            lookup_ms.append(stored_elapsed)
+            raw_ms.append(raw_elapsed)
+            checks += 1
+            if stored != raw:
+                mismatched.append(f"origin {origin} hour {hour}")
+    conn.close()
+
+    print(json.dumps({
+        'month': args.month,
+        'trips': int(matrix['trips'].sum()),
+        'skipped_trips': matrix['skipped'],
+        'occupied_cells': int((matrix['trips'] > 0).sum()),
+        'rows_written': rows,
+        'build_seconds': round(build_seconds, 2),
+        'lookups_checked': checks,
+        'lookup_ms_avg': round(sum(lookup_ms) / len(lookup_ms), 2) if lookup_ms else None,
+        'raw_ms_avg': round(sum(raw_ms) / len(raw_ms), 2) if raw_ms else None,
+        'mismatched': mismatched[:10],
+    }, indent=2))
+    sys.exit(1 if mismatched else 0)
+
+
+if __name__ == '__main__':
+    main()
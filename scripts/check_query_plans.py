@@ -0,0 +1,153 @@
+"""
+Check that the analytics queries over taxi_trips use the pipeline's indexes.
+
+Runs EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) on the queries the web app and
+the DAG run against raw trips (latest trips of a day, a day's trips and
+revenue by zone, a week's stats, one zone's trips of the month) and checks
+that each plan scans taxi_trips through one of the expected indexes of
+TAXI_TRIPS_INDEXES, by name suffix. Reports per query the scans used, heap
+fetches of index-only scans, buffers touched and execution time; exits 1 if
+a query falls back to other scans.
+
+Usage:
+    DATABASE_URL=postgresql://... python scripts/check_query_plans.py --month 2025-04 [--zone 132]
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+import psycopg2
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_ROOT, 'dags'))
+
+# (name, query, index suffixes any of which the plan should use)
+CHECKS = [
+    ('latest_trips', """
+        SELECT pickup_datetime, dropoff_datetime, pickup_location_id, dropoff_location_id,
+               trip_distance, fare_cents / 100.0, tip_cents / 100.0, total_cents / 100.0, payment_type,
+               trip_duration_minutes, tip_percentage
+        FROM taxi_trips
+        WHERE pickup_datetime >= %(day)s AND pickup_datetime <= %(day_end)s
+        ORDER BY pickup_datetime DESC
+        LIMIT 1000
+    """, ['pickup_covering']),
+    ('day_pickup_zones', """
+        SELECT pickup_location_id, COUNT(*), SUM(total_cents)
+        FROM taxi_trips
+        WHERE pickup_datetime >= %(day)s AND pickup_datetime < %(day_end)s
+        GROUP BY pickup_location_id
+    """, ['pickup_covering']),
+    ('day_dropoff_zones', """
+        SELECT dropoff_location_id, COUNT(*), SUM(total_cents)
+        FROM taxi_trips
+        WHERE pickup_datetime >= %(day)s AND pickup_datetime < %(day_end)s
+        GROUP BY dropoff_location_id
+    """, ['pickup_covering']),
+    ('week_stats', """
+        SELECT COUNT(*), AVG(fare_cents), AVG(tip_cents), AVG(trip_duration_minutes),
+               AVG(tip_percentage), SUM(total_cents)
+        FROM taxi_trips
+        WHERE pickup_datetime >= %(day)s AND pickup_datetime < %(week_end)s
+    """, ['pickup_brin', 'pickup_covering']),
+    ('zone_month_trips', """
+        SELECT pickup_datetime, total_cents
+        FROM taxi_trips
+        WHERE pickup_datetime >= %(month)s AND pickup_datetime < %(month_end)s
+          AND pickup_location_id = %(zone)s
+        ORDER BY pickup_datetime
+    """, ['pickup_zone']),
+]
+
+SCAN_NODES = {'Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Index Scan'}
+
+
+def scans(plan):
+    """Yield the scan nodes of an EXPLAIN (FORMAT JSON) plan tree"""
+    if plan['Node Type'] in SCAN_NODES:
+        yield plan
+    for child in plan.get('Plans', []):
+        yield from scans(child)
+
+
+def index_suffix(index_name):
+    """The TAXI_TRIPS_INDEXES suffix of a partition index name, or None"""
+    from nyc_taxi_dag import TAXI_TRIPS_INDEXES
+
+    for suffix in TAXI_TRIPS_INDEXES:
+        if index_name.endswith(f"_{suffix}_idx"):
+            return suffix
+    return None
+
+
+def explain(cursor, sql, params):
+    cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+    return cursor.fetchone()[0][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--month', required=True, help='YYYY-MM')
+    parser.add_argument('--zone', type=int, help='pickup LocationID (default: the busiest of the month)')
+    args = parser.parse_args()
+
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise ValueError("DATABASE_URL environment variable is required")
+    year, month_number = (int(part) for part in args.month.split('-'))
+    month = date(year, month_number, 1)
+    day = month + timedelta(days=14)
+    params = {
+        'month': month,
+        'month_end': date(year + month_number // 12, month_number % 12 + 1, 1),
+        'day': day,
+        'day_end': day + timedelta(days=1),
+        'week_end': day + timedelta(days=7),
+        'zone': args.zone,
+    }
+
+    conn = psycopg2.connect(database_url)
+    cursor = conn.cursor()
+    if params['zone'] is None:
+        cursor.execute(
+            "SELECT pickup_location_id FROM taxi_trips "
+            "WHERE pickup_datetime >= %(month)s AND pickup_datetime < %(month_end)s "
+            "GROUP BY 1 ORDER BY COUNT(*) DESC LIMIT 1",
+            params,
+        )
+        params['zone'] = cursor.fetchone()[0]
+
+    results, failed = {}, []
+    for name, sql, expected in CHECKS:
+        plan = explain(cursor, sql, params)
+        used = [
+            {
+                'node': node['Node Type'],
+                'relation': node.get('Relation Name'),
+                'index': node.get('Index Name'),
+                **({'heap_fetches': node['Heap Fetches']} if 'Heap Fetches' in node else {}),
+            }
+            for node in scans(plan['Plan'])
+        ]
+        # Every scan of the query, e.g. of each partition, must use an expected index
+        ok = bool(used) and all(index_suffix(scan['index'] or '') in expected for scan in used)
+        if not ok:
+            failed.append(name)
+        results[name] = {
+            'ok': ok,
+            'expected': expected,
+            'scans': used,
+            'shared_buffers': plan['Plan'].get('Shared Hit Blocks', 0) + plan['Plan'].get('Shared Read Blocks', 0),
+            'execution_ms': round(plan['Execution Time'], 2),
+        }
+    conn.close()
+
+    print(json.dumps({'month': args.month, 'day': day.isoformat(), 'zone': params['zone'],
+                      'queries': results, 'failed': failed}, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
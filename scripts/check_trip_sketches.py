@@ -0,0 +1,142 @@
+"""
+Check the daily trip sketches against exact quantiles and distinct counts.
+
+Cleans one month of trips (a yellow_tripdata parquet file, or the synthetic
+fixture from check_engine_parity.py), builds the per-day and per-zone
+sketches, round-trips them through their serialized form as stored in
+trip_sketches_daily, then merges them for the whole month and for the
+busiest zones and compares with the exact values:
+
+- the true rank of each KLL p50/p90/p99 must be within 1.33% of the
+  requested rank
+- each HLL distinct route count must be within 3.2% of the exact count
+
+Usage:
+    python scripts/check_trip_sketches.py [path/to/yellow_tripdata_YYYY-MM.parquet] [--month 2025-04]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dags'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from trip_processing import iter_clean_batches  # noqa: E402
+from trip_sketches import (  # noqa: E402
+    ALL_ZONES,
+    DISTINCT_METRIC,
+    QUANTILE_METRICS,
+    SKETCH_COLUMNS,
+    _deserialize,
+    build_daily_sketches,
+    describe_sketch,
+    merge_sketches,
+)
+
+RANKS = (0.5, 0.9, 0.99)
+RANK_ERROR = 0.0133
+DISTINCT_ERROR = 0.032
+
+
+def true_rank_error(values, quantile, rank):
+    """Distance from rank to the nearest true rank of quantile among values"""
+    low = np.searchsorted(values, quantile, side='left') / len(values)
+    high = np.searchsorted(values, quantile, side='right') / len(values)
+    return 0.0 if low <= rank <= high else min(abs(rank - low), abs(rank - high))
+
+
+def check_group(metric, sketches, exact):
+    """Compare a merged group of sketches with the exact column values"""
+    merged = merge_sketches(metric, sketches)
+    if metric == DISTINCT_METRIC:
+        true_count = len(np.unique(exact))
+        estimate = merged.get_estimate()
+        error = abs(estimate - true_count) / true_count if true_count else 0.0
+        return {'exact': true_count, 'estimate': round(estimate), 'error': round(error, 4)}, error <= DISTINCT_ERROR
+
+    values = np.sort(exact[~np.isnan(exact)])
+    described = describe_sketch(metric, merged, RANKS)
+    errors = [true_rank_error(values, quantile, rank) for rank, quantile in zip(RANKS, merged.get_quantiles(list(RANKS)))]
+    result = {
+        'count': described['count'],
+        **{name: value for name, value in described.items() if name.startswith('p')},
+        'exact': {f"p{rank * 100:g}": round(float(np.quantile(values, rank)), 2) for rank in RANKS},
+        'max_rank_error': round(max(errors), 4),
+    }
+    return result, described['count'] == len(values) and max(errors) <= RANK_ERROR
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('input_file', nargs='?')
+    parser.add_argument('--month', default='2025-04', help='YYYY-MM of the input file')
+    parser.add_argument('--zones', type=int, default=5, help='number of busiest pickup zones to check')
+    args = parser.parse_args()
+
+    year, month_number = (int(part) for part in args.month.split('-'))
+    start = datetime(year, month_number, 1)
+    end = datetime(year + month_number // 12, month_number % 12 + 1, 1)
+    input_file = args.input_file
+    if not input_file:
+        from check_engine_parity import write_fixture
+
+        input_file = os.path.join(tempfile.mkdtemp(), f"yellow_tripdata_{args.month}.parquet")
+        write_fixture(input_file, rows=200000)
+
+    import pyarrow as pa
+
+    cleaned = pa.concat_tables([table.select(SKETCH_COLUMNS) for _, table in iter_clean_batches(input_file, start, end)])
+    started = time.time()
+    sketches = build_daily_sketches(cleaned.to_batches())
+    build_seconds = time.time() - started
+
+    # Merge what would be read back from trip_sketches_daily
+    stored = {}
+    for (day, location_id, metric), sketch in sketches.items():
+        data = sketch.serialize_compact() if metric == DISTINCT_METRIC else sketch.serialize()
+        stored.setdefault((location_id, metric), []).append(_deserialize(metric, data))
+
+    def column(name, arrow_type):
+        return cleaned.column(name).cast(arrow_type).fill_null(-1).to_numpy()
+
+    pickup = column('pickup_location_id', pa.int64())
+    dropoff = column('dropoff_location_id', pa.int64())
+    zones, counts = np.unique(pickup[pickup > 0], return_counts=True)
+    checked_zones = [ALL_ZONES] + zones[np.argsort(-counts)][:args.zones].tolist()
+
+    results, failed = {}, []
+    for location_id in checked_zones:
+        rows = np.ones(len(pickup), dtype=bool) if location_id == ALL_ZONES else pickup == location_id
+        results[location_id] = {}
+        for metric in (*QUANTILE_METRICS, DISTINCT_METRIC):
+            if metric == DISTINCT_METRIC:
+                routed = rows & (pickup > 0) & (dropoff > 0)
+                exact = pickup[routed] * 1000 + dropoff[routed]
+            else:
+                exact = cleaned.column(metric).cast(pa.float64()).fill_null(float('nan')).to_numpy()[rows]
+            result, ok = check_group(metric, stored.get((location_id, metric), []), exact)
+            results[location_id][metric] = result
+            if not ok:
+                failed.append(f"zone {location_id} {metric}")
+
+    size = sum(len(sketch.serialize_compact() if metric == DISTINCT_METRIC else sketch.serialize())
+               for (_, _, metric), sketch in sketches.items())
+    print(json.dumps({
+        'trips': cleaned.num_rows,
+        'sketches': len(sketches),
+        'serialized_kb': round(size / 1024, 1),
+        'build_seconds': round(build_seconds, 2),
+        'zones': results,
+        'failed': failed,
+    }, indent=2))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
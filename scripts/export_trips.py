@@ -0,0 +1,62 @@
+"""
+Export trips from taxi_trips to chunked Parquet or CSV.gz files.
+
+Runs dags/trip_export.py outside Airflow for an ad-hoc extract: the trips
+picked up in [--start, --end), optionally only in some pickup zones, are
+streamed out of Postgres with COPY ... TO STDOUT and written to --out in
+files of at most --file-rows trips. Memory stays flat however long the range;
+the script reports the files, the trips written and its peak RSS. With
+--publish MONTH the month is instead published with its manifest entry, as
+the DAG's export_trips_task does.
+
+Usage:
+    SUPABASE_DATABASE_URL=postgresql://... python scripts/export_trips.py \
+        --start 2025-04-01 --end 2025-05-01 [--zones 132,138] [--format parquet,csv.gz] [--out exports]
+    SUPABASE_DATABASE_URL=postgresql://... python scripts/export_trips.py --publish 2025-04 [--out public/exports]
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import time
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_ROOT, 'dags'))
+
+from trip_export import EXPORT_FORMATS, FILE_ROWS, export_trips, publish_month_extracts  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--start', help='first pickup date (inclusive), YYYY-MM-DD')
+    parser.add_argument('--end', help='last pickup date (exclusive), YYYY-MM-DD')
+    parser.add_argument('--zones', help='comma-separated pickup LocationIDs (default: all)')
+    parser.add_argument('--format', default=','.join(EXPORT_FORMATS), help='comma-separated: parquet, csv.gz')
+    parser.add_argument('--file-rows', type=int, default=FILE_ROWS, help='trips per file')
+    parser.add_argument('--publish', metavar='YYYY-MM', help='publish one month with its manifest entry')
+    parser.add_argument('--out', default=os.path.join(REPO_ROOT, 'public', 'exports'))
+    args = parser.parse_args()
+
+    formats = args.format.split(',')
+    started = time.time()
+    if args.publish:
+        year, month = (int(part) for part in args.publish.split('-'))
+        files = publish_month_extracts(year, month, formats, args.out, args.file_rows)['files']
+    elif args.start and args.end:
+        zones = [int(zone) for zone in args.zones.split(',')] if args.zones else None
+        files = export_trips(args.out, args.start, args.end, zones, formats, args.file_rows)
+    else:
+        parser.error('either --start and --end, or --publish, is required')
+
+    print(json.dumps({
+        'files': files,
+        'trips': {export_format: sum(part['rows'] for part in parts) for export_format, parts in files.items()},
+        'seconds': round(time.time() - started, 1),
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
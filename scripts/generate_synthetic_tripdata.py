@@ -0,0 +1,288 @@
+"""
+Generate a synthetic TLC trip parquet file for offline benchmarks.
+
+The file has the raw schema of a TLC feed (yellow by default; green, fhv or
+fhvhv with --feed, see dags/tlc_feeds.py) and one month of trips with
+realistic shapes rather than uniform noise:
+
+- pickup and dropoff zones drawn from the LocationIDs in
+  taxi_zone_lookup.csv, weighted by borough (Manhattan and the airports
+  dominate, as in the real data) and skewed within each borough; most
+  dropoffs stay in the pickup's borough
+- pickups following a daily profile (quiet at 4-5am, busiest 5-8pm) with
+  fewer trips on Sundays
+- log-normal trip distances, durations from an hour-dependent speed, fares
+  from the metered rate, and tips mostly on card payments
+- about 3% of rows that the pipeline rejects: missing pickup times,
+  non-positive distance or fare, negative or overlong durations, and
+  pickups just outside the month
+
+Other feeds get the same trips in their own columns: FHV files keep only
+times and zones, and FHVHV fares are split into the base fare and the fees
+that make up the rider's total.
+
+Rows are generated and written one row group at a time, so 50M-row files
+need little memory.
+
+Usage:
+    python scripts/generate_synthetic_tripdata.py --rows 10M --month 2025-04 [--feed fhvhv] [--out /tmp/tripdata]
+"""
+import argparse
+import csv
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ZONE_LOOKUP_FILE = os.path.join(REPO_ROOT, 'data', 'zones', 'taxi_zone_lookup.csv')
+
+ROW_GROUP_ROWS = 1_000_000
+
+# Relative pickup volume per borough
+BOROUGH_WEIGHTS = {
+    'Manhattan': 85.0,
+    'Queens': 8.0,
+    'Brooklyn': 3.5,
+    'Bronx': 1.0,
+    'Staten Island': 0.05,
+    'EWR': 0.1,
+    'Unknown': 0.5,
+    'N/A': 0.2,
+}
+# JFK and LaGuardia alone are a few percent of yellow trips
+AIRPORT_WEIGHTS = {132: 4.0, 138: 3.0}
+# Share of dropoffs in the pickup's borough
+SAME_BOROUGH_SHARE = 0.8
+
+# Share of pickups per hour of the day
+HOURLY_PROFILE = np.array([
+    2.6, 1.7, 1.1, 0.7, 0.5, 0.6, 1.5, 2.9, 3.9, 4.1, 4.2, 4.5,
+    4.8, 4.9, 5.3, 5.6, 5.8, 6.4, 6.9, 6.6, 5.8, 5.5, 5.0, 3.9,
+])
+# Relative volume Monday..Sunday
+WEEKDAY_PROFILE = np.array([0.9, 1.0, 1.05, 1.1, 1.1, 1.05, 0.8])
+# Typical speed (mph) per hour of the day
+HOURLY_SPEED = np.array([
+    16, 17, 18, 19, 19, 18, 15, 12, 10, 10, 10, 10,
+    10, 10, 10, 9.5, 9.5, 9.5, 10, 11, 12, 13, 14, 15,
+])
+
+# payment_type: 1 credit card, 2 cash, 3 no charge, 4 dispute, 0 unknown
+PAYMENT_TYPES = np.array([1, 2, 3, 4, 0])
+PAYMENT_WEIGHTS = np.array([0.76, 0.17, 0.01, 0.01, 0.05])
+
+INVALID_SHARE = 0.03
+
+
+def parse_rows(value):
+    """'50M', '500k' or '1000000' as a row count"""
+    value = value.strip().lower()
+    scale = {'k': 1_000, 'm': 1_000_000}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale > 1 else value) * scale)
+
+
+def load_zones(zone_lookup_file=ZONE_LOOKUP_FILE, seed=0):
+    """LocationIDs, their boroughs, and pickup weights (borough volume times a within-borough skew)"""
+    with open(zone_lookup_file, newline='') as f:
+        rows = [(int(row['LocationID']), row['Borough']) for row in csv.DictReader(f)]
+    rng = np.random.default_rng(seed)
+    ids = np.array([location_id for location_id, _ in rows])
+    boroughs = np.array([borough for _, borough in rows])
+    weights = np.empty(len(rows))
+    for borough in np.unique(boroughs):
+        members = boroughs == borough
+        # A few busy zones and a long tail within each borough
+        skew = rng.lognormal(0.0, 0.7, members.sum())
+        weights[members] = BOROUGH_WEIGHTS.get(borough, 0.5) * skew / skew.sum()
+    for location_id, weight in AIRPORT_WEIGHTS.items():
+        weights[ids == location_id] = weight
+    return ids, boroughs, weights / weights.sum()
+
+
+def _pickup_times(rng, rows, start, end):
+    """Pickup timestamps (microseconds since the epoch) following the daily and weekly profiles"""
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D'))
+    # 1970-01-01 was a Thursday
+    weekday = (days.astype(np.int64) + 3) % 7
+    day_weights = WEEKDAY_PROFILE[weekday]
+    day = rng.choice(days.astype(np.int64), rows, p=day_weights / day_weights.sum())
+    hour = rng.choice(24, rows, p=HOURLY_PROFILE / HOURLY_PROFILE.sum())
+    seconds = day * 86400 + hour * 3600 + rng.integers(0, 3600, rows)
+    return seconds * 1_000_000, hour
+
+
+def generate_row_group(rng, rows, start, end, zones):
+    """One row group of synthetic trips as a pyarrow Table"""
+    import pyarrow as pa
+
+    ids, boroughs, weights = zones
+    pickup_us, hour = _pickup_times(rng, rows, start, end)
+
+    pickup_index = rng.choice(len(ids), rows, p=weights)
+    # Most trips end in the pickup's borough; the rest anywhere
+    dropoff_index = rng.choice(len(ids), rows, p=weights)
+    same_borough = rng.random(rows) < SAME_BOROUGH_SHARE
+    for borough in np.unique(boroughs):
+        members = np.flatnonzero(boroughs == borough)
+        chosen = same_borough & (boroughs[pickup_index] == borough)
+        borough_weights = weights[members] / weights[members].sum()
+        dropoff_index[chosen] = members[rng.choice(len(members), chosen.sum(), p=borough_weights)]
+    pickup, dropoff = ids[pickup_index], ids[dropoff_index]
+
+    airport = np.isin(pickup, list(AIRPORT_WEIGHTS)) | np.isin(dropoff, list(AIRPORT_WEIGHTS))
+    distance = np.where(
+        airport, rng.normal(17.0, 3.0, rows).clip(8.0, 30.0), rng.lognormal(0.55, 0.75, rows).clip(0.1, 40.0)
+    )
+    speed = HOURLY_SPEED[hour] * rng.lognormal(0.0, 0.25, rows)
+    duration_seconds = (distance / speed * 3600 + rng.integers(60, 240, rows)).astype(np.int64)
+    dropoff_us = pickup_us + duration_seconds * 1_000_000
+
+    # Metered rate: $3 flag drop, $0.70 per 1/5 mile, and $0.70 per minute
+    # spent below 12 mph; JFK trips are a flat fare
+    fare = 3.0 + 3.5 * distance + 0.7 * np.maximum(duration_seconds / 60 - distance * 5, 0)
+    jfk = (pickup == 132) | (dropoff == 132)
+    fare = np.where(jfk, 70.0, fare).round(2)
+    payment = rng.choice(PAYMENT_TYPES, rows, p=PAYMENT_WEIGHTS)
+    tip_rate = rng.choice([0.0, 0.15, 0.2, 0.25, 0.3], rows, p=[0.15, 0.15, 0.4, 0.2, 0.1])
+    tip = np.where(payment == 1, fare * tip_rate * rng.lognormal(0.0, 0.1, rows), 0.0).round(2)
+    extra = np.where((hour >= 20) | (hour < 6), 1.0, 0.0) + np.where((hour >= 16) & (hour < 20), 2.5, 0.0)
+    tolls = np.where(airport & (rng.random(rows) < 0.4), 6.94, 0.0)
+    congestion = np.where(np.isin(boroughs[dropoff_index], ['Manhattan']), 2.5, 0.0)
+    airport_fee = np.where(np.isin(pickup, list(AIRPORT_WEIGHTS)), 1.75, 0.0)
+    total = (fare + extra + 0.5 + tip + tolls + 1.0 + congestion + airport_fee).round(2)
+
+    # Rows the pipeline rejects
+    invalid = np.flatnonzero(rng.random(rows) < INVALID_SHARE)
+    kind = rng.integers(0, 5, len(invalid))
+    pickup_valid = np.ones(rows, dtype=bool)
+    pickup_valid[invalid[kind == 0]] = False
+    distance[invalid[kind == 1]] = 0.0
+    fare[invalid[kind == 2]] = -fare[invalid[kind == 2]]
+    total[invalid[kind == 2]] = -total[invalid[kind == 2]]
+    late = invalid[kind == 3]
+    dropoff_us[late] = pickup_us[late] + rng.choice([-120, 6 * 3600], len(late)) * 1_000_000
+    shifted = invalid[kind == 4]
+    pickup_us[shifted] -= 40 * 86400 * 1_000_000
+    dropoff_us[shifted] -= 40 * 86400 * 1_000_000
+
+    columns = {
+        'VendorID': pa.array(rng.choice([1, 2], rows, p=[0.25, 0.75]).astype(np.int32)),
+        'tpep_pickup_datetime': pa.array(pickup_us, pa.timestamp('us'), mask=~pickup_valid),
+        'tpep_dropoff_datetime': pa.array(dropoff_us, pa.timestamp('us')),
+        'passenger_count': pa.array(rng.choice([1, 2, 3, 4, 5, 6], rows, p=[0.74, 0.15, 0.04, 0.02, 0.03, 0.02])),
+        'trip_distance': pa.array(distance.round(2)),
+        'RatecodeID': pa.array(np.where(jfk, 2, 1)),
+        'store_and_fwd_flag': pa.array(np.where(rng.random(rows) < 0.005, 'Y', 'N')),
+        'PULocationID': pa.array(pickup.astype(np.int32)),
+        'DOLocationID': pa.array(dropoff.astype(np.int32)),
+        'payment_type': pa.array(payment.astype(np.int64)),
+        'fare_amount': pa.array(fare),
+        'extra': pa.array(extra),
+        'mta_tax': pa.array(np.full(rows, 0.5)),
+        'tip_amount': pa.array(tip),
+        'tolls_amount': pa.array(tolls),
+        'improvement_surcharge': pa.array(np.full(rows, 1.0)),
+        'total_amount': pa.array(total),
+        'congestion_surcharge': pa.array(congestion),
+        'Airport_fee': pa.array(airport_fee),
+    }
+    return pa.table(columns)
+
+
+def as_feed(table, feed):
+    """A row group of yellow trips in another feed's raw columns"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    rows = table.num_rows
+    if feed == 'yellow':
+        return table
+    if feed == 'green':
+        columns = {
+            name.replace('tpep_', 'lpep_'): table.column(name)
+            for name in table.column_names if name != 'Airport_fee'
+        }
+        columns['ehail_fee'] = pa.nulls(rows, pa.float64())
+        columns['trip_type'] = pa.array(np.ones(rows, dtype=np.int64))
+        return pa.table(columns)
+    if feed == 'fhv':
+        return pa.table({
+            'dispatching_base_num': pa.array(np.full(rows, 'B03404')),
+            'pickup_datetime': table.column('tpep_pickup_datetime'),
+            'dropOff_datetime': table.column('tpep_dropoff_datetime'),
+            'PUlocationID': pc.cast(table.column('PULocationID'), pa.float64()),
+            'DOlocationID': pc.cast(table.column('DOLocationID'), pa.float64()),
+            'SR_Flag': pa.nulls(rows, pa.int32()),
+            'Affiliated_base_number': pa.array(np.full(rows, 'B03404')),
+        })
+    if feed == 'fhvhv':
+        fare = table.column('fare_amount').to_numpy()
+        pickup = table.column('tpep_pickup_datetime')
+        dropoff = table.column('tpep_dropoff_datetime')
+        return pa.table({
+            'hvfhs_license_num': pa.array(np.where(np.arange(rows) % 4 == 0, 'HV0005', 'HV0003')),
+            'dispatching_base_num': pa.array(np.full(rows, 'B03404')),
+            'request_datetime': pickup,
+            'pickup_datetime': pickup,
+            'dropoff_datetime': dropoff,
+            'PULocationID': table.column('PULocationID'),
+            'DOLocationID': table.column('DOLocationID'),
+            'trip_miles': table.column('trip_distance'),
+            'trip_time': pc.cast(pc.seconds_between(pickup, dropoff), pa.int64()),
+            'base_passenger_fare': table.column('fare_amount'),
+            'tolls': table.column('tolls_amount'),
+            'bcf': pa.array((np.abs(fare) * 0.0275).round(2)),
+            'sales_tax': pa.array((np.abs(fare) * 0.08875).round(2)),
+            'congestion_surcharge': table.column('congestion_surcharge'),
+            'airport_fee': table.column('Airport_fee'),
+            'tips': table.column('tip_amount'),
+            'driver_pay': pa.array((np.abs(fare) * 0.7).round(2)),
+            'shared_request_flag': pa.array(np.full(rows, 'N')),
+        })
+    raise ValueError(f"Unknown feed: {feed}")
+
+
+def write_synthetic_month(path, rows, year, month, seed=42, zone_lookup_file=ZONE_LOOKUP_FILE,
+                          row_group_rows=ROW_GROUP_ROWS, feed='yellow'):
+    """Write `rows` synthetic trips of a feed for one month to a parquet file at path"""
+    import pyarrow.parquet as pq
+
+    start = datetime(year, month, 1)
+    end = datetime(year + month // 12, month % 12 + 1, 1)
+    zones = load_zones(zone_lookup_file, seed)
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    writer = None
+    try:
+        for offset in range(0, rows, row_group_rows):
+            table = as_feed(generate_row_group(rng, min(row_group_rows, rows - offset), start, end, zones), feed)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression='zstd')
+            writer.write_table(table, row_group_size=row_group_rows)
+    finally:
+        if writer is not None:
+            writer.close()
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', default='1M', help="row count, e.g. 1M, 10M, 50M")
+    parser.add_argument('--month', default='2025-04', help='YYYY-MM')
+    parser.add_argument('--feed', default='yellow', choices=['yellow', 'green', 'fhv', 'fhvhv'])
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--out', default='.', help='output directory')
+    args = parser.parse_args()
+
+    year, month = (int(part) for part in args.month.split('-'))
+    rows = parse_rows(args.rows)
+    path = os.path.join(args.out, f"{args.feed}_tripdata_{args.month}.parquet")
+    started = time.time()
+    write_synthetic_month(path, rows, year, month, args.seed, feed=args.feed)
+    print(f"Wrote {rows} rows to {path} ({os.path.getsize(path) / 2**20:.1f} MiB) in {time.time() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()